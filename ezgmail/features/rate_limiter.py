@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+#
+# rate_limiter.py
+#
+# [概要]
+# Google の API を呼び出す回数を制限する(レート制限)プログラム
+#
+# API ごとにトークンバケットを1つ用意し，呼び出しのたびにトークンを
+# 1つ消費する．トークンは rate 個/秒 で補充され，capacity 個まで貯まる．
+# トークンが無い場合は補充されるまで待つので，
+# 固定の time.sleep() を入れなくても利用上限を超えない．
+#
+# ・優先度: "high" / "normal" / "low" の順にトークンを受け取る
+#   (同じ優先度の中では先に待ち始めた順)
+# ・適応的な減速: 429 や利用上限のエラーが返ってきたら
+#   rate を半分にして少し待ってから送り直し，成功が続くと元に戻す
+# ・監視用のカウンタ: stats() で呼び出し回数・待ち時間などを返す
+#
+# get_rate_limiter(name) は同じ名前なら同じインスタンスを返すので，
+# 同じプロセス内の複数の処理(スレッド)で利用上限を分け合える．
+#
+
+from logging import getLogger
+import heapq
+import itertools
+import threading
+import time
+
+# 専用のロガーを作成
+logger = getLogger(__name__)
+
+# 名前 -> RateLimiter(プロセス内で共有する)
+_RATE_LIMITERS = {}
+_RATE_LIMITERS_LOCK = threading.Lock()
+
+
+class RateLimiter:
+    PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+    # 送り直せば通る(一時的な)利用上限のエラー
+    QUOTA_REASONS = (
+        "rateLimitExceeded", "userRateLimitExceeded", "RESOURCE_EXHAUSTED"
+    )
+
+    def __init__(self, name, rate, capacity=1, min_rate_ratio=0.1):
+        assert rate > 0, "rateは正の数で指定"
+        assert capacity >= 1, "capacityは1以上で指定"
+
+        self.name = name
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.min_rate_ratio = min_rate_ratio
+
+        self._tokens = float(capacity)
+        self._last_refill = time.monotonic()
+        self._pause_until = 0.0
+        self._condition = threading.Condition()
+        # 待っている呼び出し(優先度, 到着順)のヒープ
+        self._waiters = []
+        self._sequence = itertools.count()
+
+        # 監視用のカウンタ
+        self.acquired = {priority: 0 for priority in self.PRIORITIES}
+        self.waited_seconds = 0.0
+        self.throttled = 0
+        self.timeouts = 0
+
+    def _refill(self, now):
+        elapsed = now - self._last_refill
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._last_refill = now
+
+    def _try_take(self, tokens, now):
+        '''
+        [概要]
+        トークンを取れたら 0 を，取れなければあと何秒待てばよいかを返すメソッド
+        '''
+        self._refill(now)
+        if now < self._pause_until:
+            return self._pause_until - now
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return 0.0
+        return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens=1, priority="normal", timeout=None):
+        '''
+        [概要]
+        トークンを受け取るまで待つメソッド
+        優先度の高い呼び出しから順にトークンを受け取る
+        timeout 秒以内に受け取れなければ False を返す
+        '''
+        assert priority in self.PRIORITIES, \
+            f"priorityは {list(self.PRIORITIES)} のどれかで指定"
+        assert tokens <= self.capacity, "tokensはcapacity以下で指定"
+
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+        ticket = (self.PRIORITIES[priority], next(self._sequence))
+        with self._condition:
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = None
+                    if self._waiters[0] == ticket:
+                        wait = self._try_take(tokens, now)
+                        if wait == 0:
+                            heapq.heappop(self._waiters)
+                            self.acquired[priority] += 1
+                            self.waited_seconds += now - start
+                            # 次の呼び出しに順番が来たことを知らせる
+                            self._condition.notify_all()
+                            return True
+
+                    if deadline is not None:
+                        remaining = deadline - now
+                        if remaining <= 0:
+                            self.timeouts += 1
+                            return False
+                        wait = remaining if wait is None \
+                            else min(wait, remaining)
+
+                    self._condition.wait(wait)
+
+            finally:
+                if ticket in self._waiters:
+                    # タイムアウトや例外で待つのをやめた場合
+                    self._waiters.remove(ticket)
+                    heapq.heapify(self._waiters)
+                    self._condition.notify_all()
+
+    def report_throttled(self, retry_after=None):
+        '''
+        [概要]
+        利用上限のエラーが返ってきたことを伝えるメソッド
+        rate を半分(下限は base_rate * min_rate_ratio)にし，
+        retry_after 秒(指定が無ければ 1 / rate 秒)は誰にもトークンを渡さない
+        '''
+        with self._condition:
+            now = time.monotonic()
+            self.throttled += 1
+            self.rate = max(self.base_rate * self.min_rate_ratio, self.rate / 2)
+            pause = retry_after if retry_after else 1 / self.rate
+            self._pause_until = max(self._pause_until, now + pause)
+            self._tokens = 0.0
+            self._last_refill = now
+            logger.warning(
+                f">>> {self.name}: 利用上限に達したので {pause:.1f} 秒待ち，"
+                f"{self.rate:.2f} 回/秒 に減速します"
+            )
+            self._condition.notify_all()
+
+    def report_success(self):
+        '''
+        [概要]
+        呼び出しが成功したことを伝えるメソッド
+        減速していた場合は少しずつ元の rate に戻す
+        '''
+        if self.rate >= self.base_rate:
+            return
+        with self._condition:
+            self.rate = min(self.base_rate, self.rate + self.base_rate * 0.1)
+
+    @classmethod
+    def is_quota_error(cls, e):
+        '''
+        [概要]
+        送り直せば通る利用上限のエラーかどうかを判定するメソッド
+        (googleapiclient の HttpError を想定)
+        RateLimiter を使わない処理からも RateLimiter.is_quota_error(e) で使える
+        '''
+        status = getattr(getattr(e, "resp", None), "status", None)
+        if status == 429:
+            return True
+        if status == 403:
+            content = getattr(e, "content", b"")
+            if isinstance(content, bytes):
+                content = content.decode("utf-8", errors="replace")
+            return any(reason in content for reason in cls.QUOTA_REASONS)
+        return False
+
+    def _read_retry_after(self, e):
+        try:
+            return float(e.resp.get("retry-after"))
+
+        except (AttributeError, TypeError, ValueError):
+            return None
+
+    def call(self, func, *args, priority="normal", tokens=1, max_retries=5,
+             **kwargs):
+        '''
+        [概要]
+        トークンを受け取ってから func(*args, **kwargs) を呼び出すメソッド
+        利用上限のエラーなら減速して max_retries 回まで送り直す
+        '''
+        for attempt in range(max_retries + 1):
+            self.acquire(tokens, priority)
+            try:
+                result = func(*args, **kwargs)
+
+            except Exception as e:
+                if not self.is_quota_error(e) or attempt == max_retries:
+                    raise e
+                self.report_throttled(self._read_retry_after(e))
+                continue
+
+            self.report_success()
+            return result
+
+    def stats(self):
+        '''
+        [概要]
+        監視用のカウンタを辞書にまとめて返すメソッド
+        '''
+        with self._condition:
+            return {
+                "name": self.name,
+                "rate": round(self.rate, 3),
+                "base_rate": self.base_rate,
+                "acquired": dict(self.acquired),
+                "waiting": len(self._waiters),
+                "waited_seconds": round(self.waited_seconds, 3),
+                "throttled": self.throttled,
+                "timeouts": self.timeouts,
+            }
+
+
+def get_rate_limiter(name, rate, capacity=1):
+    '''
+    [概要]
+    name の RateLimiter を返す関数
+    まだ無ければ rate / capacity で作り，あれば作成済みのものを返す
+    作成済みのものと rate / capacity が違う場合は警告を出す
+    (作成済みの設定のまま使う)
+    '''
+    with _RATE_LIMITERS_LOCK:
+        if name not in _RATE_LIMITERS:
+            _RATE_LIMITERS[name] = RateLimiter(name, rate, capacity)
+            return _RATE_LIMITERS[name]
+
+        limiter = _RATE_LIMITERS[name]
+        if (limiter.base_rate, limiter.capacity) != (rate, capacity):
+            logger.warning(
+                f">>> {name}: 作成済みの設定(rate={limiter.base_rate}, "
+                f"capacity={limiter.capacity})と違う設定(rate={rate}, "
+                f"capacity={capacity})は無視されます"
+            )
+        return limiter
+
+
+def read_rate_limiter_stats():
+    '''
+    [概要]
+    全ての RateLimiter のカウンタをリストで返す関数
+    '''
+    with _RATE_LIMITERS_LOCK:
+        limiters = list(_RATE_LIMITERS.values())
+    return [limiter.stats() for limiter in limiters]
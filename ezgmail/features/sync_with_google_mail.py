@@ -9,6 +9,12 @@
 
 import ezgmail
 
+try:
+    from features.rate_limiter import get_rate_limiter
+
+except:
+    from rate_limiter import get_rate_limiter
+
 from logging import getLogger
 from pathlib import Path
 import os
@@ -20,6 +26,8 @@ logger = getLogger(__name__)
 class SyncWithGoogleMail:
     def __init__(self):
         self.mail = self._refresh_token()
+        # Gmail API の呼び出し回数の制限(同じプロセス内で共有する)
+        self.rate_limiter = get_rate_limiter("gmail", rate=2.0, capacity=5)
 
     def _refresh_token(self):
         '''
@@ -45,7 +53,9 @@ class SyncWithGoogleMail:
 
         try:
             logger.debug(f"> '{search_target}' と一致するメールを取得する")
-            self.searched_threads = ezgmail.search(search_target)
+            self.searched_threads = self.rate_limiter.call(
+                ezgmail.search, search_target
+            )
             logger.debug(
                 f"> '{search_target}' と一致するメールを取得した"
             )
@@ -75,8 +85,8 @@ class SyncWithGoogleMail:
                 recipient = self.mail
                 
             logger.debug(f"> '{recipient}' 宛にメールを送信します")
-            ezgmail.send(
-                recipient, subject, body
+            self.rate_limiter.call(
+                ezgmail.send, recipient, subject, body, priority="high"
             )
             logger.debug(
                 f"> '{recipient}' 宛にメールを送信した"
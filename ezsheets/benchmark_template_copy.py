@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+#
+# benchmark_template_copy.py
+#
+# [概要]
+# SyncWithGoogleSheets.copy_template_sheet() の2つの複製方法
+# ・server: Drive API の files.copy でサーバ上で複製する
+# ・excel: Excel 形式でダウンロードしてアップロードし直す(以前の方法)
+# の速度・HTTP リクエスト数・転送量を比較するベンチマーク
+#
+# 本物の Google API は使わず，http.server で作ったスタブサーバに
+# ezsheets(googleapiclient)のリクエストを向けて計測する．
+# スタブは1リクエストごとに --latency 秒待ち，
+# Excel ファイルは --xlsx-kb KB のダミーデータを返すので，
+# 環境に合わせて値を変えて比較できる．
+#     python3 benchmark_template_copy.py --copies 20 --latency 0.1
+#
+
+from features.setup_logging import setup_logging
+from features.sync_with_google_sheets import SyncWithGoogleSheets
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import getLogger
+from pathlib import Path
+from urllib.parse import unquote, urlsplit
+import argparse
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+from googleapiclient.discovery import build
+import ezsheets
+import httplib2
+
+# 専用のロガーを作成
+logger = getLogger(__name__)
+
+# logging の設定を適用
+logging_config = Path("./config/logging_config.yml")
+setup_logging(logging_config)
+
+
+class StubGoogleServer(ThreadingHTTPServer):
+    '''
+    Sheets API / Drive API のうち，テンプレートの複製で使う部分だけを
+    まねるスタブサーバ
+    '''
+    def __init__(self, latency, xlsx_bytes, rows=40, columns=6):
+        super().__init__(("127.0.0.1", 0), StubGoogleHandler)
+        self.latency = latency
+        self.xlsx_bytes = xlsx_bytes
+        self.rows = rows
+        self.columns = columns
+
+        self._lock = threading.Lock()
+        # スプレッドシートID -> タイトル
+        self.spreadsheets = {"template": "VM-Monitor-Template"}
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def add_spreadsheet(self, title):
+        with self._lock:
+            spreadsheet_id = f"copy{len(self.spreadsheets)}"
+            self.spreadsheets[spreadsheet_id] = title
+        return spreadsheet_id
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = 0
+            self.bytes_sent = 0
+            self.bytes_received = 0
+
+
+class StubGoogleHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        # 1リクエストごとのアクセスログは出さない
+        pass
+
+    def _reply(self, body, content_type="application/json", status=200):
+        if isinstance(body, dict):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server._lock:
+            self.server.bytes_sent += len(body)
+
+    def _start(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        with self.server._lock:
+            self.server.requests += 1
+            self.server.bytes_received += len(body)
+        time.sleep(self.server.latency)
+        return unquote(urlsplit(self.path).path)
+
+    def _spreadsheet_json(self, spreadsheet_id):
+        server = self.server
+        return {
+            "spreadsheetId": spreadsheet_id,
+            "properties": {"title": server.spreadsheets[spreadsheet_id]},
+            "sheets": [{"properties": {
+                "sheetId": 0, "title": "Sheet1", "index": 0,
+                "gridProperties": {
+                    "rowCount": server.rows, "columnCount": server.columns
+                },
+            }}],
+        }
+
+    def do_GET(self):
+        path = self._start()
+        server = self.server
+
+        match = re.fullmatch(r"/v4/spreadsheets/([^/]+)(/values/.*)?", path)
+        if match and match.group(1) in server.spreadsheets:
+            if match.group(2) is None:
+                return self._reply(self._spreadsheet_json(match.group(1)))
+            return self._reply({
+                "range": match.group(2)[len("/values/"):],
+                "majorDimension": "ROWS",
+                "values": [
+                    [f"R{row}C{column}" for column in range(server.columns)]
+                    for row in range(server.rows)
+                ],
+            })
+
+        match = re.fullmatch(r"/drive/v3/files/([^/]+)/export", path)
+        if match and match.group(1) in server.spreadsheets:
+            return self._reply(
+                server.xlsx_bytes, content_type="application/octet-stream"
+            )
+
+        return self._reply({"error": {"status": "NOT_FOUND"}}, status=404)
+
+    def do_POST(self):
+        path = self._start()
+        server = self.server
+
+        match = re.fullmatch(r"/drive/v3/files/([^/]+)/copy", path)
+        if match and match.group(1) in server.spreadsheets:
+            return self._reply({"id": server.add_spreadsheet("copy")})
+
+        if path == "/upload/drive/v3/files":
+            return self._reply({"id": server.add_spreadsheet("upload")})
+
+        return self._reply({"error": {"status": "NOT_FOUND"}}, status=404)
+
+
+class StubHttp(httplib2.Http):
+    '''
+    Google API の URL をスタブサーバの URL に書き換える httplib2.Http
+    '''
+    GOOGLE_HOSTS = re.compile(
+        r"^https://(sheets\.googleapis\.com|www\.googleapis\.com)"
+    )
+
+    def __init__(self, base_url):
+        super().__init__()
+        self.base_url = base_url
+
+    def request(self, uri, *args, **kwargs):
+        return super().request(
+            self.GOOGLE_HOSTS.sub(self.base_url, uri), *args, **kwargs
+        )
+
+
+class TemplateCopyBenchmark:
+    MODES = {"server": True, "excel": False}
+
+    def __init__(self, latency=0.05, xlsx_kb=64):
+        self.server = StubGoogleServer(latency, os.urandom(xlsx_kb * 1024))
+
+    def _connect_stub(self):
+        '''
+        [概要]
+        ezsheets がスタブサーバを使うように設定するメソッド
+        ezsheets.init() も差し替えるので，認証情報が無くても動く
+        '''
+        base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        http = StubHttp(base_url)
+        ezsheets.SHEETS_SERVICE = build(
+            "sheets", "v4", http=http, static_discovery=True
+        )
+        ezsheets.DRIVE_SERVICE = build(
+            "drive", "v3", http=http, static_discovery=True
+        )
+        ezsheets.IS_INITIALIZED = True
+        ezsheets.init = lambda *args, **kwargs: True
+
+    def run(self, copies=10):
+        '''
+        [概要]
+        各方法で copies 回ずつテンプレートを複製して
+        1回あたりの時間・リクエスト数・転送量を辞書で返すメソッド
+        '''
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self._connect_stub()
+
+        results = {}
+        # Excel 経由の複製はカレントディレクトリにファイルを作るので
+        # 一時ディレクトリで実行する
+        current_dir = Path.cwd()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.chdir(tmp_dir)
+            try:
+                sync_with_google_sheets = SyncWithGoogleSheets()
+                sync_with_google_sheets.sheet_index.refresh(
+                    {"template": "VM-Monitor-Template"}
+                )
+                for mode, server_side in self.MODES.items():
+                    self.server.reset_counters()
+                    start = time.perf_counter()
+                    for index in range(copies):
+                        sync_with_google_sheets.copy_template_sheet(
+                            "VM-Monitor-Template", f"vm{index:03}",
+                            server_side=server_side
+                        )
+                    seconds = time.perf_counter() - start
+
+                    results[mode] = {
+                        "sec_per_copy": round(seconds / copies, 4),
+                        "requests_per_copy": self.server.requests / copies,
+                        "kb_per_copy": round(
+                            (self.server.bytes_sent
+                             + self.server.bytes_received) / copies / 1024, 1
+                        ),
+                    }
+                    logger.info(
+                        f">> {mode:<6} {results[mode]['sec_per_copy']:.3f} 秒/回 "
+                        f"{results[mode]['requests_per_copy']:.0f} リクエスト/回 "
+                        f"{results[mode]['kb_per_copy']:.1f} KB/回"
+                    )
+
+            finally:
+                os.chdir(current_dir)
+                self.server.shutdown()
+
+        speedup = results["excel"]["sec_per_copy"] / results["server"]["sec_per_copy"]
+        logger.info(f">> サーバ上での複製は {speedup:.1f} 倍速い")
+        return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="テンプレートの複製方法ごとの性能を計測する"
+    )
+    parser.add_argument("--copies", type=int, default=10,
+                        help="各方法で複製する回数")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="スタブサーバの1リクエストあたりの遅延(秒)")
+    parser.add_argument("--xlsx-kb", type=int, default=64,
+                        help="ダウンロードされる Excel ファイルの大きさ(KB)")
+    args = parser.parse_args()
+
+    TemplateCopyBenchmark(args.latency, args.xlsx_kb).run(args.copies)
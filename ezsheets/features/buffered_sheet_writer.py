@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+#
+# buffered_sheet_writer.py
+#
+# [概要]
+# 計測値(1行分のリスト)を手元のバッファに溜めておき，
+# 一定件数 or 一定時間ごとに
+# SyncWithGoogleSheets.edit_sheet_rows() で
+# まとめて書き込むプログラム
+#
+# 1件ごとに API を呼ぶと，サンプリング間隔を短くするほど
+# Google Sheets API の利用上限(クォータ)にすぐ達してしまう．
+# まとめて書き込むことで API 呼び出し回数を
+# batch_size 分の1に減らせる．
+#
+# バッファには上限(max_pending)があり，上限に達した状態で
+# 追加しようとすると，その場で書き込みが終わるまで待たされる
+# (書き込めなければ例外になる)ので，メモリが際限なく増えることはない．
+# 送り直しても通らない書き込み(不正なデータなど)は，
+# いつまでもバッファに残らないように破棄する
+# (判定は SheetWriteSpool と同じ is_permanent_error() を使う)．
+#
+
+try:
+    from features.sheet_write_spool import is_permanent_error
+
+except:
+    from sheet_write_spool import is_permanent_error
+
+from logging import getLogger
+import threading
+import time
+
+# 専用のロガーを作成
+logger = getLogger(__name__)
+
+
+class BufferedSheetWriter:
+    def __init__(self, sync_with_google_sheets, start_row, batch_size=30,
+                 flush_interval=30.0, max_pending=1000, sheet_num=0):
+        assert isinstance(start_row, int), "行は整数型で渡してください"
+        assert batch_size > 0, "batch_sizeは1以上で指定"
+        assert max_pending >= batch_size, "max_pendingはbatch_size以上で指定"
+
+        self.sync_with_google_sheets = sync_with_google_sheets
+        self.next_row = start_row
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.sheet_num = sheet_num
+
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+        # 監視用のカウンタ
+        self.api_calls = 0
+        self.flushed_rows = 0
+        self.failed_flushes = 0
+        self.dropped_rows = 0
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def append(self, row):
+        '''
+        [概要]
+        1行分のデータをバッファに追加するメソッド
+        件数か経過時間が閾値を超えていればまとめて書き込む
+        バッファが満杯の場合は書き込みが終わるまで待ち(バックプレッシャー)，
+        それでも書き込めなければ例外を送出する
+        '''
+        assert isinstance(row, list), "データはリスト型で渡して"
+
+        with self._lock:
+            if len(self._buffer) >= self.max_pending:
+                logger.warning(
+                    f">>> バッファが満杯({self.max_pending} 件)なので"
+                    f"書き込みを待ちます"
+                )
+                self._flush_locked()
+
+            self._buffer.append(row)
+
+            if self._should_flush():
+                try:
+                    self._flush_locked()
+
+                except Exception as e:
+                    # 書き込めなかったデータはバッファに残して次回に再送する
+                    logger.warning(
+                        f">>> まとめ書きに失敗したので次回に再送します: {e}"
+                    )
+
+        return True
+
+    def _should_flush(self):
+        if len(self._buffer) >= self.batch_size:
+            return True
+        return time.monotonic() - self._last_flush >= self.flush_interval
+
+    def flush_if_due(self):
+        '''
+        [概要]
+        前回の書き込みから flush_interval 秒以上経っていれば書き込むメソッド
+        新しいデータが来ない間も定期的に呼び出して使う
+        '''
+        with self._lock:
+            if not self._buffer or not self._should_flush():
+                return 0
+            return self._flush_locked()
+
+    def flush(self):
+        '''
+        [概要]
+        バッファに溜まっているデータを今すぐ書き込むメソッド
+        プログラム終了時などに呼び出す
+        '''
+        with self._lock:
+            return self._flush_locked()
+
+    def _flush_locked(self):
+        '''
+        [概要]
+        ロックを取得した状態でバッファの中身を書き込むメソッド
+        書き込みに失敗した場合はバッファを消さずに例外を送出する
+        送り直しても成功しない場合はその分を破棄して 0 を返す
+        '''
+        if not self._buffer:
+            return 0
+
+        rows = list(self._buffer)
+        try:
+            self.sync_with_google_sheets.edit_sheet_rows(
+                self.next_row, rows, self.sheet_num
+            )
+
+        except Exception as e:
+            self.failed_flushes += 1
+            if not is_permanent_error(e):
+                raise e
+
+            # 1つのまとめ書きが通らないせいで後の書き込みが止まらないようにする
+            del self._buffer[:len(rows)]
+            self._last_flush = time.monotonic()
+            self.dropped_rows += len(rows)
+            logger.error(
+                f">>>> 書き込めない {len(rows)} 行を破棄しました: {e}"
+            )
+            return 0
+
+        del self._buffer[:len(rows)]
+        self.next_row += len(rows)
+        self._last_flush = time.monotonic()
+        self.api_calls += 1
+        self.flushed_rows += len(rows)
+        logger.debug(
+            f"> {len(rows)} 行をまとめて書き込みました "
+            f"(API 呼び出し {self.api_calls} 回 / {self.flushed_rows} 行)"
+        )
+        return len(rows)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+#
+# dashboard_pipeline.py
+#
+# [概要]
+# VM ダッシュボードの「計測」と「アップロード」を
+# 別々のスレッドに分けて実行するプログラム
+#
+# ・MetricCollector: 一定間隔で計測してキューに入れる(生産者)
+# ・MetricUploader: キューから取り出して BufferedSheetWriter に渡す(消費者)
+#
+# 計測とアップロードを同じループで順番に行うと，
+# ネットワークの遅延がそのまま計測間隔のズレになってしまう．
+# スレッドを分けることで，アップロードが遅れても
+# 計測は決まった時刻に行われる．
+#
+# 計測の時刻は「前回の計測時刻 + 間隔」で決める(ドリフト補正)ので，
+# 計測自体にかかった時間で間隔が少しずつ伸びることもない．
+# 計測が間に合わなかった回数(late)や，キューが満杯で
+# 捨てた件数(dropped)も数えている．
+#
+
+from logging import getLogger
+import queue
+import threading
+import time
+
+# 専用のロガーを作成
+logger = getLogger(__name__)
+
+
+class MetricCollector(threading.Thread):
+    def __init__(self, read_sample, sample_queue, interval, stop_event):
+        super().__init__(name="MetricCollector", daemon=True)
+        assert interval > 0, "intervalは正の数で指定"
+
+        self.read_sample = read_sample
+        self.sample_queue = sample_queue
+        self.interval = interval
+        self.stop_event = stop_event
+
+        # 監視用のカウンタ
+        self.collected = 0
+        self.dropped = 0
+        self.late = 0
+        self.skipped_ticks = 0
+        self.errors = 0
+
+    def run(self):
+        '''
+        [概要]
+        interval 秒おきに計測してキューに入れ続けるメソッド
+        '''
+        logger.debug(f"> {self.interval}秒おきの計測を開始します")
+        next_tick = time.monotonic()
+        while not self.stop_event.is_set():
+            try:
+                sample = self.read_sample()
+                self.collected += 1
+                self.sample_queue.put_nowait(sample)
+
+            except queue.Full:
+                self.dropped += 1
+                logger.warning(
+                    f">>> キューが満杯なので計測値を捨てました: {self.dropped} 件目"
+                )
+
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"計測中にエラーが発生しました: {e}")
+
+            next_tick += self.interval
+            delay = next_tick - time.monotonic()
+            if delay < 0:
+                # 遅れた回はすぐに計測し，丸ごと過ぎてしまった回は飛ばして
+                # 元の時刻の並び(next_tick の刻み)に戻す
+                self.late += 1
+                skipped = int(-delay // self.interval)
+                self.skipped_ticks += skipped
+                next_tick += skipped * self.interval
+                logger.debug(
+                    f"> 計測が {-delay:.3f} 秒遅れました "
+                    f"({skipped} 回分を飛ばします)"
+                )
+                delay = 0
+
+            self.stop_event.wait(delay)
+
+        logger.debug("> 計測を停止しました")
+
+
+class MetricUploader(threading.Thread):
+    def __init__(self, sample_queue, sheet_writer, stop_event,
+                 retry_interval=5.0):
+        super().__init__(name="MetricUploader", daemon=True)
+
+        self.sample_queue = sample_queue
+        self.sheet_writer = sheet_writer
+        self.stop_event = stop_event
+        self.retry_interval = retry_interval
+
+        # 監視用のカウンタ
+        self.uploaded = 0
+        self.errors = 0
+
+    def run(self):
+        '''
+        [概要]
+        キューから計測値を取り出して BufferedSheetWriter に渡し続けるメソッド
+        停止の指示があってもキューに残っている分は渡し切る
+        '''
+        logger.debug("> アップロードを開始します")
+        pending = None
+        while not self.stop_event.is_set() or not self.sample_queue.empty():
+            try:
+                if pending is None:
+                    pending = self.sample_queue.get(timeout=0.5)
+                self.sheet_writer.append(pending)
+                pending = None
+                self.uploaded += 1
+
+            except queue.Empty:
+                self._flush_if_due()
+
+            except Exception as e:
+                # バッファが満杯で書き込めない場合は少し待ってから再送する
+                # (その間キューが溢れた分は MetricCollector が捨てて数える)
+                self.errors += 1
+                logger.error(f"アップロード中にエラーが発生しました: {e}")
+                if self.stop_event.wait(self.retry_interval):
+                    break
+
+        logger.debug("> アップロードを停止しました")
+
+    def _flush_if_due(self):
+        '''
+        [概要]
+        新しい計測値が来なくても，時間の閾値を過ぎたら書き込むメソッド
+        '''
+        try:
+            self.sheet_writer.flush_if_due()
+
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f">>> 定期書き込みに失敗しました: {e}")
+
+
+class DashboardPipeline:
+    def __init__(self, read_sample, sheet_writer, sample_interval=1.0,
+                 max_queue=1000):
+        self.stop_event = threading.Event()
+        self.sample_queue = queue.Queue(maxsize=max_queue)
+        self.sheet_writer = sheet_writer
+        self.collector = MetricCollector(
+            read_sample, self.sample_queue, sample_interval, self.stop_event
+        )
+        self.uploader = MetricUploader(
+            self.sample_queue, sheet_writer, self.stop_event
+        )
+
+    def start(self):
+        '''
+        [概要]
+        計測スレッドとアップロードスレッドを開始するメソッド
+        '''
+        logger.info(">> 計測とアップロードを開始します")
+        self.collector.start()
+        self.uploader.start()
+        return True
+
+    def stop(self, timeout=30.0):
+        '''
+        [概要]
+        両スレッドを停止し，バッファに残ったデータを書き込むメソッド
+        '''
+        logger.info(">> 計測とアップロードを停止します")
+        self.stop_event.set()
+        self.collector.join(timeout)
+        self.uploader.join(timeout)
+
+        try:
+            self.sheet_writer.flush()
+
+        except Exception as e:
+            logger.error(f"停止時の書き込みでエラーが発生しました: {e}")
+
+        logger.info(f">> 停止しました: {self.stats()}")
+        return True
+
+    def stats(self):
+        '''
+        [概要]
+        監視用のカウンタを辞書にまとめて返すメソッド
+        '''
+        return {
+            "collected": self.collector.collected,
+            "dropped": self.collector.dropped,
+            "late": self.collector.late,
+            "skipped_ticks": self.collector.skipped_ticks,
+            "queued": self.sample_queue.qsize(),
+            "uploaded": self.uploader.uploaded,
+            "api_calls": self.sheet_writer.api_calls,
+            "errors": self.collector.errors + self.uploader.errors,
+        }
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+#
+# fleet_agent.py
+#
+# [概要]
+# 計測値を FleetAggregator(集約プロセス)に HTTP で送るプログラム
+#
+# Google の認証情報を持たない各 VM で動かす軽量な送信役．
+# BufferedSheetWriter と同じ append() / flush() / flush_if_due() を持つので，
+# DashboardPipeline のアップロード先としてそのまま使える．
+# batch_size 件 or flush_interval 秒ごとに1回の POST でまとめて送り，
+# 送れなかった分は手元に残して次回に送り直す
+# (max_pending 件を超えたら古いものから捨てる)．
+# 送信に失敗した後は指数バックオフの間は送らないので，
+# 集約プロセスが止まっていても append() が毎回 timeout 秒待たされない．
+#
+
+from logging import getLogger
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+
+# 専用のロガーを作成
+logger = getLogger(__name__)
+
+
+class FleetAgent:
+    def __init__(self, url, host, columns, static=None, batch_size=30,
+                 flush_interval=30.0, max_pending=5000, token=None,
+                 timeout=10.0, base_backoff=1.0, max_backoff=300.0):
+        assert batch_size > 0, "batch_sizeは1以上で指定"
+        assert max_pending >= batch_size, "max_pendingはbatch_size以上で指定"
+
+        self.url = url
+        self.host = host
+        self.columns = list(columns)
+        # 静的情報は集約プロセスに届くまで毎回付けて送る
+        self.static = static
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.token = token
+        self.timeout = timeout
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+        # 再送の状態
+        self.failures = 0
+        self._retry_at = 0.0
+
+        # 監視用のカウンタ(DashboardPipeline.stats() で api_calls を使う)
+        self.api_calls = 0
+        self.sent_rows = 0
+        self.failed_posts = 0
+        self.dropped_rows = 0
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def _should_flush(self):
+        if time.monotonic() < self._retry_at:
+            # 前回の失敗からのバックオフ中
+            return False
+        if len(self._buffer) >= self.batch_size:
+            return True
+        return time.monotonic() - self._last_flush >= self.flush_interval
+
+    def append(self, row):
+        '''
+        [概要]
+        1行分のデータを追加し，閾値を超えていればまとめて送るメソッド
+        送信に失敗しても例外は出さない
+        '''
+        with self._lock:
+            self._buffer.append(row)
+            overflow = len(self._buffer) - self.max_pending
+            if overflow > 0:
+                del self._buffer[:overflow]
+                self.dropped_rows += overflow
+                logger.warning(
+                    f">>> 未送信が {self.max_pending} 件を超えたので"
+                    f"古い {overflow} 件を捨てました"
+                )
+
+            if self._should_flush():
+                self._flush_locked()
+
+        return True
+
+    def flush_if_due(self):
+        with self._lock:
+            if not self._buffer or not self._should_flush():
+                return 0
+            return self._flush_locked()
+
+    def flush(self):
+        '''
+        [概要]
+        バックオフ中でもバッファの中身を送るメソッド(終了時など)
+        '''
+        with self._lock:
+            return self._flush_locked()
+
+    def _post(self, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        request = urllib.request.Request(
+            self.url, data=body, method="POST",
+            headers={"Content-Type": "application/json"}
+        )
+        if self.token is not None:
+            request.add_header("X-Fleet-Token", self.token)
+
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return response.status
+
+    def _flush_locked(self):
+        '''
+        [概要]
+        バッファの中身を集約プロセスに送るメソッド
+        失敗した場合はバッファに残して 0 を返す
+        '''
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return 0
+
+        rows = self._buffer[:self.batch_size * 10]
+        payload = {"host": self.host, "columns": self.columns, "rows": rows}
+        if self.static is not None:
+            payload["static"] = self.static
+
+        try:
+            self.api_calls += 1
+            self._post(payload)
+
+        except urllib.error.HTTPError as e:
+            self.failed_posts += 1
+            if e.code not in (400, 413):
+                self._schedule_retry(e)
+                return 0
+
+            # 内容が不正で受け付けられない分は送り直しても通らない
+            del self._buffer[:len(rows)]
+            self.dropped_rows += len(rows)
+            logger.error(f"受け付けられなかった {len(rows)} 件を捨てました: {e}")
+            return 0
+
+        except (urllib.error.URLError, OSError) as e:
+            # 503(集約側のキューが満杯)もここに来るので後で送り直す
+            self.failed_posts += 1
+            self._schedule_retry(e)
+            return 0
+
+        self.failures = 0
+        self._retry_at = 0.0
+        del self._buffer[:len(rows)]
+        self.static = None
+        self.sent_rows += len(rows)
+        logger.debug(f"> {len(rows)} 行を {self.url} に送りました")
+        return len(rows)
+
+    def _schedule_retry(self, e):
+        self.failures += 1
+        backoff = min(
+            self.base_backoff * 2 ** (self.failures - 1), self.max_backoff
+        )
+        # 複数の VM が同時に再送しないように揺らぎを入れる
+        backoff *= random.uniform(0.5, 1.0)
+        self._retry_at = time.monotonic() + backoff
+        logger.warning(
+            f">>> 送信に失敗したので {backoff:.1f} 秒後に再送します "
+            f"(未送信 {len(self._buffer)} 件, {self.failures} 回目): {e}"
+        )
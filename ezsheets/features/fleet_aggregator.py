@@ -0,0 +1,488 @@
+#!/usr/bin/env python3
+#
+# fleet_aggregator.py
+#
+# [概要]
+# 多数の VM(エージェント)から HTTP で送られてくる計測値を受け取り，
+# 1台ごとのシートと全体の一覧(サマリ)シートに書き込むプログラム
+#
+# UpdateVMDashboard は1台の PC で1つのプロセスを動かし，
+# それぞれが Google の認証情報を持って自分のシートに書き込む．
+# 数百台になると認証情報の配布も API の利用上限も問題になるので，
+# 書き込みはこの集約プロセスだけが行う．
+#
+# ・FleetHTTPServer: POST /metrics で計測値(JSON)を受け取り，キューに入れる
+# ・FleetAggregator: キューから取り出してホストごとの
+#   BufferedSheetWriter に溜め，まとめて書き込む
+#   初めて見るホストはテンプレートを複製してシートを用意する
+#
+# Google への接続(SyncWithGoogleSheets)は全ホストで1つを共有し，
+# api_lock で1度に1リクエストだけ送るので，
+# 書き込み間隔の制限(RateLimiter)は全体にかかる．
+#
+# 送られてくる JSON の形式:
+#     {"host": "user@pc_name", "columns": [...], "rows": [[...], ...],
+#      "static": {...}}  # static は初回だけでよい
+#
+
+try:
+    from features.buffered_sheet_writer import BufferedSheetWriter
+
+except:
+    from buffered_sheet_writer import BufferedSheetWriter
+
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import getLogger
+from pathlib import Path
+import hmac
+import ipaddress
+import json
+import math
+import os
+import queue
+import re
+import tempfile
+import threading
+import time
+
+import ezsheets
+
+# 専用のロガーを作成
+logger = getLogger(__name__)
+
+
+class HostSheetTarget:
+    '''
+    1台分のスプレッドシートに書き込む窓口
+    BufferedSheetWriter の書き込み先として使う
+    '''
+    def __init__(self, aggregator, spreadsheet_id):
+        self.aggregator = aggregator
+        self.spreadsheet_id = spreadsheet_id
+
+    def edit_sheet_rows(self, start_row, rows, sheet_num=0):
+        sync_with_google_sheets = self.aggregator.sync_with_google_sheets
+        with self.aggregator.api_lock:
+            sync_with_google_sheets.open_spreadsheet(self.spreadsheet_id)
+            return sync_with_google_sheets.edit_sheet_rows(
+                start_row, rows, sheet_num
+            )
+
+
+class HostState:
+    __slots__ = ("spreadsheet_id", "writer", "columns", "latest", "last_seen")
+
+    def __init__(self, spreadsheet_id, writer):
+        self.spreadsheet_id = spreadsheet_id
+        self.writer = writer
+        self.columns = []
+        self.latest = []
+        self.last_seen = None
+
+
+class FleetAggregator:
+    # ホスト名として受け付ける文字列(シート名にも使う)
+    HOST_PATTERN = re.compile(r"^[\w.@-]{1,100}$")
+    # 1回の送信で受け付ける最大の行数
+    MAX_ROWS = 1000
+
+    def __init__(self, sync_with_google_sheets, template_sheet_name,
+                 summary_sheet_name="VM-Fleet-Summary",
+                 hosts_path=Path("./fleet_hosts.json"), start_row=35,
+                 batch_size=60, flush_interval=300.0, summary_interval=60.0,
+                 max_queue=10000):
+        self.sync_with_google_sheets = sync_with_google_sheets
+        self.template_sheet_name = template_sheet_name
+        self.summary_sheet_name = summary_sheet_name
+        self.hosts_path = hosts_path
+        self.start_row = start_row
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.summary_interval = summary_interval
+
+        # Google への接続は全ホストで共有するので，1度に1リクエストだけ送る
+        self.api_lock = threading.Lock()
+        self.inbox = queue.Queue(maxsize=max_queue)
+        self.hosts = {}
+        self._saved_hosts = self._load_hosts()
+        self._summary_id = None
+        self._last_summary = time.monotonic()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        # 監視用のカウンタ
+        self.received_rows = 0
+        self.rejected = 0
+        self.dropped_rows = 0
+
+    def _load_hosts(self):
+        '''
+        [概要]
+        ホストごとのシートIDと次に書き込む行を読み込むメソッド
+        再起動してもテンプレートを複製し直さず，続きの行から書き込める
+        '''
+        try:
+            with open(self.hosts_path, mode="r", encoding="utf-8") as f:
+                return json.load(f)
+
+        except FileNotFoundError:
+            return {}
+
+        except (OSError, ValueError) as e:
+            logger.warning(f">>> ホストの一覧を読み込めませんでした: {e}")
+            return {}
+
+    def _save_hosts(self):
+        hosts = dict(self._saved_hosts)
+        for host, state in self.hosts.items():
+            hosts[host] = {
+                "spreadsheet_id": state.spreadsheet_id,
+                "next_row": state.writer.next_row,
+            }
+
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.hosts_path.parent, prefix=f".{self.hosts_path.name}.",
+            suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, mode="w", encoding="utf-8") as f:
+                json.dump(hosts, f, ensure_ascii=False, indent=4)
+            os.replace(tmp_path, self.hosts_path)
+
+        except Exception as e:
+            Path(tmp_path).unlink(missing_ok=True)
+            logger.warning(f">>> ホストの一覧を保存できませんでした: {e}")
+            return False
+
+        self._saved_hosts = hosts
+        return True
+
+    def _is_cell_value(self, value):
+        '''
+        [概要]
+        シートのセルに書き込める値(文字列・数値・真偽値・空欄)かを判定する
+        NaN や無限大は Sheets API が受け付けないので不可
+        '''
+        if value is None or isinstance(value, (str, bool, int)):
+            return True
+        return isinstance(value, float) and math.isfinite(value)
+
+    def _validate(self, payload):
+        if not isinstance(payload, dict):
+            raise ValueError("JSON のオブジェクトで送ってください")
+        if not self.HOST_PATTERN.match(str(payload.get("host", ""))):
+            raise ValueError("host が不正です")
+
+        rows = payload.get("rows")
+        if not isinstance(rows, list) or not rows \
+                or not all(isinstance(row, list) for row in rows):
+            raise ValueError("rows はリストのリストで送ってください")
+        if len(rows) > self.MAX_ROWS:
+            raise ValueError(f"rows は {self.MAX_ROWS} 行以下で送ってください")
+        # 1つでも書き込めない値があると，そのホストのまとめ書きが全て失敗する
+        if not all(self._is_cell_value(cell) for row in rows for cell in row):
+            raise ValueError(
+                "rows の値は文字列・数値・真偽値・null で送ってください"
+            )
+
+        static = payload.get("static", {})
+        if not isinstance(static, dict) \
+                or not all(self._is_cell_value(v) for v in static.values()):
+            raise ValueError("static は値が文字列・数値などの辞書で送ってください")
+
+    def receive(self, payload):
+        '''
+        [概要]
+        エージェントから届いた計測値をキューに入れるメソッド
+        内容が不正なら ValueError，キューが満杯なら False を返す
+        (書き込みは別スレッドで行うので，ここでは待たない)
+        '''
+        self._validate(payload)
+        try:
+            self.inbox.put_nowait(payload)
+
+        except queue.Full:
+            self.rejected += 1
+            return False
+
+        return True
+
+    def _provision_host(self, host, static):
+        '''
+        [概要]
+        テンプレートを複製して host 用のシートを作り，静的情報を書き込むメソッド
+        '''
+        logger.info(f">> {host} のシートを用意します")
+        sync_with_google_sheets = self.sync_with_google_sheets
+        with self.api_lock:
+            sync_with_google_sheets.copy_template_sheet(
+                self.template_sheet_name, host
+            )
+            if static:
+                # UpdateVMDashboard.insert_static_info() と同じ並び(C5, C7, ...)
+                cells = {
+                    f"C{5 + index * 2}": value
+                    for index, value in enumerate(static.values())
+                }
+                sync_with_google_sheets.edit_cells(cells, priority="high")
+
+            return sync_with_google_sheets.ss.id
+
+    def _get_host(self, host, static):
+        state = self.hosts.get(host)
+        if state is not None:
+            return state
+
+        saved = self._saved_hosts.get(host)
+        if saved is not None:
+            spreadsheet_id = saved["spreadsheet_id"]
+            next_row = saved["next_row"]
+        else:
+            spreadsheet_id = self._provision_host(host, static)
+            next_row = self.start_row
+
+        writer = BufferedSheetWriter(
+            HostSheetTarget(self, spreadsheet_id), next_row,
+            batch_size=self.batch_size, flush_interval=self.flush_interval
+        )
+        state = HostState(spreadsheet_id, writer)
+        self.hosts[host] = state
+        self._save_hosts()
+        return state
+
+    def _handle(self, payload):
+        host = payload["host"]
+        rows = payload["rows"]
+        try:
+            state = self._get_host(host, payload.get("static", {}))
+
+        except Exception as e:
+            self.dropped_rows += len(rows)
+            logger.error(f"{host} のシートを用意できませんでした: {e}")
+            return False
+
+        state.columns = payload.get("columns", state.columns)
+        state.last_seen = datetime.now()
+        for row in rows:
+            try:
+                state.writer.append(row)
+
+            except Exception as e:
+                # バッファが満杯で書き込めない
+                self.dropped_rows += 1
+                logger.error(f"{host} の計測値を捨てました: {e}")
+        state.latest = rows[-1]
+        self.received_rows += len(rows)
+        return True
+
+    def _flush_due(self, force=False):
+        '''
+        [概要]
+        各ホストのバッファのうち，時間の閾値を過ぎたものを書き込むメソッド
+        '''
+        flushed = 0
+        for host, state in self.hosts.items():
+            try:
+                if force:
+                    flushed += state.writer.flush()
+                else:
+                    flushed += state.writer.flush_if_due()
+
+            except Exception as e:
+                logger.warning(f">>> {host} の書き込みに失敗しました: {e}")
+
+        if flushed:
+            self._save_hosts()
+        return flushed
+
+    def _open_summary(self):
+        if self._summary_id is not None:
+            return self._summary_id
+
+        sync_with_google_sheets = self.sync_with_google_sheets
+        self._summary_id = sync_with_google_sheets._read_sheet_id_by_title(
+            self.summary_sheet_name
+        )
+        if self._summary_id is None:
+            logger.info(f">> サマリシート {self.summary_sheet_name} を作成します")
+            # 作成は Drive の API なので drive の RateLimiter を通す
+            summary_ss = sync_with_google_sheets.drive_limiter.call(
+                ezsheets.createSpreadsheet, self.summary_sheet_name
+            )
+            self._summary_id = summary_ss.id
+            sync_with_google_sheets.sheet_index.add(
+                summary_ss.id, self.summary_sheet_name
+            )
+        return self._summary_id
+
+    def write_summary(self):
+        '''
+        [概要]
+        全ホストの最新の計測値をサマリシートに1ホスト1行で書き込むメソッド
+        '''
+        if not self.hosts:
+            return False
+
+        columns = next(
+            (state.columns for state in self.hosts.values() if state.columns),
+            []
+        )
+        rows = [["host", "last_seen"] + list(columns)]
+        for host in sorted(self.hosts):
+            state = self.hosts[host]
+            last_seen = state.last_seen.strftime("%Y-%m-%d %H:%M:%S") \
+                if state.last_seen else ""
+            rows.append([host, last_seen] + list(state.latest))
+
+        sync_with_google_sheets = self.sync_with_google_sheets
+        with self.api_lock:
+            sync_with_google_sheets.open_spreadsheet(self._open_summary())
+            # サマリはホストごとの書き込みより後回しでよい
+            sync_with_google_sheets.edit_sheet_rows(1, rows, priority="low")
+
+        self._last_summary = time.monotonic()
+        logger.debug(f"> サマリシートに {len(rows) - 1} 台分を書き込みました")
+        return True
+
+    def _write_summary_if_due(self):
+        if time.monotonic() - self._last_summary < self.summary_interval:
+            return False
+        try:
+            return self.write_summary()
+
+        except Exception as e:
+            self._last_summary = time.monotonic()
+            logger.warning(f">>> サマリシートの書き込みに失敗しました: {e}")
+            return False
+
+    def run(self):
+        '''
+        [概要]
+        キューの計測値をホストごとのバッファに振り分け，
+        定期的にシートへ書き込み続けるメソッド
+        '''
+        while not self._stop_event.is_set() or not self.inbox.empty():
+            try:
+                self._handle(self.inbox.get(timeout=1.0))
+
+            except queue.Empty:
+                pass
+
+            self._flush_due()
+            self._write_summary_if_due()
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self.run, name="FleetAggregator", daemon=True
+        )
+        self._thread.start()
+        logger.info(">> 集約を開始しました")
+        return True
+
+    def stop(self, timeout=60.0):
+        '''
+        [概要]
+        キューとバッファに残っている計測値を書き込んでから止めるメソッド
+        '''
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+        self._flush_due(force=True)
+        try:
+            self.write_summary()
+
+        except Exception as e:
+            logger.warning(f">>> サマリシートの書き込みに失敗しました: {e}")
+
+        logger.info(f">> 集約を停止しました: {self.stats()}")
+        return True
+
+    def stats(self):
+        return {
+            "hosts": len(self.hosts),
+            "queued": self.inbox.qsize(),
+            "received_rows": self.received_rows,
+            "rejected": self.rejected,
+            "dropped_rows": self.dropped_rows,
+            "api_calls": sum(
+                state.writer.api_calls for state in self.hosts.values()
+            ),
+        }
+
+
+class FleetRequestHandler(BaseHTTPRequestHandler):
+    # 1回の送信で受け付ける最大のバイト数
+    MAX_BODY = 1024 * 1024
+
+    def log_message(self, format, *args):
+        logger.debug(f"> {self.address_string()} {format % args}")
+
+    def _reply(self, status, message):
+        body = json.dumps({"message": message}, ensure_ascii=False)
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path != "/metrics":
+            return self._reply(404, "not found")
+
+        token = self.server.token
+        if token is not None and not hmac.compare_digest(
+                self.headers.get("X-Fleet-Token", ""), token):
+            return self._reply(401, "invalid token")
+
+        try:
+            length = int(self.headers["Content-Length"])
+
+        except (TypeError, ValueError):
+            # Content-Length が無い，もしくは数値ではない
+            return self._reply(400, "invalid Content-Length")
+
+        if length <= 0 or length > self.MAX_BODY:
+            return self._reply(413, "body is empty or too large")
+
+        try:
+            payload = json.loads(self.rfile.read(length))
+            accepted = self.server.aggregator.receive(payload)
+
+        except ValueError as e:
+            return self._reply(400, str(e))
+
+        if not accepted:
+            # エージェントは送信済みにせず，後で送り直す
+            return self._reply(503, "queue is full")
+        return self._reply(202, "accepted")
+
+
+def is_loopback_address(host):
+    '''
+    [概要]
+    host が自分自身(ループバック)のアドレスかどうかを判定する関数
+    '''
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+
+    except ValueError:
+        return False
+
+
+class FleetHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, aggregator, token=None):
+        # 合言葉なしで外から受け付けると，誰でもシートを作って書き込める
+        if not token and not is_loopback_address(address[0]):
+            raise ValueError(
+                f"{address[0]} で待ち受ける場合は token を指定してください"
+            )
+        super().__init__(address, FleetRequestHandler)
+        self.aggregator = aggregator
+        self.token = token
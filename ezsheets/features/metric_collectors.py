@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+#
+# metric_collectors.py
+#
+# [概要]
+# ダッシュボードに書き込む動的情報(計測値)を
+# 「コレクタ」という部品として登録・組み合わせるプログラム
+#
+# コレクタは BaseCollector を継承したクラスで，
+# ・name: 設定で指定するときの名前
+# ・columns: シートに書き込む列の名前
+# ・cost: 1回の計測の重さ("low" / "medium" / "high")
+# ・interval: 計測し直す間隔(秒)．0 なら毎回計測する
+# を持ち，collect() で columns と同じ長さのリストを返す．
+# @register_collector を付けたクラスは COLLECTORS に登録され，
+# MetricRegistry.from_names(["cpu", "ram", "disk_io"]) のように
+# 名前だけで組み合わせられる．
+#
+# 重いコレクタ(プロセス一覧など)は interval を長めにしておき，
+# 間の回は前回の値を使い回すことで，
+# 計測全体を高い頻度で回しても負荷が増えすぎないようにしている．
+#
+
+try:
+    from features.sync_cpu import SyncCPU
+    from features.sync_ram import SyncRAM
+
+except:
+    from sync_cpu import SyncCPU
+    from sync_ram import SyncRAM
+
+from logging import getLogger
+import time
+
+import psutil
+
+# 専用のロガーを作成
+logger = getLogger(__name__)
+
+# 登録されたコレクタ(名前 -> クラス)
+COLLECTORS = {}
+
+
+def register_collector(collector_class):
+    '''
+    [概要]
+    コレクタのクラスを COLLECTORS に登録するデコレータ
+    '''
+    assert collector_class.name not in COLLECTORS, \
+        f"{collector_class.name} は登録済みです"
+    COLLECTORS[collector_class.name] = collector_class
+    return collector_class
+
+
+class BaseCollector:
+    name = None
+    columns = []
+    cost = "low"
+    interval = 0.0
+
+    def collect(self):
+        '''
+        [概要]
+        計測値を columns と同じ長さのリストで返すメソッド
+        継承したクラスで実装する
+        '''
+        raise NotImplementedError
+
+
+class RateCollector(BaseCollector):
+    '''
+    累積カウンタ(送信バイト数など)の前回との差分から
+    1秒あたりの量を計算するコレクタの共通部分
+    '''
+    # 累積カウンタの項目名と，1秒あたりの量を割る単位
+    counter_fields = []
+    unit = 1
+
+    def __init__(self):
+        self._previous = self._read_counters()
+        self._previous_time = time.monotonic()
+
+    def _read_counters(self):
+        raise NotImplementedError
+
+    def collect(self):
+        counters = self._read_counters()
+        now = time.monotonic()
+        if counters is None or self._previous is None:
+            # 計測できない環境(ディスクが無いコンテナなど)
+            self._previous = counters
+            self._previous_time = now
+            return [None] * len(self.counter_fields)
+
+        elapsed = now - self._previous_time
+        rates = []
+        for field in self.counter_fields:
+            delta = getattr(counters, field) - getattr(self._previous, field)
+            if elapsed <= 0 or delta < 0:
+                # カウンタがリセットされた場合は 0 とする
+                rates.append(0.0)
+            else:
+                rates.append(round(delta / elapsed / self.unit, 2))
+
+        self._previous = counters
+        self._previous_time = now
+        return rates
+
+
+@register_collector
+class CPUCollector(BaseCollector):
+    name = "cpu"
+    columns = ["cpu_utilities"]
+
+    def __init__(self, sync_cpu=None):
+        self.sync_cpu = sync_cpu or SyncCPU()
+
+    def collect(self):
+        return [self.sync_cpu.read_cores_utilities()]
+
+
+@register_collector
+class RAMCollector(BaseCollector):
+    name = "ram"
+    columns = ["ram_virtual_percent"]
+
+    def __init__(self, sync_ram=None):
+        self.sync_ram = sync_ram or SyncRAM()
+
+    def collect(self):
+        return [self.sync_ram.read_latest_virtual_memory_percent()]
+
+
+@register_collector
+class SwapCollector(RateCollector):
+    name = "swap"
+    columns = ["swap_percent", "swap_in_kb_per_sec", "swap_out_kb_per_sec"]
+    counter_fields = ["sin", "sout"]
+    unit = 1024
+
+    def _read_counters(self):
+        return psutil.swap_memory()
+
+    def collect(self):
+        rates = super().collect()
+        # super().collect() で self._previous は今回の値に更新されている
+        swap_memory = self._previous
+        return [swap_memory.percent if swap_memory else None] + rates
+
+
+@register_collector
+class DiskIOCollector(RateCollector):
+    name = "disk_io"
+    columns = ["disk_read_mb_per_sec", "disk_write_mb_per_sec"]
+    counter_fields = ["read_bytes", "write_bytes"]
+    unit = 1024 ** 2
+
+    def _read_counters(self):
+        return psutil.disk_io_counters()
+
+
+@register_collector
+class NetworkCollector(RateCollector):
+    name = "network"
+    columns = ["net_sent_kb_per_sec", "net_recv_kb_per_sec"]
+    counter_fields = ["bytes_sent", "bytes_recv"]
+    unit = 1024
+
+    def _read_counters(self):
+        return psutil.net_io_counters()
+
+
+@register_collector
+class LoadAverageCollector(BaseCollector):
+    name = "load_average"
+    columns = ["load_1min", "load_5min", "load_15min"]
+
+    def collect(self):
+        return [round(load, 2) for load in psutil.getloadavg()]
+
+
+@register_collector
+class TemperatureCollector(BaseCollector):
+    name = "temperature"
+    columns = ["temperature_max"]
+    cost = "medium"
+    interval = 10.0
+
+    def collect(self):
+        '''
+        センサーの中で最も高い温度(℃)を返す
+        取得できない環境(Windows / 仮想マシンなど)では None を返す
+        '''
+        if not hasattr(psutil, "sensors_temperatures"):
+            return [None]
+
+        temperatures = [
+            sensor.current
+            for sensors in psutil.sensors_temperatures().values()
+            for sensor in sensors
+        ]
+        return [max(temperatures) if temperatures else None]
+
+
+@register_collector
+class TopProcessCollector(BaseCollector):
+    name = "top_processes"
+    cost = "high"
+    interval = 10.0
+
+    def __init__(self, top_n=3):
+        self.top_n = top_n
+        self.columns = (
+            [f"top_cpu_{rank}" for rank in range(1, top_n + 1)]
+            + [f"top_rss_{rank}" for rank in range(1, top_n + 1)]
+        )
+        # 初回の cpu_percent は 0 になるので，ここで基準を取っておく
+        self._read_processes()
+
+    def _read_processes(self):
+        processes = []
+        for process in psutil.process_iter(["name", "memory_info"]):
+            try:
+                processes.append((
+                    process.info["name"],
+                    process.cpu_percent(interval=None),
+                    process.info["memory_info"].rss,
+                ))
+
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+
+            except AttributeError:
+                # memory_info を読めなかった(None の)プロセス
+                continue
+
+        return processes
+
+    def _format_top(self, processes, index, format_value):
+        '''
+        processes を index 番目の値が大きい順に top_n 件選び，
+        "名前:値" の文字列のリストにする(足りない分は None)
+        '''
+        top = sorted(
+            processes, key=lambda process: process[index], reverse=True
+        )[:self.top_n]
+        values = [f"{process[0]}:{format_value(process[index])}"
+                  for process in top]
+        return values + [None] * (self.top_n - len(values))
+
+    def collect(self):
+        '''
+        CPU 使用率と RSS が大きいプロセスを上位 top_n 件ずつ
+        "名前:値" の文字列で返す
+        '''
+        processes = self._read_processes()
+        top_cpu = self._format_top(
+            processes, 1, lambda cpu_percent: f"{cpu_percent:.1f}%"
+        )
+        top_rss = self._format_top(
+            processes, 2, lambda rss: f"{rss / 1024 ** 2:.0f}MB"
+        )
+        return top_cpu + top_rss
+
+
+class MetricRegistry:
+    def __init__(self, collectors):
+        assert collectors, "コレクタを1つ以上指定してください"
+
+        self.collectors = collectors
+        # コレクタごとの(最後に計測した時刻, 計測値)
+        self._cache = [(None, None)] * len(collectors)
+
+    @classmethod
+    def from_names(cls, names, instances=None):
+        '''
+        [概要]
+        コレクタの名前のリストから MetricRegistry を作るメソッド
+        instances で名前ごとに作成済みのコレクタを渡すこともできる
+        '''
+        instances = instances or {}
+        collectors = []
+        for name in names:
+            if name in instances:
+                collectors.append(instances[name])
+                continue
+
+            if name not in COLLECTORS:
+                raise ValueError(
+                    f"{name} というコレクタはありません: {list(COLLECTORS)}"
+                )
+            collectors.append(COLLECTORS[name]())
+
+        logger.debug(
+            "> コレクタ: "
+            + ", ".join(f"{c.name}({c.cost}, {c.interval}秒)"
+                        for c in collectors)
+        )
+        return cls(collectors)
+
+    @property
+    def columns(self):
+        '''
+        [概要]
+        read_row() で返す列の名前のリスト
+        '''
+        return [column for c in self.collectors for column in c.columns]
+
+    def read_row(self):
+        '''
+        [概要]
+        全コレクタの計測値をつなげて1行分のリストで返すメソッド
+        interval が経っていないコレクタは前回の値を使う
+        計測に失敗したコレクタの列は None になる
+        '''
+        now = time.monotonic()
+        row = []
+        for index, collector in enumerate(self.collectors):
+            last_time, values = self._cache[index]
+            if last_time is None or now - last_time >= collector.interval:
+                try:
+                    values = collector.collect()
+
+                except Exception as e:
+                    logger.warning(
+                        f">>> {collector.name} の計測に失敗しました: {e}"
+                    )
+                    values = [None] * len(collector.columns)
+                self._cache[index] = (now, values)
+
+            row.extend(values)
+
+        return row
@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+#
+# metric_history.py
+#
+# [概要]
+# ダッシュボードの計測値を手元(プロセス内)に保存し，
+# 1分ごと・1時間ごとの集計値(最小/平均/最大/95パーセンタイル)を
+# 作るプログラム
+#
+# ・RingBuffer: array で確保した固定長の領域に古いものから上書きしていく
+#   リングバッファ．保存件数に上限があるのでメモリは増え続けない
+# ・RollupTier: 計測値を一定時間(1分 / 1時間)ごとにまとめて集計する
+# ・MetricHistory: 生の計測値と各集計値をまとめて管理し，
+#   バイナリファイルに保存・読み込みする
+# ・HistoryRecorder: BufferedSheetWriter の前に挟んで，
+#   計測値を MetricHistory に記録しつつ，
+#   生の値 or 集計値だけをシートに書き込む
+#
+# 集計値だけをシートに書き込むモードにすると，
+# シートの行数が 1/60(1分) or 1/3600(1時間) になるので
+# シートが軽くなり，細かい値は手元のファイルに残る．
+#
+
+from array import array
+from datetime import datetime
+from logging import getLogger
+from pathlib import Path
+import json
+import math
+import os
+import struct
+import tempfile
+import time
+
+# 専用のロガーを作成
+logger = getLogger(__name__)
+
+
+class RingBuffer:
+    def __init__(self, capacity, width):
+        assert capacity > 0, "capacityは1以上で指定"
+        assert width > 0, "widthは1以上で指定"
+
+        self.capacity = capacity
+        self.width = width
+        # 欠損値(数値でない計測値)は NaN で表す
+        self.timestamps = array("d", [math.nan]) * capacity
+        self.values = array("d", [math.nan]) * (capacity * width)
+        # 次に書き込む位置と，保存されている件数
+        self.head = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, values):
+        '''
+        [概要]
+        1件分の値を追加するメソッド
+        満杯の場合は最も古い値を上書きする
+        '''
+        assert len(values) == self.width, "値の数が width と違います"
+
+        offset = self.head * self.width
+        self.timestamps[self.head] = timestamp
+        self.values[offset:offset + self.width] = array("d", values)
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def __iter__(self):
+        '''
+        [概要]
+        古い順に(時刻, 値のリスト)を返すジェネレータメソッド
+        '''
+        start = (self.head - self.count) % self.capacity
+        for step in range(self.count):
+            index = (start + step) % self.capacity
+            offset = index * self.width
+            yield (
+                self.timestamps[index],
+                self.values[offset:offset + self.width].tolist()
+            )
+
+    def to_bytes(self):
+        return self.timestamps.tobytes() + self.values.tobytes()
+
+    def load_bytes(self, data, head, count):
+        '''
+        [概要]
+        to_bytes() で書き出した内容を読み込むメソッド
+        '''
+        timestamps_size = self.capacity * self.timestamps.itemsize
+        timestamps = array("d")
+        timestamps.frombytes(data[:timestamps_size])
+        values = array("d")
+        values.frombytes(data[timestamps_size:])
+        assert len(timestamps) == self.capacity \
+            and len(values) == self.capacity * self.width, \
+            "ファイルの大きさが capacity / width と合いません"
+
+        self.timestamps = timestamps
+        self.values = values
+        self.head = head
+        self.count = count
+        return True
+
+
+class RollupTier:
+    # 1列あたりの集計値
+    STATS = ["min", "avg", "max", "p95"]
+
+    def __init__(self, name, resolution, capacity, width):
+        assert resolution > 0, "resolutionは正の数で指定"
+
+        self.name = name
+        self.resolution = resolution
+        self.width = width
+        self.ring = RingBuffer(capacity, width * len(self.STATS))
+
+        # 集計中の区間の開始時刻と，列ごとの計測値
+        self._bucket_start = None
+        self._bucket = [array("d") for _ in range(width)]
+
+    def _summarize(self, samples):
+        '''
+        [概要]
+        1列分の計測値から [最小, 平均, 最大, 95パーセンタイル] を返すメソッド
+        '''
+        samples = sorted(value for value in samples if not math.isnan(value))
+        if not samples:
+            return [math.nan] * len(self.STATS)
+
+        # 95パーセンタイルは nearest-rank 法で求める
+        p95 = samples[max(math.ceil(len(samples) * 0.95) - 1, 0)]
+        return [
+            samples[0], sum(samples) / len(samples), samples[-1], p95
+        ]
+
+    def _close_bucket(self):
+        '''
+        [概要]
+        集計中の区間を集計して ring に追加し，(開始時刻, 集計値)を返すメソッド
+        '''
+        rollup = []
+        for samples in self._bucket:
+            rollup.extend(self._summarize(samples))
+        self.ring.append(self._bucket_start, rollup)
+
+        closed = (self._bucket_start, rollup)
+        self._bucket = [array("d") for _ in range(self.width)]
+        return closed
+
+    def add(self, timestamp, values):
+        '''
+        [概要]
+        計測値を集計中の区間に追加するメソッド
+        新しい区間に入った場合は，終わった区間の(開始時刻, 集計値)を返す
+        '''
+        bucket_start = timestamp - timestamp % self.resolution
+        closed = None
+        if self._bucket_start is not None and bucket_start != self._bucket_start:
+            closed = self._close_bucket()
+
+        self._bucket_start = bucket_start
+        for samples, value in zip(self._bucket, values):
+            samples.append(value)
+
+        return closed
+
+
+class MetricHistory:
+    MAGIC = b"VMHIST01"
+
+    def __init__(self, columns, raw_capacity=3600, minute_capacity=1440,
+                 hour_capacity=24 * 30):
+        assert columns, "列を1つ以上指定してください"
+
+        self.columns = list(columns)
+        width = len(self.columns)
+        self.raw = RingBuffer(raw_capacity, width)
+        self.tiers = {
+            "minute": RollupTier("minute", 60, minute_capacity, width),
+            "hour": RollupTier("hour", 3600, hour_capacity, width),
+        }
+
+    def _to_float(self, value):
+        '''
+        [概要]
+        計測値を float にするメソッド
+        数値でない値(プロセス名の文字列や None)は NaN にする
+        '''
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(value)
+        return math.nan
+
+    def add(self, values, timestamp=None):
+        '''
+        [概要]
+        1件分の計測値を記録するメソッド
+        区間が終わった集計値を {tier 名: (開始時刻, 集計値)} で返す
+        '''
+        timestamp = time.time() if timestamp is None else timestamp
+        numbers = [self._to_float(value) for value in values]
+        self.raw.append(timestamp, numbers)
+
+        closed = {}
+        for name, tier in self.tiers.items():
+            rollup = tier.add(timestamp, numbers)
+            if rollup is not None:
+                closed[name] = rollup
+
+        return closed
+
+    def rollup_columns(self):
+        '''
+        [概要]
+        集計値1件分の列の名前を返すメソッド
+        '''
+        return [
+            f"{column}_{stat}"
+            for column in self.columns for stat in RollupTier.STATS
+        ]
+
+    def _rings(self):
+        yield "raw", self.raw
+        for name, tier in self.tiers.items():
+            yield name, tier.ring
+
+    def save(self, history_path):
+        '''
+        [概要]
+        全ての ring をバイナリファイルに保存するメソッド
+        先頭に MAGIC と JSON のヘッダ(列名と各 ring の大きさ)を書き，
+        その後に各 ring の array をそのまま書き出す
+        一時ファイルに書いてから置き換えるので，途中で落ちても壊れない
+        '''
+        assert isinstance(history_path, Path), "Pathオブジェクトで指定"
+
+        header = {
+            "columns": self.columns,
+            "rings": [
+                {"name": name, "capacity": ring.capacity,
+                 "width": ring.width, "head": ring.head,
+                 "count": ring.count}
+                for name, ring in self._rings()
+            ],
+        }
+        header_bytes = json.dumps(header).encode("utf-8")
+
+        history_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=history_path.parent, prefix=f".{history_path.name}.",
+            suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, mode="wb") as f:
+                f.write(self.MAGIC)
+                f.write(struct.pack("<I", len(header_bytes)))
+                f.write(header_bytes)
+                for _, ring in self._rings():
+                    f.write(ring.to_bytes())
+            os.replace(tmp_path, history_path)
+
+        except Exception:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+        logger.debug(f"> 計測履歴を保存しました: {history_path}")
+        return True
+
+    def load(self, history_path):
+        '''
+        [概要]
+        save() で保存したファイルを読み込むメソッド
+        列や大きさが今の設定と違う場合は読み込まずに False を返す
+        '''
+        assert isinstance(history_path, Path), "Pathオブジェクトで指定"
+
+        try:
+            data = history_path.read_bytes()
+
+        except FileNotFoundError:
+            return False
+
+        magic_size = len(self.MAGIC)
+        if data[:magic_size] != self.MAGIC:
+            logger.warning(f">>> 計測履歴のファイルではありません: {history_path}")
+            return False
+
+        rings = dict(self._rings())
+        try:
+            header_size, = struct.unpack_from("<I", data, magic_size)
+            offset = magic_size + 4
+            header = json.loads(data[offset:offset + header_size])
+            offset += header_size
+
+            layout = [
+                (ring_info["name"], ring_info["capacity"], ring_info["width"])
+                for ring_info in header["rings"]
+            ]
+            expected = [
+                (name, ring.capacity, ring.width)
+                for name, ring in rings.items()
+            ]
+            if header["columns"] != self.columns or layout != expected:
+                logger.warning(
+                    ">>> 列や保存件数が変わったので計測履歴を読み込みません"
+                )
+                return False
+
+            # 途中まで読み込んだ状態にならないよう，全て確認してから反映する
+            loaded = []
+            for ring_info in header["rings"]:
+                ring = RingBuffer(ring_info["capacity"], ring_info["width"])
+                size = ring.capacity * (1 + ring.width) * 8
+                head, count = ring_info["head"], ring_info["count"]
+                assert 0 <= head < ring.capacity \
+                    and 0 <= count <= ring.capacity, \
+                    "head / count が capacity の範囲外です"
+                ring.load_bytes(data[offset:offset + size], head, count)
+                loaded.append((rings[ring_info["name"]], ring))
+                offset += size
+
+        except (struct.error, ValueError, KeyError, TypeError,
+                AssertionError) as e:
+            # json.JSONDecodeError / UnicodeDecodeError は ValueError の仲間
+            logger.warning(
+                f">>> 計測履歴のファイルが壊れているので読み込みません: "
+                f"{history_path} ({e})"
+            )
+            return False
+
+        for ring, loaded_ring in loaded:
+            ring.timestamps = loaded_ring.timestamps
+            ring.values = loaded_ring.values
+            ring.head = loaded_ring.head
+            ring.count = loaded_ring.count
+
+        logger.info(
+            f">> 計測履歴を読み込みました: {history_path} "
+            f"({len(self.raw)} 件)"
+        )
+        return True
+
+
+class HistoryRecorder:
+    def __init__(self, history, sheet_writer, upload_tier=None,
+                 history_path=None, save_interval=60.0):
+        assert upload_tier is None or upload_tier in history.tiers, \
+            f"upload_tierは None か {list(history.tiers)} のどれかで指定"
+
+        self.history = history
+        self.sheet_writer = sheet_writer
+        self.upload_tier = upload_tier
+        self.history_path = history_path
+        self.save_interval = save_interval
+        self._last_save = time.monotonic()
+        # 記録済みだが sheet_writer にまだ受け付けられていない行
+        # (MetricUploader は失敗した行を同じオブジェクトのまま送り直す)
+        self._unsent_row = None
+        # 区間が終わったがまだ sheet_writer に渡せていない集計値の行
+        self._pending_rollups = []
+
+    @property
+    def api_calls(self):
+        return self.sheet_writer.api_calls
+
+    def append(self, row):
+        '''
+        [概要]
+        計測値を記録し，シートに書き込む分を sheet_writer に渡すメソッド
+        upload_tier が None なら生の値を，
+        "minute" / "hour" ならその区間が終わった時の集計値だけを渡す
+        sheet_writer が例外を出した場合は，同じ行で呼び直されても
+        二重に記録せず，渡せなかった集計値も次の呼び出しで渡し直す
+        '''
+        if row is not self._unsent_row:
+            closed = self.history.add(row)
+            self._unsent_row = row
+            if self.upload_tier in closed:
+                self._pending_rollups.append(
+                    self._format_rollup(*closed[self.upload_tier])
+                )
+            self._save_if_due()
+
+        if self.upload_tier is None:
+            result = self.sheet_writer.append(row)
+        else:
+            result = True
+            while self._pending_rollups:
+                result = self.sheet_writer.append(self._pending_rollups[0])
+                self._pending_rollups.pop(0)
+
+        self._unsent_row = None
+        return result
+
+    def _format_rollup(self, bucket_start, rollup):
+        '''
+        [概要]
+        集計値をシートに書き込む1行(開始時刻 + 集計値)にするメソッド
+        '''
+        started_at = datetime.fromtimestamp(bucket_start)
+        # シートには NaN を書けないので空欄(None)にする
+        return [started_at.strftime("%Y-%m-%d %H:%M")] + [
+            None if math.isnan(value) else round(value, 2)
+            for value in rollup
+        ]
+
+    def _save_if_due(self):
+        if self.history_path is None:
+            return False
+        if time.monotonic() - self._last_save < self.save_interval:
+            return False
+        return self.save()
+
+    def save(self):
+        '''
+        [概要]
+        計測履歴をファイルに保存するメソッド
+        保存に失敗しても計測は止めない
+        '''
+        if self.history_path is None:
+            return False
+
+        self._last_save = time.monotonic()
+        try:
+            return self.history.save(self.history_path)
+
+        except Exception as e:
+            logger.warning(f">>> 計測履歴を保存できませんでした: {e}")
+            return False
+
+    def flush_if_due(self):
+        self._save_if_due()
+        return self.sheet_writer.flush_if_due()
+
+    def flush(self):
+        self.save()
+        return self.sheet_writer.flush()
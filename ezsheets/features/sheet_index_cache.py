@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+#
+# sheet_index_cache.py
+#
+# [概要]
+# スプレッドシートのタイトルとIDの対応表(索引)を
+# ファイルにキャッシュするプログラム
+#
+# ezsheets.listSpreadsheets() は Drive 上の全ファイルを一覧するので，
+# シート名から ID を調べるたびに呼ぶと時間がかかる．
+# 一度取得した一覧を タイトル -> ID と ID -> タイトル の
+# 2つの辞書にしてファイルに保存し，ttl 秒間は使い回す．
+#
+# シートを新しく作った(アップロードした)場合は add() で索引に追加し，
+# 索引のIDが使えなかった場合は invalidate() で作り直す．
+#
+
+from logging import getLogger
+from pathlib import Path
+import json
+import os
+import tempfile
+import time
+
+# 専用のロガーを作成
+logger = getLogger(__name__)
+
+
+class SheetIndexCache:
+    def __init__(self, cache_path=Path("./sheet_index_cache.json"),
+                 ttl=3600.0):
+        assert isinstance(cache_path, Path), "Pathオブジェクトで指定"
+
+        self.cache_path = cache_path
+        self.ttl = ttl
+
+        self._title_to_id = {}
+        self._id_to_title = {}
+        # 一覧を取得した時刻(None なら未取得 or 無効)
+        self._created_at = None
+        self._load()
+
+    def __len__(self):
+        return len(self._id_to_title)
+
+    def _load(self):
+        '''
+        [概要]
+        キャッシュファイルから索引を読み込むメソッド
+        '''
+        try:
+            with open(self.cache_path, mode="r", encoding="utf-8") as f:
+                cache = json.load(f)
+            self._id_to_title = dict(cache["sheets"])
+            self._title_to_id = dict(cache["titles"])
+            self._created_at = cache["created_at"]
+
+        except FileNotFoundError:
+            return False
+
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f">>> 索引を読み込めないので作り直します: {e}")
+            return False
+
+        logger.debug(f"> 索引を読み込みました: {len(self)} 件")
+        return True
+
+    def _save(self):
+        '''
+        [概要]
+        索引をキャッシュファイルに保存するメソッド
+        一時ファイルに書いてから置き換える
+        '''
+        cache_dir = self.cache_path.parent
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=cache_dir, prefix=f".{self.cache_path.name}.", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, mode="w", encoding="utf-8") as f:
+                json.dump(
+                    {"created_at": self._created_at,
+                     "sheets": self._id_to_title,
+                     "titles": self._title_to_id},
+                    f, ensure_ascii=False, indent=4
+                )
+            os.replace(tmp_path, self.cache_path)
+
+        except Exception as e:
+            Path(tmp_path).unlink(missing_ok=True)
+            # 保存できなくても索引はメモリ上で使える
+            logger.warning(f">>> 索引を保存できませんでした: {e}")
+            return False
+
+        return True
+
+    def _build(self, sheets_dict):
+        self._id_to_title = dict(sheets_dict)
+        self._title_to_id = {}
+        for sheet_id, title in self._id_to_title.items():
+            # 同じタイトルが複数ある場合は一覧で先に出てきた方を使う
+            self._title_to_id.setdefault(title, sheet_id)
+
+    def is_expired(self):
+        '''
+        [概要]
+        索引が無い or ttl 秒以上経って古くなっているかを返すメソッド
+        '''
+        if self._created_at is None:
+            return True
+        return time.time() - self._created_at >= self.ttl
+
+    def refresh(self, sheets_dict):
+        '''
+        [概要]
+        listSpreadsheets() の結果({ID: タイトル})で索引を作り直すメソッド
+        '''
+        self._build(sheets_dict)
+        self._created_at = time.time()
+        self._save()
+        logger.debug(f"> 索引を作り直しました: {len(self)} 件")
+        return True
+
+    def find_id(self, title):
+        '''
+        [概要]
+        タイトルからIDを返すメソッド．見つからなければ None
+        '''
+        return self._title_to_id.get(title)
+
+    def find_title(self, sheet_id):
+        '''
+        [概要]
+        IDからタイトルを返すメソッド．見つからなければ None
+        '''
+        return self._id_to_title.get(sheet_id)
+
+    def add(self, sheet_id, title):
+        '''
+        [概要]
+        新しく作ったスプレッドシートを索引に追加するメソッド
+        同じタイトルがあっても新しいシートの方を優先する
+        '''
+        old_title = self._id_to_title.get(sheet_id)
+        if old_title is not None and self._title_to_id.get(old_title) == sheet_id:
+            del self._title_to_id[old_title]
+
+        self._id_to_title[sheet_id] = title
+        self._title_to_id[title] = sheet_id
+        if self._created_at is not None:
+            self._save()
+        return True
+
+    def invalidate(self):
+        '''
+        [概要]
+        索引を無効にして，次の検索で一覧を取得し直させるメソッド
+        '''
+        self._created_at = None
+        self.cache_path.unlink(missing_ok=True)
+        logger.debug("> 索引を無効にしました")
+        return True
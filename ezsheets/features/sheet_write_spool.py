@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+#
+# sheet_write_spool.py
+#
+# [概要]
+# スプレッドシートへの書き込みを一度ファイル(スプール)に記録してから
+# 送信し，失敗した分は後で再送するプログラム
+#
+# ネットワークの瞬断や API の利用上限で書き込みに失敗すると，
+# これまでは例外で main() の無限ループごと止まっていた．
+# SheetWriteSpool は SyncWithGoogleSheets と同じ
+# edit_sheet_cell() / edit_sheet_rows() を持ち，
+# ・書き込み内容をスプールファイルに追記(fsync)してから送信する
+# ・送信に失敗したら例外を出さずに残し，指数バックオフで再送する
+# ・同じ範囲への書き込みが溜まった場合は1つにまとめる(後の内容を優先)
+# ・プログラムを再起動したらスプールを読み込んで未送信分を再送する
+#
+# スプールファイルは1行1レコードの追記専用ファイルで，
+# 各行の先頭に CRC32 を付けている．
+# 書き込み途中で落ちて壊れた末尾の行は読み込み時に無視する．
+#
+# 新しい書き込みの送信先は作成時に決めたスプレッドシート(spreadsheet_id)で，
+# 前回の実行の書き込みを別のスプレッドシートへ再送しても変わらない．
+#
+# 送信先(backend)は差し替えられるので，
+# FakeSheetsBackend を使えば Google に接続せずに動作を確認できる．
+#
+
+try:
+    from features.rate_limiter import RateLimiter
+
+except:
+    from rate_limiter import RateLimiter
+
+from logging import getLogger
+from pathlib import Path
+import json
+import os
+import random
+import tempfile
+import time
+import zlib
+
+# 専用のロガーを作成
+logger = getLogger(__name__)
+
+# 送り直しても成功しない(リクエストが間違っている)HTTP ステータス
+# (BufferedSheetWriter も同じ判定を使う)
+PERMANENT_STATUSES = (400, 403, 404)
+
+
+def is_permanent_error(e):
+    '''
+    [概要]
+    送り直しても成功しないエラーかどうかを判定する関数
+    403 でも利用上限(rateLimitExceeded など)の場合は
+    時間を置けば通るので送り直す対象にする
+    '''
+    if isinstance(e, (AssertionError, ValueError, TypeError)):
+        return True
+    if RateLimiter.is_quota_error(e):
+        return False
+    status = getattr(getattr(e, "resp", None), "status", None)
+    return status in PERMANENT_STATUSES
+
+
+class SpoolFullError(Exception):
+    '''
+    未送信の書き込みが上限に達したときに送出する例外
+    '''
+    pass
+
+
+class SheetWriteSpool:
+    def __init__(self, backend, spool_path=Path("./sheet_write_spool.log"),
+                 base_backoff=1.0, max_backoff=300.0, max_pending=10000,
+                 compact_threshold=1000, spreadsheet_id=None):
+        '''
+        spreadsheet_id を省略した場合は作成時に backend が開いている
+        スプレッドシートに書き込む
+        '''
+        assert isinstance(spool_path, Path), "Pathオブジェクトで指定"
+
+        self.backend = backend
+        # 新しい書き込みの送信先
+        # (再送で backend.ss が切り替わっても影響されないように固定する)
+        self.spreadsheet_id = spreadsheet_id or backend.ss.id
+        self.spool_path = spool_path
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.max_pending = max_pending
+        self.compact_threshold = compact_threshold
+
+        # 未送信の書き込み(書き込み先 -> レコード)．古い順に並んでいる
+        self._pending = {}
+        self._next_seq = 1
+        # スプールファイルの行数(圧縮するかどうかの判断に使う)
+        self._spool_records = 0
+
+        # 再送の状態
+        self.failures = 0
+        self._retry_at = 0.0
+
+        # 監視用のカウンタ
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+        self._load()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _make_key(self, record):
+        return (
+            record["spreadsheet_id"], record["sheet_num"],
+            record["op"], record["target"]
+        )
+
+    def _apply(self, record):
+        '''
+        [概要]
+        レコードを未送信の書き込みに反映するメソッド
+        書き込み時とスプールの読み込み時で同じ処理を使うので，
+        再起動しても同じ状態(まとめ方)が再現される
+        '''
+        self._next_seq = max(self._next_seq, record["seq"] + 1)
+
+        if "done" in record:
+            # 送信済み(or 破棄)の記録
+            key = tuple(record["done"])
+            pending = self._pending.get(key)
+            if pending is not None and pending["seq"] == record["done_seq"]:
+                del self._pending[key]
+            return None
+
+        key = self._make_key(record)
+        previous = self._pending.get(key)
+        if previous is not None:
+            # 同じ範囲への書き込みは1つにまとめる
+            # 行の場合は新しい行で上書きし，はみ出た古い行は残す
+            if record["op"] == "rows":
+                record = dict(record)
+                record["data"] = (
+                    record["data"] + previous["data"][len(record["data"]):]
+                )
+            self.coalesced += 1
+
+        # dict の値の更新では順番が変わらないので，最初の書き込みの位置で送る
+        self._pending[key] = record
+        return record
+
+    def _encode(self, record):
+        payload = json.dumps(record, ensure_ascii=False)
+        checksum = zlib.crc32(payload.encode("utf-8"))
+        return f"{checksum:08x} {payload}\n"
+
+    def _load(self):
+        '''
+        [概要]
+        スプールファイルを読み込んで未送信の書き込みを復元するメソッド
+        CRC が合わない行(書き込み途中で落ちた行)から後ろは無視する
+        '''
+        try:
+            with open(self.spool_path, mode="r", encoding="utf-8") as f:
+                lines = f.readlines()
+
+        except FileNotFoundError:
+            return False
+
+        for line_num, line in enumerate(lines, start=1):
+            checksum, _, payload = line.rstrip("\n").partition(" ")
+            try:
+                if not line.endswith("\n") or \
+                        int(checksum, 16) != zlib.crc32(payload.encode("utf-8")):
+                    raise ValueError("CRC が一致しません")
+                record = json.loads(payload)
+
+            except ValueError as e:
+                logger.warning(
+                    f">>> スプールの {line_num} 行目以降は壊れているので"
+                    f"無視します: {e}"
+                )
+                break
+
+            self._apply(record)
+            self._spool_records += 1
+
+        self.coalesced = 0
+        logger.info(
+            f">> スプールから未送信の書き込みを {len(self._pending)} 件"
+            f"読み込みました"
+        )
+        # 壊れた行や送信済みの記録を取り除いておく
+        self._compact()
+        return True
+
+    def _append_records(self, records):
+        '''
+        [概要]
+        レコードをスプールファイルに追記するメソッド
+        fsync まで行うので，戻った時点で電源が落ちても消えない
+        '''
+        self.spool_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.spool_path, mode="a", encoding="utf-8") as f:
+            f.writelines(self._encode(record) for record in records)
+            f.flush()
+            os.fsync(f.fileno())
+        self._spool_records += len(records)
+
+    def _compact(self):
+        '''
+        [概要]
+        未送信の書き込みだけでスプールファイルを作り直すメソッド
+        一時ファイルに書いてから置き換える
+        '''
+        self.spool_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.spool_path.parent, prefix=f".{self.spool_path.name}.",
+            suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, mode="w", encoding="utf-8") as f:
+                f.writelines(
+                    self._encode(record) for record in self._pending.values()
+                )
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.spool_path)
+
+        except Exception:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+        self._spool_records = len(self._pending)
+        logger.debug(f"> スプールを圧縮しました: {self._spool_records} 件")
+        return True
+
+    def _record(self, op, target, data, sheet_num):
+        if len(self._pending) >= self.max_pending:
+            raise SpoolFullError(
+                f"未送信の書き込みが上限({self.max_pending} 件)に達しました"
+            )
+
+        record = {
+            "seq": self._next_seq,
+            "spreadsheet_id": self.spreadsheet_id,
+            "sheet_num": sheet_num,
+            "op": op,
+            "target": target,
+            "data": data,
+        }
+        self._append_records([record])
+        self._apply(record)
+
+    def edit_sheet_cell(self, cell, data, sheet_num=0):
+        '''
+        [概要]
+        セルへの書き込みをスプールに記録してから送信するメソッド
+        送信に失敗しても例外は出さず，後で再送する
+        '''
+        self._record("cell", cell, data, sheet_num)
+        self.replay()
+        return True
+
+    def edit_sheet_rows(self, start_row, rows, sheet_num=0):
+        '''
+        [概要]
+        複数行への書き込みをスプールに記録してから送信するメソッド
+        送信に失敗しても例外は出さず，後で再送する
+        '''
+        self._record("rows", start_row, rows, sheet_num)
+        self.replay()
+        return True
+
+    def _send(self, record):
+        '''
+        [概要]
+        レコードを1件送信するメソッド
+        送信先のスプレッドシートに切り替え，送信後は元に戻す
+        '''
+        previous_ss = getattr(self.backend, "ss", None)
+        try:
+            self.backend.open_spreadsheet(record["spreadsheet_id"])
+            if record["op"] == "cell":
+                self.backend.edit_sheet_cell(
+                    record["target"], record["data"], record["sheet_num"]
+                )
+            else:
+                self.backend.edit_sheet_rows(
+                    record["target"], record["data"], record["sheet_num"]
+                )
+
+        finally:
+            self.backend.ss = previous_ss
+
+    def replay(self, force=False):
+        '''
+        [概要]
+        未送信の書き込みを古い順に送信するメソッド
+        失敗したらそこで止め，指数バックオフで次に送る時刻を決める
+        (書き込みの順番が入れ替わらないように後ろの分も送らない)
+        バックオフ中は force=True の場合だけ送信する
+        送信できた件数を返す
+        '''
+        if not self._pending:
+            return 0
+        if not force and time.monotonic() < self._retry_at:
+            return 0
+
+        sent = 0
+        done = []
+        try:
+            for key, record in list(self._pending.items()):
+                try:
+                    self._send(record)
+                    self.sent += 1
+                    sent += 1
+
+                except Exception as e:
+                    if not is_permanent_error(e):
+                        self._schedule_retry(e)
+                        break
+
+                    self.dropped += 1
+                    logger.error(
+                        f">>>> 送信できない書き込みを破棄します "
+                        f"({record['op']} {record['target']}): {e}"
+                    )
+
+                done.append({
+                    "seq": self._next_seq + len(done),
+                    "done": list(key), "done_seq": record["seq"],
+                })
+
+            else:
+                self.failures = 0
+                self._retry_at = 0.0
+
+        finally:
+            if done:
+                self._append_records(done)
+                for record in done:
+                    self._apply(record)
+
+        if self._spool_records >= self.compact_threshold:
+            self._compact()
+
+        return sent
+
+    def _schedule_retry(self, e):
+        self.failures += 1
+        backoff = min(
+            self.base_backoff * 2 ** (self.failures - 1), self.max_backoff
+        )
+        # 複数の PC が同時に再送しないように揺らぎを入れる
+        backoff *= random.uniform(0.5, 1.0)
+        self._retry_at = time.monotonic() + backoff
+        logger.warning(
+            f">>> 書き込みに失敗したので {backoff:.1f} 秒後に再送します "
+            f"(未送信 {len(self._pending)} 件, {self.failures} 回目): {e}"
+        )
+
+
+class FakeSheetsBackend:
+    '''
+    動作確認用の送信先
+    SyncWithGoogleSheets の代わりに，書き込みを手元の辞書に保存する
+    fail_count 回だけ送信に失敗する
+    '''
+    class _Spreadsheet:
+        def __init__(self, spreadsheet_id):
+            self.id = spreadsheet_id
+
+    def __init__(self, spreadsheet_id="fake", fail_count=0):
+        self.ss = self._Spreadsheet(spreadsheet_id)
+        self.fail_count = fail_count
+        # (スプレッドシートID, シート番号) -> {(行, 列): 値}
+        self.cells = {}
+        self.api_calls = 0
+
+    def open_spreadsheet(self, spreadsheet_id):
+        self.ss = self._Spreadsheet(spreadsheet_id)
+        return True
+
+    def _check_failure(self):
+        self.api_calls += 1
+        if self.fail_count > 0:
+            self.fail_count -= 1
+            raise ConnectionError("fake network error")
+
+    def edit_sheet_cell(self, cell, data, sheet_num=0):
+        self._check_failure()
+        column = "".join(char for char in cell if char.isalpha())
+        row = int(cell[len(column):])
+        grid = self.cells.setdefault((self.ss.id, sheet_num), {})
+        grid[(row, column)] = data
+        return True
+
+    def edit_sheet_rows(self, start_row, rows, sheet_num=0):
+        self._check_failure()
+        grid = self.cells.setdefault((self.ss.id, sheet_num), {})
+        for row_offset, row in enumerate(rows):
+            for column_index, value in enumerate(row, start=1):
+                grid[(start_row + row_offset, column_index)] = value
+        return True
+
+
+if __name__ == "__main__":
+    # FakeSheetsBackend で失敗 -> 再送 -> 再起動後の再送を確認する
+    import logging
+
+    logging.basicConfig(level=logging.DEBUG)
+    spool_path = Path("./sheet_write_spool_demo.log")
+    spool_path.unlink(missing_ok=True)
+
+    backend = FakeSheetsBackend(fail_count=2)
+    spool = SheetWriteSpool(backend, spool_path, base_backoff=0.0)
+    spool.edit_sheet_rows(35, [[1.0, 10.0], [2.0, 11.0]])
+    spool.edit_sheet_rows(35, [[1.0, 10.0], [2.0, 11.0], [3.0, 12.0]])
+    logger.info(f">> 未送信: {len(spool)} 件 (まとめた数: {spool.coalesced})")
+
+    # 再起動したつもりでスプールを読み直す
+    restarted = SheetWriteSpool(backend, spool_path, base_backoff=0.0)
+    restarted.replay(force=True)
+    logger.info(f">> 未送信: {len(restarted)} 件, 書き込み結果: {backend.cells}")
+    spool_path.unlink(missing_ok=True)
+
+    # 前回の実行(別のスプレッドシート)の書き込みを再送した後でも，
+    # 新しい書き込みは今回のスプレッドシートに届くことを確認する
+    old_backend = FakeSheetsBackend("OLD", fail_count=1)
+    SheetWriteSpool(old_backend, spool_path).edit_sheet_rows(35, [[1.0]])
+
+    new_backend = FakeSheetsBackend("NEW")
+    spool = SheetWriteSpool(new_backend, spool_path, base_backoff=0.0)
+    spool.replay(force=True)
+    spool.edit_sheet_rows(36, [[2.0]])
+    assert new_backend.cells[("OLD", 0)] == {(35, 1): 1.0}, \
+        "前回の書き込みは前回のスプレッドシートに再送される"
+    assert new_backend.cells[("NEW", 0)] == {(36, 1): 2.0}, \
+        "今回の書き込みは今回のスプレッドシートに届く"
+    assert new_backend.ss.id == "NEW", "再送後は元のスプレッドシートに戻る"
+    logger.info(f">> 再送後の書き込み結果: {new_backend.cells}")
+    spool_path.unlink(missing_ok=True)
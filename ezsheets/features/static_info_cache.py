@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+#
+# static_info_cache.py
+#
+# [概要]
+# CPU のブランド名やメモリ総量などの
+# 静的(PC稼働中に変化しない)情報をファイルにキャッシュするプログラム
+#
+# cpuinfo.get_cpu_info() はサブプロセスを起動することもあり，
+# 1回の取得に数秒かかる場合がある．
+# 一度取得した値を JSON ファイルに保存しておき，
+# 次回以降の起動ではファイルから読み込むことで起動時間を短縮する．
+#
+# キャッシュは「起動ID(boot ID) + ホスト名」で識別しているので，
+# 再起動した場合や別の PC にファイルを持っていった場合は
+# 自動的に作り直される．
+# 値は項目ごとに必要になった時点で取得(遅延読み込み)する．
+#
+
+from logging import getLogger
+from pathlib import Path
+import json
+import os
+import socket
+import tempfile
+
+import psutil
+
+# 専用のロガーを作成
+logger = getLogger(__name__)
+
+
+class StaticInfoCache:
+    # Linux で起動ごとに変わる ID が書かれているファイル
+    BOOT_ID_PATH = Path("/proc/sys/kernel/random/boot_id")
+
+    def __init__(self, cache_path=Path("./static_info_cache.json")):
+        assert isinstance(cache_path, Path), "Pathオブジェクトで指定"
+
+        self.cache_path = cache_path
+        self.key = self._make_key()
+        self._fields = None
+
+    def _read_boot_id(self):
+        '''
+        [概要]
+        起動ごとに変わる ID を返すメソッド
+        Linux 以外では起動時刻で代用する
+        '''
+        try:
+            return self.BOOT_ID_PATH.read_text().strip()
+
+        except OSError:
+            return str(int(psutil.boot_time()))
+
+    def _make_key(self):
+        return {
+            "boot_id": self._read_boot_id(),
+            "hostname": socket.gethostname(),
+        }
+
+    def _read_cache_file(self):
+        '''
+        [概要]
+        キャッシュファイルを読み込み，キーが一致すれば項目の辞書を返すメソッド
+        ファイルが無い・壊れている・キーが違う場合は空の辞書を返す
+        '''
+        try:
+            with open(self.cache_path, mode="r", encoding="utf-8") as f:
+                cache = json.load(f)
+
+        except FileNotFoundError:
+            return {}
+
+        except (OSError, ValueError) as e:
+            logger.warning(f">>> キャッシュを読み込めないので作り直します: {e}")
+            return {}
+
+        if not isinstance(cache, dict) or cache.get("key") != self.key:
+            logger.debug("> 再起動 or 別の PC のキャッシュなので作り直します")
+            return {}
+
+        return cache.get("fields", {})
+
+    def _load(self):
+        if self._fields is None:
+            self._fields = self._read_cache_file()
+            logger.debug(
+                f"> キャッシュから {len(self._fields)} 項目を読み込みました"
+            )
+        return self._fields
+
+    def _save(self):
+        '''
+        [概要]
+        項目をキャッシュファイルに保存するメソッド
+        他のインスタンスが保存した項目も消さないように，
+        ファイルの内容と統合してから一時ファイル経由で置き換える
+        '''
+        fields = self._read_cache_file() | self._fields
+        cache_dir = self.cache_path.parent
+        cache_dir.mkdir(parents=True, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(
+            dir=cache_dir, prefix=f".{self.cache_path.name}.", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, mode="w", encoding="utf-8") as f:
+                json.dump(
+                    {"key": self.key, "fields": fields}, f,
+                    ensure_ascii=False, indent=4
+                )
+            os.replace(tmp_path, self.cache_path)
+
+        except Exception:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+        self._fields = fields
+
+    def get(self, field, loader):
+        '''
+        [概要]
+        項目の値を返すメソッド
+        キャッシュに無い場合だけ loader() を呼び出して取得し，保存する
+        '''
+        fields = self._load()
+        if field in fields:
+            return fields[field]
+
+        value = loader()
+        fields[field] = value
+        try:
+            self._save()
+
+        except Exception as e:
+            # 保存できなくても値は返す(次回の起動で取得し直す)
+            logger.warning(f">>> キャッシュを保存できませんでした: {e}")
+
+        return value
+
+    def clear(self):
+        '''
+        [概要]
+        キャッシュファイルを削除するメソッド
+        '''
+        self._fields = {}
+        self.cache_path.unlink(missing_ok=True)
+        return True
@@ -7,6 +7,12 @@
 # 取得して返すプログラム
 #
 
+try:
+    from features.static_info_cache import StaticInfoCache
+
+except:
+    from static_info_cache import StaticInfoCache
+
 import cpuinfo
 import platform
 import psutil
@@ -18,23 +24,51 @@ logger = getLogger(__name__)
 
 
 class SyncCPU:
-    def __init__(self):
-        self.cpu_info = cpuinfo.get_cpu_info()
+    # guest / guest_nice は user / nice に含まれているので合計から除く
+    EXCLUDED_TIMES = ("guest", "guest_nice")
+    # 使用中ではない(待機中の)時間
+    IDLE_TIMES = ("idle", "iowait")
+
+    def __init__(self, static_info_cache=None):
+        # 静的情報はキャッシュから読み，無い項目だけ取得する
+        self.static_info_cache = static_info_cache or StaticInfoCache()
+        self._cpu_info = None
+        # read_cores_utilities() の差分計算に使う前回の cpu_times
+        # 全体用(False)とコアごと用(True)で別々に持つ
+        self._previous_cpu_times = {
+            False: [psutil.cpu_times(percpu=False)],
+            True: psutil.cpu_times(percpu=True),
+        }
+
+    @property
+    def cpu_info(self):
+        '''
+        [概要]
+        cpuinfo.get_cpu_info() の結果を返すプロパティ
+        取得に時間がかかるので，初めて必要になった時に1回だけ実行する
+        '''
+        if self._cpu_info is None:
+            logger.debug("> cpuinfo から CPU の情報を取得します")
+            self._cpu_info = cpuinfo.get_cpu_info()
+        return self._cpu_info
 
     def read_cpu_vendor(self):
         '''
         [概要]
         CPUのベンダー(製造元)を取得するメソッド
         '''
-        return self.cpu_info["vendor_id_raw"]
-
+        return self.static_info_cache.get(
+            "cpu_vendor", lambda: self.cpu_info["vendor_id_raw"]
+        )
 
     def read_cpu_brand(self):
         '''
         [概要]
         CPUのブランド名(製品名)を取得するメソッド
         '''
-        return self.cpu_info["brand_raw"]
+        return self.static_info_cache.get(
+            "cpu_brand", lambda: self.cpu_info["brand_raw"]
+        )
 
     def read_machine_type(self):
         '''
@@ -42,29 +76,83 @@ class SyncCPU:
         マシンのアーキテクチャ(ハードウェアの種類)を
         取得するメソッド
         '''
-        return platform.machine()
+        return self.static_info_cache.get("machine_type", platform.machine)
 
     def read_logical_cores(self):
         '''
         [概要]
         CPUの論理コア数を取得して返すメソッド
         '''
-        return psutil.cpu_count(logical=True)
+        return self.static_info_cache.get(
+            "logical_cores", lambda: psutil.cpu_count(logical=True)
+        )
 
     def read_phisical_cores(self):
         '''
         [概要]
         CPUの物理コアを取得して返すメソッド
         '''
-        return psutil.cpu_count(logical=False)
+        return self.static_info_cache.get(
+            "phisical_cores", lambda: psutil.cpu_count(logical=False)
+        )
+
+    def _split_cpu_times(self, cpu_times):
+        '''
+        [概要]
+        cpu_times を(全体の時間, 待機時間)の組に変換するメソッド
+        '''
+        fields = cpu_times._asdict()
+        total = sum(
+            value for key, value in fields.items()
+            if key not in self.EXCLUDED_TIMES
+        )
+        idle = sum(fields.get(key, 0.0) for key in self.IDLE_TIMES)
+        return total, idle
 
-    def read_cores_utilities(self):
+    def _calc_utility(self, previous, current):
         '''
         [概要]
-        CPU全体の平均使用率を取得して返すメソッド
-        0.5秒間の平均使用率を計測して1つの数値として返している
+        2つの cpu_times の差分から使用率(%)を計算するメソッド
         '''
-        return psutil.cpu_percent(interval=0.5, percpu=False)
+        previous_total, previous_idle = self._split_cpu_times(previous)
+        current_total, current_idle = self._split_cpu_times(current)
+
+        total_delta = current_total - previous_total
+        if total_delta <= 0:
+            # 前回から時間が進んでいない(呼び出し間隔が短すぎる)場合
+            return 0.0
+
+        busy_delta = total_delta - (current_idle - previous_idle)
+        utility = busy_delta / total_delta * 100
+        return round(min(max(utility, 0.0), 100.0), 1)
+
+    def read_cores_utilities(self, percpu=False):
+        '''
+        [概要]
+        CPUの使用率を取得して返すメソッド
+        前回呼び出し時(初回はインスタンス生成時)からの
+        cpu_times の差分で計算するので，呼び出し元を待たせない
+        percpu=True の場合はコアごとの使用率をリストで返す
+        '''
+        if percpu:
+            current = psutil.cpu_times(percpu=True)
+        else:
+            current = [psutil.cpu_times(percpu=False)]
+
+        previous = self._previous_cpu_times[percpu]
+        self._previous_cpu_times[percpu] = current
+
+        if len(previous) != len(current):
+            # CPU のホットプラグなどでコア数が変わった場合は比較できない
+            logger.warning(">>> コア数が変わったので使用率を計算し直します")
+            utilities = [0.0] * len(current)
+        else:
+            utilities = [
+                self._calc_utility(before, after)
+                for before, after in zip(previous, current)
+            ]
+
+        return utilities if percpu else utilities[0]
 
     def collect_static_info(self):
         '''
@@ -74,13 +162,7 @@ class SyncCPU:
         '''
         logger.debug("> CPUの静的情報のみを出力します")
 
-        logger.debug(f"> CPU Vendor: '{self.read_cpu_vendor()}'")
-        logger.debug(f"> CPU Brand: '{self.read_cpu_brand()}'")
-        logger.debug(f"> Machine Type: '{self.read_machine_type()}'")
-        logger.debug(f"> Logical Cores: '{self.read_logical_cores()}'")
-        logger.debug(f"> Phisical Cores: '{self.read_phisical_cores()}'")
-
-        return {
+        static_info = {
             "cpu_vendor": self.read_cpu_vendor(),
             "cpu_brand": self.read_cpu_brand(),
             "machine_type": self.read_machine_type(),
@@ -88,6 +170,14 @@ class SyncCPU:
             "phisical_cores": self.read_phisical_cores()
         }
 
+        logger.debug(f"> CPU Vendor: '{static_info['cpu_vendor']}'")
+        logger.debug(f"> CPU Brand: '{static_info['cpu_brand']}'")
+        logger.debug(f"> Machine Type: '{static_info['machine_type']}'")
+        logger.debug(f"> Logical Cores: '{static_info['logical_cores']}'")
+        logger.debug(f"> Phisical Cores: '{static_info['phisical_cores']}'")
+
+        return static_info
+
     def collect_dynamic_info(self):
         '''
         [概要]
@@ -97,10 +187,11 @@ class SyncCPU:
         '''
         logger.debug("> CPUの動的情報のみを出力します")
         
-        logger.debug(f"> CPU Utilities: '{self.read_cores_utilities()}'")
-        
+        cpu_utilities = self.read_cores_utilities()
+        logger.debug(f"> CPU Utilities: '{cpu_utilities}'")
+
         return {
-            "cpu_utilities": self.read_cores_utilities()
+            "cpu_utilities": cpu_utilities
         }
 
 
@@ -6,6 +6,12 @@
 # RAMの情報を取得して返すプログラム
 #
 
+try:
+    from features.static_info_cache import StaticInfoCache
+
+except:
+    from static_info_cache import StaticInfoCache
+
 import psutil
 
 from logging import getLogger
@@ -15,8 +21,9 @@ logger = getLogger(__name__)
 
 
 class SyncRAM:
-    def __init__(self):
-        pass
+    def __init__(self, static_info_cache=None):
+        # 静的情報はキャッシュから読み，無い項目だけ取得する
+        self.static_info_cache = static_info_cache or StaticInfoCache()
 
     def _bytes_to_gb(self, bytes_int):
         '''
@@ -34,14 +41,20 @@ class SyncRAM:
         [概要]
         OSが認識している物理メモリの総量(静的情報)を取得して返すメソッド
         '''
-        return self._bytes_to_gb(psutil.virtual_memory().total)
+        return self.static_info_cache.get(
+            "ram_total_virtual_memory",
+            lambda: self._bytes_to_gb(psutil.virtual_memory().total)
+        )
 
     def read_total_swap_memory(self):
         '''
         [概要]
         OSが認識しているスワップメモリの総量(静的情報)を取得して返すメソッド
         '''
-        return self._bytes_to_gb(psutil.swap_memory().total)
+        return self.static_info_cache.get(
+            "ram_total_swap_memory",
+            lambda: self._bytes_to_gb(psutil.swap_memory().total)
+        )
 
     def read_latest_virtual_memory_percent(self):
         '''
@@ -65,15 +78,12 @@ class SyncRAM:
         '''
         logger.debug("> RAMの静的情報を出力します")
 
-        logger.debug(
-            f"> RAM Virtual Memory: '{self.read_total_virtual_memory()}'"
-        )
-        logger.debug(
-            f"> RAM Swap Memory: '{self.read_total_swap_memory()}'"
-        )
+        total_virtual_memory = self.read_total_virtual_memory()
+        logger.debug(f"> RAM Virtual Memory: '{total_virtual_memory}'")
+        logger.debug(f"> RAM Swap Memory: '{self.read_total_swap_memory()}'")
 
         return {
-            "ram_total_virtual_memoty": self.read_total_virtual_memory()
+            "ram_total_virtual_memoty": total_virtual_memory
         }
 
     def collect_dynamic_info(self):
@@ -12,6 +12,14 @@
 # クラス内に定義している
 #
 
+try:
+    from features.rate_limiter import get_rate_limiter
+    from features.sheet_index_cache import SheetIndexCache
+
+except:
+    from rate_limiter import get_rate_limiter
+    from sheet_index_cache import SheetIndexCache
+
 import ezsheets
 
 from logging import getLogger
@@ -22,8 +30,24 @@ logger = getLogger(__name__)
 
 
 class SyncWithGoogleSheets:
-    def __init__(self):
+    def __init__(self, min_write_interval=1.0):
         self._refresh_token()
+        # API ごとのレート制限(同じプロセス内の全インスタンスで共有する)
+        # 書き込みは min_write_interval 秒に1回まで
+        # (Sheets API の書き込み上限: 1分あたり60回)
+        self.write_limiter = get_rate_limiter(
+            "sheets_write", rate=1 / min_write_interval
+        )
+        # 読み込み(スプレッドシートを開く)も1分あたり60回まで
+        self.read_limiter = get_rate_limiter(
+            "sheets_read", rate=1.0, capacity=5
+        )
+        # Drive API(一覧の取得・複製)
+        self.drive_limiter = get_rate_limiter(
+            "drive", rate=10.0, capacity=10
+        )
+        # タイトルとIDの索引(listSpreadsheets() の結果をキャッシュする)
+        self.sheet_index = SheetIndexCache()
 
     def _refresh_token(self):
         '''
@@ -49,12 +73,15 @@ class SyncWithGoogleSheets:
         [概要]
         listSpreadsheets()を使って，編集権限と閲覧権限がある
         スプレッドシートを辞書型で取得するメソッド．
-        取得した辞書型は self.sheets_dict インスタンス変数で保持される．
+        取得した辞書型は self.sheets_dict インスタンス変数で保持され，
+        self.sheet_index の索引も作り直す．
         また，コンソール上には取得したシートのタイトルとIDを出力する．
         '''
         try:
             logger.debug("> 複数のスプレッドシートを取得します")
-            self.sheets_dict = ezsheets.listSpreadsheets()
+            self.sheets_dict = self.drive_limiter.call(
+                ezsheets.listSpreadsheets
+            )
             if not self.sheets_dict:
                 logger.warning(
                     f">>> シートを取得できなかった: {len(self.sheets_dict)}"
@@ -70,6 +97,7 @@ class SyncWithGoogleSheets:
                 logger.debug(
                     f"シート名: {title}, \nシートID: {sheet_id}"
                 )
+            self.sheet_index.refresh(self.sheets_dict)
 
             return True
 
@@ -82,31 +110,34 @@ class SyncWithGoogleSheets:
     def _read_sheet_id_by_title(self, title_name):
         '''
         [概要]
-        self._make_sheets_dict()を実行して作成した
-        self.sheets_dictを参照し，引数で渡される title_name と一致する
+        self.sheet_index の索引を参照し，引数で渡される title_name と一致する
         スプレッドシートのIDを取得するメソッド．
-        取得したIDを参照してスプレッドシートのオブジェクトを作成する．
-        なお，オブジェクトは self.ss インスタンス変数が保持する．
+        索引が古い場合や見つからなかった場合だけ
+        self._make_sheets_dict() で一覧を取得し直す．
         '''
         assert title_name, "検索したいシート名を渡して"
         assert isinstance(title_name, str), "シート名は文字列型にして"
-        
-        self._make_sheets_dict()
-        target_id = None
+
         try:
             logger.debug(f"> {title_name}と一致するシートを検索します")
-            for sheet_id, title in self.sheets_dict.items():
-                if title == title_name:
-                    target_id = sheet_id
-                    logger.debug(
-                        f"> {title_name}と一致するシートが見つかった"
-                    )
-                    break
+            refreshed = False
+            if self.sheet_index.is_expired():
+                self._make_sheets_dict()
+                refreshed = True
+
+            target_id = self.sheet_index.find_id(title_name)
+            if target_id is None and refreshed == False:
+                # 索引を作った後に作られたシートかもしれないので取得し直す
+                logger.debug("> 索引に無いので一覧を取得し直します")
+                self._make_sheets_dict()
+                target_id = self.sheet_index.find_id(title_name)
 
             if target_id is None:
                 logger.warning(
                     f">>> {title_name}と一致するシートが見つからなかった"
                 )
+            else:
+                logger.debug(f"> {title_name}と一致するシートが見つかった")
 
             logger.info(
                 f">> タイトル: {title_name} (ID: {target_id})を読み込む"
@@ -120,10 +151,69 @@ class SyncWithGoogleSheets:
             )
             raise e
 
-    def copy_template_sheet(self, template_sheet_name, new_sheet_name):
+    def _copy_on_server(self, template_id, new_sheet_name):
+        '''
+        [概要]
+        Drive API の files.copy でテンプレートを複製するメソッド
+        Google のサーバ内で複製するので，ファイルの送受信が無く
+        書式もそのまま引き継がれる
+        '''
+        response = self.drive_limiter.call(
+            ezsheets.DRIVE_SERVICE.files().copy(
+                fileId=template_id, body={"name": new_sheet_name},
+                fields="id", supportsAllDrives=True
+            ).execute, priority="high"
+        )
+        return self.read_limiter.call(
+            ezsheets.Spreadsheet, response["id"], priority="high"
+        )
+
+    def _copy_via_excel(self, template_sheet_name, template_id,
+                        new_sheet_name):
+        '''
+        [概要]
+        テンプレートを Excel 形式でダウンロードし，
+        アップロードし直して複製するメソッド
+        files.copy が使えない場合の代わりに使う
+        '''
+        try:
+            template_ss = self.read_limiter.call(
+                ezsheets.Spreadsheet, template_id, priority="high"
+            )
+
+        except Exception as e:
+            # 索引のIDが削除済みなどで開けない場合は索引を作り直す
+            logger.warning(f">>> 索引のIDで開けないので検索し直します: {e}")
+            self.sheet_index.invalidate()
+            template_id = self._read_sheet_id_by_title(template_sheet_name)
+            template_ss = self.read_limiter.call(
+                ezsheets.Spreadsheet, template_id, priority="high"
+            )
+
+        downloads_path = Path(f"./{new_sheet_name}.xlsx")
+        try:
+            self.drive_limiter.call(
+                template_ss.downloadAsExcel, downloads_path, priority="high"
+            )
+            new_ss = self.drive_limiter.call(
+                ezsheets.upload, downloads_path.name, priority="high"
+            )
+
+        finally:
+            downloads_path.unlink(missing_ok=True)
+            logger.debug(
+                f"> 複製時にダウンロードしたファイルを削除した"
+            )
+
+        return new_ss
+
+    def copy_template_sheet(self, template_sheet_name, new_sheet_name,
+                            server_side=True):
         '''
         [概要]
         テンプレートシートを複製するメソッド
+        server_side=True の場合は Drive API で直接複製し，
+        失敗した場合は Excel 形式でダウンロード -> アップロードして複製する
         '''
         assert template_sheet_name, "テンプレートシートの名前を渡して"
         assert isinstance(template_sheet_name, str), "文字列型を渡して"
@@ -131,21 +221,29 @@ class SyncWithGoogleSheets:
         assert isinstance(new_sheet_name, str), "文字列型を渡して"
 
         template_id = self._read_sheet_id_by_title(template_sheet_name)
-        template_ss = ezsheets.Spreadsheet(template_id)
-        downloads_path = Path(f"./{new_sheet_name}.xlsx")
         try:
             logger.debug(
                 f"> テンプレート {template_sheet_name} を複製する"
             )
-            template_ss.downloadAsExcel(downloads_path)
+            new_ss = None
+            if server_side == True:
+                try:
+                    new_ss = self._copy_on_server(template_id, new_sheet_name)
+
+                except Exception as e:
+                    logger.warning(
+                        f">>> サーバ上で複製できなかったので"
+                        f"Excel 形式を経由して複製します: {e}"
+                    )
 
-            if downloads_path.exists() == True:
-                self.ss = ezsheets.upload(downloads_path.name)
-                downloads_path.unlink(missing_ok=True)
-                logger.debug(
-                    f"> 複製時にダウンロードしたファイルを削除した"
+            if new_ss is None:
+                new_ss = self._copy_via_excel(
+                    template_sheet_name, template_id, new_sheet_name
                 )
-            
+
+            self.ss = new_ss
+            self.sheet_index.add(self.ss.id, self.ss.title)
+
             logger.debug(
                 f"> テンプレートの複製に成功した -> {new_sheet_name}"
             )
@@ -161,7 +259,67 @@ class SyncWithGoogleSheets:
             )
             raise e
 
-    def edit_sheet_cell(self, cell, data, sheet_num=0):
+    def open_spreadsheet(self, spreadsheet_id):
+        '''
+        [概要]
+        IDを指定してスプレッドシートを開き，self.ss を差し替えるメソッド
+        既に開いている場合は何もしない
+        '''
+        assert spreadsheet_id, "スプレッドシートのIDを渡して"
+
+        if getattr(self, "ss", None) is not None \
+                and self.ss.id == spreadsheet_id:
+            return True
+
+        try:
+            logger.debug(f"> ID: {spreadsheet_id} のシートを開きます")
+            self.ss = self.read_limiter.call(
+                ezsheets.Spreadsheet, spreadsheet_id
+            )
+            return True
+
+        except Exception as e:
+            logger.error(
+                f">>>> スプレッドシートを開く際にエラーが発生しました: {e}"
+            )
+            raise e
+
+    def edit_cells(self, cells, sheet_num=0, priority="normal"):
+        '''
+        [概要]
+        複数のセルをまとめて編集する(データを書き込む)メソッド
+        {"C5": 値, "C7": 値, ...} の辞書を受け取り，
+        values.batchUpdate の1回のリクエストで全て書き込む
+        priority は書き込み待ちの順番("high" / "normal" / "low")
+        '''
+        assert cells, "編集対象のセルを辞書で渡してください"
+        assert isinstance(cells, dict), "セルと値は辞書型で渡して"
+
+        sheet = self.ss[sheet_num]
+        sheet_title = sheet.title.replace("'", "''")
+        data = [
+            {"range": f"'{sheet_title}'!{cell}", "values": [[value]]}
+            for cell, value in cells.items()
+        ]
+        try:
+            logger.debug(f"> {len(cells)} 個のセルをまとめて書き込みます")
+            self.write_limiter.call(
+                ezsheets.SHEETS_SERVICE.spreadsheets().values().batchUpdate(
+                    spreadsheetId=self.ss.id,
+                    body={"valueInputOption": "USER_ENTERED", "data": data},
+                ).execute, priority=priority
+            )
+            logger.debug(f"> {', '.join(cells)} に書き込みました")
+
+            return True
+
+        except Exception as e:
+            logger.error(
+                f"複数のセルに書き込む際にエラーが発生しました: {e}"
+            )
+            raise e
+
+    def edit_sheet_cell(self, cell, data, sheet_num=0, priority="normal"):
         '''
         [概要]
         特定のシート内のセルを編集する(データを書き込む)ためのメソッド
@@ -173,7 +331,9 @@ class SyncWithGoogleSheets:
         sheet = self.ss[sheet_num]
         try:
             logger.debug(f"'{cell}' セルに {data} を書き込みます")
-            sheet[cell] = data
+            self.write_limiter.call(
+                sheet.__setitem__, cell, data, priority=priority
+            )
             logger.debug(f"'{cell}' セルに {data} を書き込みました")
 
             return True
@@ -197,7 +357,7 @@ class SyncWithGoogleSheets:
         sheet = self.ss[sheet_num]
         try:
             logger.info(">> データを追加します")
-            sheet.updateRow(row_num, data_list)
+            self.write_limiter.call(sheet.updateRow, row_num, data_list)
             logger.debug("> データを追加しました")
 
             return True
@@ -208,6 +368,54 @@ class SyncWithGoogleSheets:
             )
             raise e
 
+    def edit_sheet_rows(self, start_row, rows, sheet_num=0,
+                        priority="normal"):
+        '''
+        [概要]
+        start_row 行目から複数行をまとめて編集する(データを書き込む)メソッド
+        edit_sheet_row() を行数分呼ぶと API も行数分呼ばれるが，
+        こちらは1回の範囲更新(values.update)で書き込む
+        '''
+        assert start_row, "データを挿入する行を数値で指定してください"
+        assert isinstance(start_row, int), "行は整数型で渡してください"
+        assert rows, "rowsが空です"
+        assert isinstance(rows, list), "データはリストのリストで渡して"
+
+        sheet = self.ss[sheet_num]
+        end_row = start_row + len(rows) - 1
+        width = max(len(row) for row in rows)
+        try:
+            if end_row > sheet.rowCount or width > sheet.columnCount:
+                logger.debug(f"> シートを {end_row} 行まで拡張します")
+                self.write_limiter.call(
+                    sheet.resize, max(width, sheet.columnCount),
+                    max(end_row, sheet.rowCount), priority=priority
+                )
+
+            sheet_title = sheet.title.replace("'", "''")
+            cell_range = (
+                f"'{sheet_title}'!A{start_row}:"
+                f"{ezsheets.getColumnLetterOf(width)}{end_row}"
+            )
+            logger.info(f">> {len(rows)} 行のデータをまとめて追加します")
+            self.write_limiter.call(
+                ezsheets.SHEETS_SERVICE.spreadsheets().values().update(
+                    spreadsheetId=self.ss.id,
+                    range=cell_range,
+                    valueInputOption="USER_ENTERED",
+                    body={"majorDimension": "ROWS", "values": rows},
+                ).execute, priority=priority
+            )
+            logger.debug(f"> {cell_range} にデータを追加しました")
+
+            return True
+
+        except Exception as e:
+            logger.error(
+                f">>>> 複数行のデータ更新中にエラーが発生しました: {e}"
+            )
+            raise e
+
     
 if __name__ == "__main__":
     from setup_logging import setup_logging
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+#
+# fleet_dashboard.py
+#
+# [概要]
+# 多数の VM の計測値を1か所に集めてスプレッドシートに書き込むプログラム
+#
+# ・集約プロセス(Google の認証情報を持つ PC で1つだけ動かす)
+#     python3 fleet_dashboard.py aggregator --host 0.0.0.0 --port 8080 \
+#         --token 合言葉
+# ・エージェント(計測したい各 VM で動かす．認証情報は不要)
+#     python3 fleet_dashboard.py agent --url http://集約PC:8080/metrics \
+#         --token 合言葉 --metrics cpu ram disk_io
+#
+# 1台ずつ update_vm_dashboard.py を動かす場合と違い，
+# Google への書き込みは集約プロセスだけが行うので，
+# 台数が増えても書き込み間隔の制限を全体で守れる．
+#
+
+from features.dashboard_pipeline import DashboardPipeline
+from features.fleet_agent import FleetAgent
+from features.fleet_aggregator import FleetAggregator
+from features.fleet_aggregator import FleetHTTPServer
+from features.metric_collectors import CPUCollector
+from features.metric_collectors import MetricRegistry
+from features.metric_collectors import RAMCollector
+from features.rate_limiter import read_rate_limiter_stats
+from features.setup_logging import setup_logging
+from features.static_info_cache import StaticInfoCache
+from features.sync_cpu import SyncCPU
+from features.sync_ram import SyncRAM
+from features.sync_with_google_sheets import SyncWithGoogleSheets
+
+from logging import getLogger
+from pathlib import Path
+import argparse
+import getpass
+import os
+import socket
+import threading
+import time
+
+# 専用のロガーを作成
+logger = getLogger(__name__)
+
+# loggingの設定を反映
+logging_config = Path("./config/logging_config.yml")
+setup_logging(logging_config)
+
+
+def run_aggregator(host, port, token, template_sheet_name,
+                   summary_sheet_name, stats_interval=60.0):
+    '''
+    [概要]
+    計測値を受け取る HTTP サーバと集約処理を動かす関数
+    自分以外からも受け付けるアドレスで token が無い場合は
+    FleetHTTPServer が ValueError を出す
+    '''
+    # 待ち受けの設定が間違っていれば Google の認証より先に止める
+    server = FleetHTTPServer((host, port), None, token=token)
+
+    # client_secret_*.jsonがあるディレクトリへ移動
+    os.chdir("./config/")
+
+    aggregator = FleetAggregator(
+        SyncWithGoogleSheets(), template_sheet_name,
+        summary_sheet_name=summary_sheet_name
+    )
+    server.aggregator = aggregator
+    aggregator.start()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f">> {host}:{port}/metrics で計測値を受け付けます")
+    logger.info(">> プログラムを停止する場合は Ctrl + c を押してください")
+    try:
+        while True:
+            time.sleep(stats_interval)
+            logger.info(f">> 集約状況: {aggregator.stats()}")
+            logger.info(f">> レート制限: {read_rate_limiter_stats()}")
+
+    except KeyboardInterrupt:
+        server.shutdown()
+        aggregator.stop()
+
+
+def run_agent(url, token, metric_names, sample_interval=1.0,
+              batch_size=30, flush_interval=30.0, stats_interval=60.0):
+    '''
+    [概要]
+    計測値を集約プロセスに送り続ける関数
+    '''
+    static_info_cache = StaticInfoCache()
+    sync_cpu = SyncCPU(static_info_cache)
+    sync_ram = SyncRAM(static_info_cache)
+    registry = MetricRegistry.from_names(
+        metric_names, instances={
+            "cpu": CPUCollector(sync_cpu),
+            "ram": RAMCollector(sync_ram),
+        }
+    )
+
+    # UpdateVMDashboard._merge_static_info() と同じ並びの静的情報
+    user = getpass.getuser()
+    pc_name = socket.gethostname()
+    static = {"user": user, "pc_name": pc_name} \
+        | sync_cpu.collect_static_info() | sync_ram.collect_static_info()
+
+    agent = FleetAgent(
+        url, f"{user}@{pc_name}", registry.columns, static=static,
+        batch_size=batch_size, flush_interval=flush_interval, token=token
+    )
+    pipeline = DashboardPipeline(
+        registry.read_row, agent, sample_interval=sample_interval
+    )
+    logger.info(f">> {url} に {', '.join(registry.columns)} を送ります")
+    logger.info(">> プログラムを停止する場合は Ctrl + c を押してください")
+    pipeline.start()
+    try:
+        while True:
+            time.sleep(stats_interval)
+            logger.info(f">> 計測状況: {pipeline.stats()}")
+
+    except KeyboardInterrupt:
+        pipeline.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="多数の VM の計測値を集めてスプレッドシートに書き込む"
+    )
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    aggregator_parser = subparsers.add_parser(
+        "aggregator", help="計測値を受け取って書き込む(1台だけで動かす)"
+    )
+    aggregator_parser.add_argument(
+        "--host", default="127.0.0.1",
+        help="待ち受けるアドレス(他の VM から受け付けるには 0.0.0.0)"
+    )
+    aggregator_parser.add_argument("--port", type=int, default=8080)
+    aggregator_parser.add_argument(
+        "--token", help="エージェントとの合言葉(--host が 127.0.0.1 以外なら必須)"
+    )
+    aggregator_parser.add_argument(
+        "--template", default="25PP2_W11_VM-Monitor",
+        help="ホストごとに複製するテンプレートシート"
+    )
+    aggregator_parser.add_argument(
+        "--summary", default="VM-Fleet-Summary", help="サマリシートの名前"
+    )
+
+    agent_parser = subparsers.add_parser(
+        "agent", help="計測値を集約プロセスに送る(各 VM で動かす)"
+    )
+    agent_parser.add_argument(
+        "--url", default="http://127.0.0.1:8080/metrics"
+    )
+    agent_parser.add_argument("--token", help="集約プロセスとの合言葉")
+    agent_parser.add_argument(
+        "--metrics", nargs="+", default=["cpu", "ram"],
+        help="送る計測値(コレクタの名前)"
+    )
+    agent_parser.add_argument("--interval", type=float, default=1.0,
+                              help="計測の間隔(秒)")
+    args = parser.parse_args()
+
+    if args.mode == "aggregator":
+        run_aggregator(
+            args.host, args.port, args.token, args.template, args.summary
+        )
+    else:
+        run_agent(args.url, args.token, args.metrics, args.interval)
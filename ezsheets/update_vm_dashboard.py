@@ -7,8 +7,18 @@
 # 複製して無限に情報を書き込み続けるプログラム
 #
 
+from features.buffered_sheet_writer import BufferedSheetWriter
+from features.dashboard_pipeline import DashboardPipeline
+from features.metric_collectors import CPUCollector
+from features.metric_collectors import MetricRegistry
+from features.metric_collectors import RAMCollector
+from features.metric_history import HistoryRecorder
+from features.metric_history import MetricHistory
+from features.rate_limiter import read_rate_limiter_stats
 from features.sync_cpu import SyncCPU
 from features.setup_logging import setup_logging
+from features.sheet_write_spool import SheetWriteSpool
+from features.static_info_cache import StaticInfoCache
 from features.sync_ram import SyncRAM
 from features.sync_with_google_sheets import SyncWithGoogleSheets
 
@@ -28,10 +38,20 @@ setup_logging(logging_config)
 
 
 class UpdateVMDashboard:
-    def __init__(self):
-        self.sync_cpu = SyncCPU()
-        self.sync_ram = SyncRAM()
+    def __init__(self, metric_names=("cpu", "ram")):
+        # CPU と RAM で同じ静的情報のキャッシュファイルを使う
+        static_info_cache = StaticInfoCache()
+        self.sync_cpu = SyncCPU(static_info_cache)
+        self.sync_ram = SyncRAM(static_info_cache)
         self.sync_with_google_sheets = SyncWithGoogleSheets()
+        # シートに書き込む列(コレクタ)の組み合わせ
+        # cpu / ram は静的情報と同じインスタンスを使う
+        self.metric_registry = MetricRegistry.from_names(
+            metric_names, instances={
+                "cpu": CPUCollector(self.sync_cpu),
+                "ram": RAMCollector(self.sync_ram),
+            }
+        )
 
     def _read_user_and_pc(self):
         '''
@@ -94,13 +114,12 @@ class UpdateVMDashboard:
             )
             
             logger.info(">> 複製したシートに静的情報を書き込みます")
-            for key, value in self.static.items():
-                cell_num = f"C{target_num}"
-                self.sync_with_google_sheets.edit_sheet_cell(
-                    cell_num, value
-                )
-                target_num += 2
-                time.sleep(3)
+            # C5, C7, C9, ... に1つずつ書き込む内容を1回のリクエストで送る
+            cells = {
+                f"C{target_num + index * 2}": value
+                for index, value in enumerate(self.static.values())
+            }
+            self.sync_with_google_sheets.edit_cells(cells, priority="high")
 
         except Exception as e:
             logger.error(
@@ -108,16 +127,22 @@ class UpdateVMDashboard:
             )
             raise e
 
+    def read_dynamic_info(self):
+        '''
+        [概要]
+        シートの1行分になる動的な情報をリストで返すメソッド
+        列の並びは self.metric_registry.columns の通り
+        '''
+        return self.metric_registry.read_row()
+
     def insert_dynamic_info(self, row_num):
         '''
         [概要]
         動的な情報を書き込むためのメソッド
-        繰り返し処理の中で実行され続ける
+        1回の呼び出しで1回 API を呼ぶので，
+        繰り返し書き込む場合は buffer_dynamic_info() を使う
         '''
-        dynamic_info_list = [
-            self.sync_cpu.read_cores_utilities(),
-            self.sync_ram.read_latest_virtual_memory_percent()
-        ]
+        dynamic_info_list = self.read_dynamic_info()
         try:
             logger.debug("> CPUとRAMの動的な情報を書き込みます")
             self.sync_with_google_sheets.edit_sheet_row(
@@ -133,34 +158,102 @@ class UpdateVMDashboard:
             )
             raise e
 
+    def buffer_dynamic_info(self, sheet_writer):
+        '''
+        [概要]
+        動的な情報を BufferedSheetWriter に追加するメソッド
+        実際の書き込みは一定件数 or 一定時間ごとにまとめて行われる
+        '''
+        try:
+            dynamic_info_list = self.read_dynamic_info()
+            logger.debug(
+                f"> 動的な情報をバッファに追加します: {dynamic_info_list}"
+            )
+            return sheet_writer.append(dynamic_info_list)
 
-def main():
+        except Exception as e:
+            logger.error(
+                f"動的な情報のバッファ追加時にエラーが発生しました: {e}"
+            )
+            raise e
+
+
+def main(sample_interval=0.5, batch_size=30, flush_interval=30.0,
+         stats_interval=60.0, metric_names=("cpu", "ram"),
+         upload_tier=None, history_path=Path("./vm_history.bin")):
     '''
     [概要]
     全行程一括実行用の関数
+    計測用のスレッドで sample_interval 秒おきに動的情報を取得し，
+    アップロード用のスレッドで batch_size 件 or flush_interval 秒ごとに
+    まとめて書き込む
+    CPU 使用率は前回の計測との差分で求めるので待ち時間は無く，
+    sample_interval 秒間の平均になる．計測自体は軽いので，
+    sample_interval は「シートに何秒おきの行が欲しいか」で決める
+    (0.5 秒なら1日で約17万行．長時間動かす場合は upload_tier を使う)
+    計測値は history_path に記録し，upload_tier に "minute" / "hour" を
+    指定した場合はその区間ごとの集計値だけをシートに書き込む
     '''
     # client_secret_*.jsonがあるディレクトリへ移動
     os.chdir("./config/")
 
     # インスタンスを生成
-    vm_updater = UpdateVMDashboard()
+    vm_updater = UpdateVMDashboard(metric_names)
     vm_updater._merge_static_info()
+    logger.info(
+        f">> 書き込む列: {', '.join(vm_updater.metric_registry.columns)}"
+    )
+
+    # 前回の実行で送れなかった書き込みがあれば先に送る
+    spool = SheetWriteSpool(vm_updater.sync_with_google_sheets)
+    spool.replay(force=True)
 
     # 編集開始
     template_sheet_name = "25PP2_W11_VM-Monitor"
     vm_updater.insert_static_info(template_sheet_name)
     target_row_num = 35
-    logger.debug("> 3秒おきに動的情報を書き込みます")
+    # 動的情報はスプールを通して書き込むので，
+    # 通信に失敗しても止まらずに後で再送される
+    sheet_writer = BufferedSheetWriter(
+        spool, target_row_num,
+        batch_size=batch_size, flush_interval=flush_interval
+    )
+    history = MetricHistory(vm_updater.metric_registry.columns)
+    history.load(history_path)
+    if upload_tier is not None:
+        logger.info(
+            f">> {upload_tier} ごとの集計値だけを書き込みます: "
+            f"started_at, {', '.join(history.rollup_columns())}"
+        )
+    recorder = HistoryRecorder(
+        history, sheet_writer, upload_tier=upload_tier,
+        history_path=history_path
+    )
+    pipeline = DashboardPipeline(
+        vm_updater.read_dynamic_info, recorder,
+        sample_interval=sample_interval
+    )
+    logger.debug(
+        f"> {sample_interval}秒おきに動的情報を取得し，"
+        f"{batch_size}件 or {flush_interval}秒ごとに書き込みます"
+    )
     logger.info(">> プログラムを停止する場合は Ctrl + c を押してください")
+    pipeline.start()
     try:
-        # コマンド操作で停止されない限り無限に繰り返す
+        # コマンド操作で停止されない限り，計測状況を定期的に表示し続ける
         while True:
-            vm_updater.insert_dynamic_info(target_row_num)
-            target_row_num += 1
-            logger.debug("> 次の書き込みまで3秒待機します")
-            time.sleep(3)
+            time.sleep(stats_interval)
+            logger.info(f">> 計測状況: {pipeline.stats()}")
+            logger.debug(f"> レート制限: {read_rate_limiter_stats()}")
 
     except KeyboardInterrupt:
+        # キューとバッファに残っているデータを書き込んでから終了する
+        pipeline.stop()
+        spool.replay(force=True)
+        if len(spool):
+            logger.warning(
+                f">>> 送信できなかった {len(spool)} 件は次回の起動時に再送します"
+            )
         logger.info(
             ">> 演習用のプログラムを停止しました．お疲れ様でした．"
         )
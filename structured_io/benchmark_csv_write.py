@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+#
+# benchmark_csv_write.py
+#
+# [概要]
+# CSVIO.write_data() の書き込み速度を
+# 以前の実装(touch() してから1行ずつ writerow())と比較するベンチマーク
+#
+# 以前の実装は途中で失敗すると書きかけの CSV が残るが，
+# 現在の write_data() は batch_size 行ずつ writerows() でまとめて書き込み，
+# 一時ファイルに fsync した後でアトミックに置き換えている．
+# 100万行の出力で両者の行/秒を計測してログに出す．
+#
+
+from features.csv_io import CSVIO
+from features.setup_logging import setup_logging
+
+from logging import getLogger
+from pathlib import Path
+import csv
+import time
+
+# 専用のロガーを作成
+logger = getLogger(__name__)
+
+# logging の設定を適用
+logging_config = Path("./config/logging_config.yml")
+setup_logging(logging_config)
+
+
+class CSVWriteBenchmark:
+    def __init__(self, output_dir_path=Path("./output")):
+        self.output_dir_path = output_dir_path
+        self.csv_handler = CSVIO()
+
+    def make_rows(self, num_rows):
+        '''
+        [概要]
+        Netflix のデータセットを模した行を作るジェネレータメソッド
+        '''
+        for index in range(num_rows):
+            yield [
+                f"s{index}", "Movie", f"作品 {index}", "Japan",
+                str(1990 + index % 32), "90 min", "説明文, カンマ入り"
+            ]
+
+    def _write_legacy(self, rows, save_csv_path):
+        '''
+        [概要]
+        以前の write_data() と同じ方法(1行ずつ writerow())で書き込む
+        '''
+        save_csv_path.touch()
+        with open(save_csv_path, mode="w", encoding="utf-8") as csv_file:
+            writer = csv.writer(csv_file)
+            for row in rows:
+                writer.writerow(row)
+
+    def run(self, num_rows=1000000, batch_size=10000):
+        '''
+        [概要]
+        以前の実装と現在の write_data() の書き込み時間を計測して
+        結果を辞書で返すメソッド
+        '''
+        self.output_dir_path.mkdir(exist_ok=True)
+        rows = list(self.make_rows(num_rows))
+
+        legacy_path = self.output_dir_path / "bench_legacy.csv"
+        start = time.perf_counter()
+        self._write_legacy(rows, legacy_path)
+        legacy_sec = time.perf_counter() - start
+
+        atomic_path = self.output_dir_path / "bench_atomic.csv"
+        start = time.perf_counter()
+        self.csv_handler.write_data(rows, atomic_path, batch_size=batch_size)
+        atomic_sec = time.perf_counter() - start
+
+        assert legacy_path.read_bytes() == atomic_path.read_bytes(), \
+            "書き込み結果が一致しない"
+
+        result = {
+            "rows": num_rows,
+            "legacy_rows_per_sec": round(num_rows / legacy_sec),
+            "atomic_rows_per_sec": round(num_rows / atomic_sec),
+            "speedup": round(legacy_sec / atomic_sec, 2),
+        }
+        logger.info(
+            f">> 以前の実装: {legacy_sec:.2f} 秒 "
+            f"({result['legacy_rows_per_sec']} 行/秒)"
+        )
+        logger.info(
+            f">> write_data(): {atomic_sec:.2f} 秒 "
+            f"({result['atomic_rows_per_sec']} 行/秒, fsync 込み)"
+        )
+        logger.info(f">> 速度比: {result['speedup']} 倍")
+
+        legacy_path.unlink(missing_ok=True)
+        atomic_path.unlink(missing_ok=True)
+        return result
+
+
+if __name__ == "__main__":
+    benchmark = CSVWriteBenchmark()
+    benchmark.run()
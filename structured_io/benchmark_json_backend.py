@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+#
+# benchmark_json_backend.py
+#
+# [概要]
+# JSONBackend で使える JSON ライブラリ(json / orjson / ujson)の
+# 書き込み・読み込み速度を比較するベンチマーク
+#
+# ExtractJapaneseVideo の出力と同じ形(日本語を含む辞書のリスト)の
+# データを Netflix のデータセット相当の件数(8807件)と
+# その10倍・100倍の件数で作り，
+# ・整形出力(compact=False, インデント4)
+# ・コンパクト出力(compact=True)
+# それぞれの変換時間を計測する．
+# あわせて，どのライブラリでも日本語がエスケープされずに
+# 往復変換できることを確認する．
+#
+
+from features.json_backend import JSONBackend
+from features.setup_logging import setup_logging
+
+from logging import getLogger
+from pathlib import Path
+import importlib.util
+import random
+import time
+
+# 専用のロガーを作成
+logger = getLogger(__name__)
+
+# logging の設定を適用
+logging_config = Path("./config/logging_config.yml")
+setup_logging(logging_config)
+
+
+class JSONBackendBenchmark:
+    def __init__(self, repeat=3, seed=0):
+        self.repeat = repeat
+        self.random = random.Random(seed)
+
+    def make_records(self, num_records):
+        '''
+        [概要]
+        ExtractJapaneseVideo の出力を模したデータを作るメソッド
+        '''
+        words = ["東京", "物語", "アニメ", "侍", "夏", "ラーメン", "学園", "冒険"]
+        records = []
+        for index in range(num_records):
+            title = "".join(self.random.choices(words, k=3))
+            records.append({
+                "title": f"{title} {index}",
+                "type": self.random.choice(["Movie", "TV Show"]),
+                "duration": self.random.choice(["90 min", "1 Season"]),
+            })
+        return records
+
+    def _best_time(self, func):
+        '''
+        [概要]
+        func を repeat 回実行して最短の実行時間(秒)を返すメソッド
+        '''
+        best = None
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def run(self, sizes=(8807, 88070, 880700)):
+        '''
+        [概要]
+        インストールされている全ライブラリについて計測して
+        結果を辞書のリストで返すメソッド
+        '''
+        backends = [
+            JSONBackend(name) for name in JSONBackend.CANDIDATES
+            if importlib.util.find_spec(name) is not None
+        ]
+
+        results = []
+        for size in sizes:
+            records = self.make_records(size)
+            for backend in backends:
+                for compact in (False, True):
+                    encoded = backend.dumps_bytes(records, compact=compact)
+                    assert backend.loads(encoded) == records, \
+                        f"{backend.name} で往復変換に失敗した"
+                    assert b"\\u" not in encoded, \
+                        f"{backend.name} で日本語がエスケープされた"
+
+                    dump_time = self._best_time(
+                        lambda: backend.dumps_bytes(records, compact=compact)
+                    )
+                    load_time = self._best_time(
+                        lambda: backend.loads(encoded)
+                    )
+                    result = {
+                        "records": size,
+                        "backend": backend.name,
+                        "compact": compact,
+                        "bytes": len(encoded),
+                        "dump_sec": round(dump_time, 4),
+                        "load_sec": round(load_time, 4),
+                    }
+                    results.append(result)
+                    logger.info(
+                        f">> {size:>7} 件 {backend.name:<6} "
+                        f"compact={str(compact):<5} "
+                        f"dump: {dump_time:.4f} 秒 / load: {load_time:.4f} 秒"
+                        f" ({len(encoded)} bytes)"
+                    )
+
+        return results
+
+
+if __name__ == "__main__":
+    benchmark = JSONBackendBenchmark()
+    benchmark.run()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+#
+# benchmark_pipeline.py
+#
+# [概要]
+# structured_io の処理(CSVIO / JSONIO / ExtractJapaneseVideo)の
+# 性能を計測するベンチマーク
+#
+# NetflixDataGenerator で指定行数(1万〜1000万行)の CSV を作り，
+# ・parse: CSV を1行ずつ読み取るだけ
+# ・filter: 読み取り + 日本の作品の絞り込み
+# ・write_json: 絞り込み結果を JSON に書き込む
+# ・write_jsonl: 絞り込み結果を JSON Lines に書き込む
+# の各段階を別々に計測し，行/秒とピークメモリ(RSS)を出力する．
+# ピークメモリを段階ごとに測るため，各段階は新しいプロセスで実行する．
+#
+# 結果は output/benchmarks/ に JSON で保存されるので，
+#     python3 benchmark_pipeline.py --compare 古い結果.json 新しい結果.json
+# でバージョン間の性能差(劣化)を確認できる．
+#
+
+from extract_japanese_video import ExtractJapaneseVideo
+from features.json_io import JSONIO
+from features.netflix_data_generator import NetflixDataGenerator
+from features.setup_logging import setup_logging
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from logging import getLogger
+from pathlib import Path
+import argparse
+import multiprocessing
+import platform
+import resource
+import subprocess
+import time
+
+# 専用のロガーを作成
+logger = getLogger(__name__)
+
+# logging の設定を適用
+logging_config = Path("./config/logging_config.yml")
+setup_logging(logging_config)
+
+
+class PipelineBenchmark:
+    STAGES = ["parse", "filter", "write_json", "write_jsonl"]
+
+    def __init__(self, output_dir_path=Path("./output/benchmarks")):
+        self.output_dir_path = output_dir_path
+
+    def _prepare_csv(self, num_rows):
+        '''
+        [概要]
+        ベンチマーク用の CSV を用意するメソッド
+        生成に時間がかかるので，同じ行数の CSV があれば使い回す
+        '''
+        csv_path = self.output_dir_path / f"netflix_{num_rows}.csv"
+        if csv_path.exists() == False:
+            NetflixDataGenerator().write_csv(csv_path, num_rows)
+        return csv_path
+
+    @staticmethod
+    def _run_stage(stage, csv_path, input_rows, output_dir_path):
+        '''
+        [概要]
+        1つの段階を実行して計測結果を辞書で返すメソッド
+        parse / filter の処理量は読み取った行数(input_rows)，
+        write_* の処理量は書き込んだ件数で数える
+        ＊ 新しいプロセスで実行するので静的メソッドとして定義している
+        '''
+        extractor = ExtractJapaneseVideo()
+
+        def read_body():
+            rows = extractor.iter_csv_rows(csv_path)
+            indices = extractor._get_column_indices(next(rows))
+            return rows, indices
+
+        if stage in ("write_json", "write_jsonl"):
+            # 書き込みだけを測るため，絞り込みは計測の外で済ませておく
+            rows, indices = read_body()
+            target_data = extractor._extract_target_data(rows, indices)
+
+        matched = None
+        start = time.perf_counter()
+        if stage == "parse":
+            num_rows = sum(1 for _ in extractor.iter_csv_rows(
+                csv_path, skip_header=True
+            ))
+
+        elif stage == "filter":
+            rows, indices = read_body()
+            matched = len(extractor._extract_target_data(rows, indices))
+            num_rows = input_rows
+
+        elif stage == "write_json":
+            extractor.write_json_data(
+                target_data, output_dir_path / "bench_output.json"
+            )
+            num_rows = len(target_data)
+
+        elif stage == "write_jsonl":
+            json_lines_path = output_dir_path / "bench_output.jsonl"
+            json_lines_path.unlink(missing_ok=True)
+            num_rows = extractor.append_records(target_data, json_lines_path)
+
+        seconds = time.perf_counter() - start
+        # Linux の ru_maxrss は KB 単位(macOS はバイト単位)
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if platform.system() == "Darwin":
+            peak_rss //= 1024
+
+        return {
+            "stage": stage,
+            "rows": num_rows,
+            "matched": matched,
+            "seconds": round(seconds, 4),
+            "rows_per_sec": round(num_rows / seconds) if seconds else None,
+            "peak_rss_mb": round(peak_rss / 1024, 1),
+        }
+
+    def _read_git_revision(self):
+        '''
+        [概要]
+        計測したコードのバージョン(git のコミット)を返すメソッド
+        '''
+        try:
+            return subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                capture_output=True, text=True, check=True
+            ).stdout.strip()
+
+        except Exception:
+            return None
+
+    def run(self, sizes=(10000, 100000, 1000000)):
+        '''
+        [概要]
+        各行数・各段階を計測して結果を JSON に保存するメソッド
+        '''
+        self.output_dir_path.mkdir(parents=True, exist_ok=True)
+        # fork だと親プロセスのメモリ使用量を引き継ぐので spawn を使う
+        context = multiprocessing.get_context("spawn")
+
+        results = []
+        for num_rows in sizes:
+            csv_path = self._prepare_csv(num_rows)
+            for stage in self.STAGES:
+                with ProcessPoolExecutor(
+                        max_workers=1, mp_context=context) as executor:
+                    result = executor.submit(
+                        self._run_stage, stage, csv_path, num_rows,
+                        self.output_dir_path
+                    ).result()
+
+                result["input_rows"] = num_rows
+                results.append(result)
+                logger.info(
+                    f">> {num_rows:>8} 行 {stage:<11} "
+                    f"{result['seconds']:>8.3f} 秒 "
+                    f"{result['rows_per_sec'] or 0:>10} 行/秒 "
+                    f"peak RSS {result['peak_rss_mb']:>7.1f} MB"
+                )
+
+        report = {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": self._read_git_revision(),
+            "python": platform.python_version(),
+            "results": results,
+        }
+        report_path = self.output_dir_path / (
+            f"result_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        )
+        JSONIO().write_json_data(report, report_path)
+        logger.info(f">> 計測結果を保存した: {report_path}")
+
+        return report
+
+    def compare(self, old_report_path, new_report_path, threshold=0.1):
+        '''
+        [概要]
+        2つの計測結果を比較して，行/秒が threshold 以上
+        低下した段階を性能劣化として警告するメソッド
+        劣化した段階のリストを返す
+        '''
+        json_io = JSONIO()
+        old_report = json_io.read_json_data(old_report_path)
+        new_report = json_io.read_json_data(new_report_path)
+
+        old_results = {
+            (result["input_rows"], result["stage"]): result
+            for result in old_report["results"]
+        }
+
+        regressions = []
+        for result in new_report["results"]:
+            key = (result["input_rows"], result["stage"])
+            if key not in old_results:
+                continue
+
+            old_result = old_results[key]
+            # 計測時間が 0 秒だった結果は行/秒が None なので比較できない
+            if not result["rows_per_sec"] or not old_result["rows_per_sec"]:
+                continue
+
+            ratio = result["rows_per_sec"] / old_result["rows_per_sec"]
+            rss_diff = result["peak_rss_mb"] - old_result["peak_rss_mb"]
+            message = (
+                f"{key[0]:>8} 行 {key[1]:<11} 行/秒 {ratio - 1:+.1%} "
+                f"peak RSS {rss_diff:+.1f} MB"
+            )
+            if ratio < 1 - threshold:
+                logger.warning(f">>> 性能劣化: {message}")
+                regressions.append(key)
+            else:
+                logger.info(f">> {message}")
+
+        logger.info(
+            f">> {old_report['git_revision']} -> "
+            f"{new_report['git_revision']}: 劣化 {len(regressions)} 件"
+        )
+        return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="structured_io の処理性能を計測する"
+    )
+    parser.add_argument(
+        "--rows", type=int, nargs="+", default=[10000, 100000, 1000000],
+        help="生成する CSV の行数(複数指定可)"
+    )
+    parser.add_argument(
+        "--compare", type=Path, nargs=2, metavar=("OLD", "NEW"),
+        help="2つの計測結果 JSON を比較する"
+    )
+    args = parser.parse_args()
+
+    benchmark = PipelineBenchmark()
+    if args.compare:
+        benchmark.compare(*args.compare)
+    else:
+        benchmark.run(args.rows)
@@ -2,3 +2,4 @@
 
 rm -f *~ pp2_app.log features/*~ features/pp2_app.log
 rm -rf output features/__pycache__
+rm -f input/*.tblcache
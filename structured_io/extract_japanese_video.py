@@ -15,11 +15,18 @@
 #
 
 from features.csv_io import CSVIO
+from features.csv_tail_reader import CSVTailReader
 from features.json_io import JSONIO
+from features.query_engine import QueryEngine
 from features.setup_logging import setup_logging
 
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+from itertools import islice
+from itertools import repeat
 from logging import getLogger
 from pathlib import Path
+import os
 import re
 
 # 専用のロガーを作成
@@ -43,21 +50,35 @@ class ExtractJapaneseVideo(CSVIO, JSONIO):
         ・_get_column_indices()
         ・_extract_target_data()
         が担っている
+        CSV は iter_csv_rows() で1行ずつ読み取りながら絞り込むので
+        ファイル全体をメモリに載せることはない
+        出力先の拡張子が .jsonl / .ndjson の場合は JSON Lines 形式で
+        1件ずつ追記していくので，結果もメモリに溜めない
         '''
-        csv_data = self.read_csv_data(input_csv_path)
+        rows = self.iter_csv_rows(input_csv_path)
+        header = next(rows, None)
 
-        if not csv_data:
+        if not header:
             logger.warning(
-                f"{input_csv_path} の中身が空でした: {len(csv_data)}"
+                f"{input_csv_path} の中身が空でした: {header}"
             )
             raise ValueError
 
-        header = csv_data[0]
-        body = csv_data[1:]
+        body = rows
 
         try:
             logger.debug(f"> データの分析を開始")
             indices = self._get_column_indices(header)
+
+            if output_json_path.suffix in (".jsonl", ".ndjson"):
+                # JSON Lines の場合は絞り込んだそばから書き出す
+                output_json_path.unlink(missing_ok=True)
+                count = self.append_records(
+                    self._iter_target_data(body, indices), output_json_path
+                )
+                logger.info(f">> 分析結果: {count} 件")
+                return True
+
             target_data = self._extract_target_data(body, indices)
             self.write_json_data(target_data, output_json_path)
             logger.info(f">> 分析結果: {len(target_data)} 件")
@@ -70,6 +91,181 @@ class ExtractJapaneseVideo(CSVIO, JSONIO):
             )
             raise e
 
+    def run_incremental_analysis(self, input_csv_path, output_json_path):
+        '''
+        [概要]
+        追記され続ける CSV について，前回の実行以降に増えた行だけを
+        分析して JSON Lines ファイルに追記するメソッド
+        読み終えた位置は CSVTailReader のチェックポイントで管理し，
+        書き込みに成功してから位置を確定させる
+        '''
+        assert output_json_path.suffix in (".jsonl", ".ndjson"), \
+            "出力先は JSON Lines(.jsonl / .ndjson)で指定"
+
+        tail_reader = CSVTailReader(input_csv_path)
+        body = tail_reader.iter_new_rows(commit=False)
+        # ヘッダーは最初のブロックを読んだ時点で取得される
+        first_rows = list(islice(body, 1))
+
+        if not tail_reader.header:
+            logger.warning(
+                f"{input_csv_path} のヘッダーを取得できていない"
+            )
+            raise ValueError
+
+        try:
+            logger.debug("> 差分の分析を開始")
+            indices = self._get_column_indices(tail_reader.header)
+            count = self.append_records(
+                self._iter_target_data(chain(first_rows, body), indices),
+                output_json_path
+            )
+            tail_reader.commit()
+            logger.info(f">> 差分の分析結果: {count} 件")
+
+            return count
+
+        except Exception as e:
+            logger.error(
+                f"差分データの分析中にエラーが発生: {e}"
+            )
+            raise e
+
+    def run_parallel_analysis(self, input_csv_path, output_json_path,
+                              max_workers=None, chunks_per_worker=4):
+        '''
+        [概要]
+        run_analysis() の並列処理版
+        CSV をレコード境界に揃えたバイト範囲のチャンクに分割し，
+        ProcessPoolExecutor で各チャンクを並列に絞り込んだ後，
+        元の行順を保ったまま結果を連結する
+        '''
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+
+        header, chunks = self.split_csv_chunks(
+            input_csv_path, max_workers * chunks_per_worker
+        )
+
+        if not header:
+            logger.warning(
+                f"{input_csv_path} の中身が空でした: {header}"
+            )
+            raise ValueError
+
+        try:
+            logger.debug(
+                f"> {max_workers} プロセスでデータの分析を開始"
+            )
+            indices = self._get_column_indices(header)
+            target_data = []
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                # map() は投入順に結果を返すので元の行順が保たれる
+                results = executor.map(
+                    self._scan_chunk,
+                    repeat(input_csv_path),
+                    chunks,
+                    repeat(indices),
+                    repeat(self.target_country_pattern.pattern)
+                )
+                for chunk_results in results:
+                    target_data.extend(chunk_results)
+
+            self.write_json_data(target_data, output_json_path)
+            logger.info(f">> 分析結果: {len(target_data)} 件")
+
+            return True
+
+        except Exception as e:
+            logger.error(
+                f"並列データ分析中にエラーが発生: {e}"
+            )
+            raise e
+
+    @staticmethod
+    def _scan_chunk(input_csv_path, chunk, indices, pattern):
+        '''
+        [概要]
+        1つのチャンクを読み取って条件に合うデータを返すメソッド
+        ＊ ProcessPoolExecutor のワーカーで実行するので
+           静的メソッドとして定義している
+        '''
+        start, end = chunk
+        body = CSVIO.read_csv_chunk(input_csv_path, start, end)
+        if not body:
+            return []
+
+        extractor = ExtractJapaneseVideo()
+        extractor.target_country_pattern = re.compile(pattern)
+
+        return extractor._extract_target_data(body, indices)
+
+    def run_table_analysis(self, input_csv_path, output_json_path):
+        '''
+        [概要]
+        CSV を列指向の Table として読み込んで分析するメソッド
+        同じデータに対して何度も絞り込む場合は
+        read_csv_table() の結果を使い回すと速い
+        '''
+        table = self.read_csv_table(input_csv_path)
+
+        try:
+            logger.debug(f"> テーブルを使ってデータの分析を開始")
+            target_table = table.where(
+                country__regex=self.target_country_pattern
+            )
+            target_data = target_table.to_dicts(["title", "type", "duration"])
+            self.write_json_data(target_data, output_json_path)
+            logger.info(f">> 分析結果: {len(target_data)} 件")
+
+            return True
+
+        except Exception as e:
+            logger.error(
+                f"テーブルを使ったデータ分析中にエラーが発生: {e}"
+            )
+            raise e
+
+    def run_queries(self, input_csv_path, queries, output_dir_path):
+        '''
+        [概要]
+        複数のクエリを CSV の1回の走査でまとめて評価し，
+        クエリごとに <クエリ名>.json として保存するメソッド
+        '''
+        assert queries, "クエリを渡して"
+        assert isinstance(output_dir_path, Path), "Pathオブジェクトを渡して"
+
+        rows = self.iter_csv_rows(input_csv_path)
+        header = next(rows, None)
+
+        if not header:
+            logger.warning(
+                f"{input_csv_path} の中身が空でした: {header}"
+            )
+            raise ValueError
+
+        try:
+            logger.debug(f"> {len(queries)} 個のクエリで分析を開始")
+            results = QueryEngine().run(header, rows, queries)
+
+            for name, target_data in results.items():
+                if not target_data:
+                    logger.warning(f">>> {name} に一致するデータはなかった")
+                    continue
+
+                self.write_json_data(
+                    target_data, output_dir_path / f"{name}.json"
+                )
+                logger.info(f">> {name} の分析結果: {len(target_data)} 件")
+
+            return results
+
+        except Exception as e:
+            logger.error(
+                f"クエリによるデータ分析中にエラーが発生: {e}"
+            )
+            raise e
+
     def _get_column_indices(self, header):
         '''
         [概要]
@@ -99,38 +295,42 @@ class ExtractJapaneseVideo(CSVIO, JSONIO):
         [概要]
         データ本体を参照して，条件(Japaneseを含む)に合うデータを
         整形してリストで返す
+        body はリストでもジェネレータでもよい
         '''
         assert body, "body(データ本体)を渡して"
         assert indices, "カラムのインデックスを渡して"
 
-        results = []
-
-        idx_country = indices["country"]
-        idx_title = indices["title"]
-        idx_type = indices["type"]
-        idx_duration = indices["duration"]
-
         try:
-            for row in body:
-                if len(row) <= idx_country:
-                    continue
-
-                country_value = row[idx_country]
-                if self.target_country_pattern.search(country_value):
-                    item = {
-                        "title": row[idx_title],
-                        "type": row[idx_type],
-                        "duration": row[idx_duration]
-                    }
-                    results.append(item)
-
-            return results
+            return list(self._iter_target_data(body, indices))
 
         except Exception as e:
             logger.error(
                 f"データ整形中にエラーが発生: {e}"
             )
             raise e
+
+    def _iter_target_data(self, body, indices):
+        '''
+        [概要]
+        _extract_target_data() のジェネレータ版
+        条件に合うデータを整形して1件ずつ返す
+        '''
+        idx_country = indices["country"]
+        idx_title = indices["title"]
+        idx_type = indices["type"]
+        idx_duration = indices["duration"]
+
+        for row in body:
+            if len(row) <= idx_country:
+                continue
+
+            country_value = row[idx_country]
+            if self.target_country_pattern.search(country_value):
+                yield {
+                    "title": row[idx_title],
+                    "type": row[idx_type],
+                    "duration": row[idx_duration]
+                }
     
 
 if __name__ == "__main__":
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+#
+# atomic_file.py
+#
+# [概要]
+# ファイルを「全部書けたときだけ」置き換えるための
+# 書き込み用コンテキストマネージャを定義したプログラム
+#
+# 同じディレクトリの一時ファイルに書き込み，
+# fsync でディスクに確実に書き出してから os.replace() で
+# 本来のファイル名にリネームする．
+# リネームはアトミックなので，途中でプログラムが落ちても
+# 書きかけのファイルが残ることはない(元のファイルはそのまま)．
+# リネーム後はディレクトリも fsync し，リネーム自体を確実に残す．
+#
+
+from contextlib import contextmanager
+from logging import getLogger
+from pathlib import Path
+import os
+import secrets
+import stat
+
+# 専用のロガーを作成
+logger = getLogger(__name__)
+
+
+@contextmanager
+def atomic_open(file_path, mode="w", **kwargs):
+    '''
+    [概要]
+    file_path をアトミックに書き込むためのファイルオブジェクトを返す関数
+    with ブロックを例外なく抜けた場合だけ file_path が置き換わる
+
+    Arg:
+        file_path (Path): 書き込み先のファイルパス．
+        mode (str): "w" もしくは "wb"．
+        kwargs: open() に渡す encoding や newline など．
+    '''
+    assert isinstance(file_path, Path), "Pathオブジェクトを渡して"
+    assert mode in ("w", "wb"), "modeは w か wb で指定"
+
+    fd, tmp_path = _create_temp_file(file_path)
+    try:
+        if file_path.exists():
+            # 既存ファイルの権限を引き継ぐ
+            os.chmod(tmp_path, stat.S_IMODE(file_path.stat().st_mode))
+        with open(fd, mode, **kwargs) as tmp_file:
+            yield tmp_file
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+
+        os.replace(tmp_path, file_path)
+        _fsync_directory(file_path.parent)
+        logger.debug(f"> {file_path} をアトミックに書き込んだ")
+
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def _create_temp_file(file_path):
+    '''
+    [概要]
+    file_path と同じディレクトリに一時ファイルを作り，(fd, パス)を返す関数
+    権限は 0666 で作り OS に umask を反映させるので，通常の open() と同じになる
+    (umask を読むために os.umask() を変更すると，その間に
+    他のスレッドが作るファイルの権限まで変わってしまう)
+    '''
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0)
+    for _ in range(100):
+        tmp_path = file_path.parent / (
+            f".{file_path.name}.{secrets.token_hex(4)}.tmp"
+        )
+        try:
+            return os.open(tmp_path, flags, 0o666), tmp_path
+
+        except FileExistsError:
+            continue
+
+    raise FileExistsError(f"{file_path} の一時ファイルを作成できない")
+
+
+def _fsync_directory(directory):
+    '''
+    [概要]
+    ディレクトリを fsync してリネームをディスクに書き出す関数
+    ディレクトリを開けない OS(Windows)やファイルシステムでは何もしない
+    '''
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+
+    except OSError:
+        return
+
+    try:
+        os.fsync(fd)
+
+    except OSError:
+        pass
+
+    finally:
+        os.close(fd)
@@ -10,9 +10,21 @@
 # を定義したプログラム
 #
 
+try:
+    from features.atomic_file import atomic_open
+    from features.table import Table
+    from features.table_cache import TableCache
+
+except:
+    from atomic_file import atomic_open
+    from table import Table
+    from table_cache import TableCache
+
+from itertools import islice
 from logging import getLogger
 from pathlib import Path
 import csv
+import io
 
 # 専用のロガーを作成
 logger = getLogger(__name__)
@@ -55,31 +67,264 @@ class CSVIO:
             )
             raise e
 
-    def write_data(self, data_lists, save_csv_path="output.csv"):
+    def iter_csv_rows(self, csv_path, buffer_size=1024 * 1024,
+                      skip_header=False):
+        '''
+        [概要]
+        CSV から1行ずつデータを取り出すジェネレータメソッド
+        read_csv_data() と違って全行をリストに溜めないので
+        ファイルサイズに関係なくメモリ使用量は一定になる
+        buffer_size でファイル読み込み時のバッファサイズ(バイト)を，
+        skip_header=True でヘッダー行を読み飛ばすかを指定する
+        '''
+        assert csv_path, "CSVを指定していない"
+        assert isinstance(csv_path, Path), "CSVはPathオブジェクトで指定"
+        assert isinstance(buffer_size, int), "buffer_sizeは整数型で指定"
+        assert buffer_size > 0, "buffer_sizeは1以上で指定"
+
+        if csv_path.exists() == False:
+            logger.warning(f">>> {csv_path} が存在していません")
+            raise FileNotFoundError
+
+        row_count = 0
+        try:
+            logger.info(f">> {csv_path} をストリーミングで読み取る")
+            with open(
+                csv_path, mode="r", encoding="utf-8",
+                newline="", buffering=buffer_size
+            ) as csv_file:
+                reader = csv.reader(csv_file)
+
+                if skip_header == True:
+                    next(reader, None)
+
+                for row in reader:
+                    row_count += 1
+                    yield row
+
+            logger.info(f">> データを取得した: {row_count}")
+
+        except Exception as e:
+            logger.error(
+                f"ストリーミング読み取り時にエラーが発生: {e}"
+            )
+            raise e
+
+    def iter_csv_dicts(self, csv_path, buffer_size=1024 * 1024,
+                       fieldnames=None):
+        '''
+        [概要]
+        iter_csv_rows() の辞書版
+        1行目(もしくは fieldnames)をキーにした辞書を1件ずつ返す
+        fieldnames を渡した場合は1行目もデータとして扱う
+        '''
+        rows = self.iter_csv_rows(csv_path, buffer_size=buffer_size)
+
+        if fieldnames is None:
+            fieldnames = next(rows, None)
+            if fieldnames is None:
+                logger.warning(f">>> {csv_path} にヘッダーがありません")
+                return
+
+        for row in rows:
+            yield dict(zip(fieldnames, row))
+
+    def read_csv_table(self, csv_path, dict_threshold=0.5, use_cache=True):
+        '''
+        [概要]
+        CSV を列指向の Table として読み込むメソッド
+        iter_csv_rows() で1行ずつ読みながら列ごとの配列に詰めるので
+        行のリストを経由せずに済む
+        use_cache=True の場合は CSV の隣に置いたキャッシュ(.tblcache)を
+        mmap で読み込み，キャッシュが無いか古い場合は解析後に作り直す
+        '''
+        if use_cache == True:
+            table_cache = TableCache()
+            table = table_cache.load(csv_path, dict_threshold=dict_threshold)
+            if table is not None:
+                return table
+
+        rows = self.iter_csv_rows(csv_path)
+        header = next(rows, None)
+
+        if not header:
+            logger.warning(f">>> {csv_path} の中身が空でした")
+            raise ValueError
+
+        try:
+            logger.debug(f"> {csv_path} をテーブルとして読み込む")
+            table = Table.from_rows(
+                header, rows, dict_threshold=dict_threshold
+            )
+
+            if use_cache == True:
+                table_cache.save(csv_path, table, dict_threshold=dict_threshold)
+
+            return table
+
+        except Exception as e:
+            logger.error(
+                f"テーブル読み込み時にエラーが発生: {e}"
+            )
+            raise e
+
+    def split_csv_chunks(self, csv_path, num_chunks, block_size=1024 * 1024):
+        '''
+        [概要]
+        CSV ファイルをバイト範囲 (start, end) のチャンクに分割するメソッド
+        分割位置は必ずレコードの区切り(クォート外の改行の直後)に
+        揃えるので，セル内の改行でレコードが分断されることはない
+        ヘッダー行とチャンクのリストをタプルで返す
+        '''
+        assert csv_path, "CSVを指定していない"
+        assert isinstance(csv_path, Path), "CSVはPathオブジェクトで指定"
+        assert isinstance(num_chunks, int), "num_chunksは整数型で指定"
+        assert num_chunks > 0, "num_chunksは1以上で指定"
+
+        if csv_path.exists() == False:
+            logger.warning(f">>> {csv_path} が存在していません")
+            raise FileNotFoundError
+
+        file_size = csv_path.stat().st_size
+        try:
+            logger.debug(f"> {csv_path} を {num_chunks} 個に分割する")
+            with open(csv_path, mode="rb") as csv_file:
+                header_end = (self._find_record_boundaries(
+                    csv_file, [0], block_size
+                ) or [file_size])[0]
+                body_size = file_size - header_end
+                targets = [
+                    header_end + body_size * i // num_chunks
+                    for i in range(1, num_chunks)
+                ]
+                boundaries = self._find_record_boundaries(
+                    csv_file, targets, block_size
+                )
+                boundaries = [header_end] + boundaries + [file_size]
+
+                csv_file.seek(0)
+                header_text = csv_file.read(header_end).decode("utf-8")
+
+            header = next(csv.reader(io.StringIO(header_text, newline="")), [])
+            chunks = [
+                (start, end) for start, end in zip(boundaries, boundaries[1:])
+                if start < end
+            ]
+            logger.info(f">> {len(chunks)} 個のチャンクに分割した")
+
+            return header, chunks
+
+        except Exception as e:
+            logger.error(
+                f"チャンク分割時にエラーが発生: {e}"
+            )
+            raise e
+
+    def _find_record_boundaries(self, csv_file, targets, block_size):
+        '''
+        [概要]
+        targets(昇順のバイト位置)それぞれについて，その位置以降で
+        最初に現れるレコード区切りの位置をリストで返すメソッド
+        ファイルを先頭から1回だけ走査し，クォートの開閉状態は
+        '"' の個数の偶奇で判定する
+        (エスケープされた "" は2個として数えられるので偶奇は崩れない)
+        区切りが見つからなかった target は結果に含めない
+        '''
+        csv_file.seek(0)
+        pending = sorted(targets)
+        boundaries = []
+        position = 0
+        in_quote = False
+
+        while pending:
+            block = csv_file.read(block_size)
+            if not block:
+                break
+
+            # scanned: in_quote が block[scanned] 時点の状態を表す位置
+            scanned = 0
+            while pending:
+                start = max(pending[0] - position, scanned)
+                if start >= len(block):
+                    break
+                if block.count(b'"', scanned, start) % 2 == 1:
+                    in_quote = not in_quote
+                scanned = start
+
+                boundary = None
+                newline = block.find(b"\n", scanned)
+                while newline != -1:
+                    if block.count(b'"', scanned, newline) % 2 == 1:
+                        in_quote = not in_quote
+                    scanned = newline + 1
+                    if in_quote == False:
+                        boundary = position + newline + 1
+                        break
+                    newline = block.find(b"\n", scanned)
+
+                if boundary is None:
+                    break
+
+                boundaries.append(boundary)
+                while pending and pending[0] < boundary:
+                    pending.pop(0)
+
+            if block.count(b'"', scanned) % 2 == 1:
+                in_quote = not in_quote
+            position += len(block)
+
+        return boundaries
+
+    @staticmethod
+    def read_csv_chunk(csv_path, start, end):
+        '''
+        [概要]
+        split_csv_chunks() で得たバイト範囲だけを読み取って
+        行のリストを返すメソッド
+        ＊ multiprocessing のワーカーから呼び出せるように
+           静的メソッドとして定義している
+        '''
+        with open(csv_path, mode="rb") as csv_file:
+            csv_file.seek(start)
+            text = csv_file.read(end - start).decode("utf-8")
+
+        return list(csv.reader(io.StringIO(text, newline="")))
+
+    def write_data(self, data_lists, save_csv_path=Path("output.csv"),
+                   batch_size=10000):
         '''
         [概要]
-        _make_writer() で生成した変数を使って
         CSVにデータを書き込むメソッド
+        batch_size 行ずつ writerows() でまとめて書き込み，
+        一時ファイルに書き終えてから置き換えるので
+        途中で失敗しても書きかけの CSV は残らない
+        data_lists はリストでもジェネレータでもよい
         '''
         assert save_csv_path, "CSVを指定していない"
         assert isinstance(save_csv_path, Path), "CSVはPathオブジェクトで指定"
+        assert batch_size > 0, "batch_sizeは1以上で指定"
 
         if save_csv_path.exists() == False:
-            save_csv_path.touch()
             logger.info(
                 f">> {save_csv_path} が存在していないので新規作成する"
             )
-        
+
+        count = 0
         try:
-            logger.info(f">> {csv_path} 書き込み用変数を生成")
-            with open(save_csv_path, mode="w", encoding="utf-8") as csv_file:
+            logger.info(f">> {save_csv_path} 書き込み用変数を生成")
+            with atomic_open(
+                save_csv_path, "w", encoding="utf-8", newline=""
+            ) as csv_file:
                 writer = csv.writer(csv_file)
-        
-                logger.debug(f"> {len(data_lists)} 個書き込む")
-                for data in data_lists:
-                    writer.writerow(data)
 
-            logger.debug(f"> {len(data_lists)} 個書き込んだ")
+                rows = iter(data_lists)
+                batch = list(islice(rows, batch_size))
+                while batch:
+                    writer.writerows(batch)
+                    count += len(batch)
+                    batch = list(islice(rows, batch_size))
+
+            logger.debug(f"> {count} 個書き込んだ")
             return True
 
         except Exception as e:
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+#
+# csv_tail_reader.py
+#
+# [概要]
+# CSVIO.add_data_csv() などで追記され続ける CSV から
+# 前回読んだ位置より後ろの「新しく増えた行」だけを取り出すプログラム
+#
+# 読み終えた位置(バイトオフセット)はチェックポイントファイル
+# (<CSV名>.checkpoint.json)に保存しておき，次回はそこから再開する．
+# ・書き込み途中の最終行(クォート内の改行を含む)は次回に持ち越す
+# ・block_size バイトずつ読んで完全な行だけを順に返すので，
+#   初回(ファイル全体)でもメモリに載るのは1ブロック分だけ
+# ・ファイルが切り詰められた/別ファイルに置き換えられた場合は
+#   先頭から読み直す
+#
+
+try:
+    from features.atomic_file import atomic_open
+
+except:
+    from atomic_file import atomic_open
+
+from logging import getLogger
+from pathlib import Path
+import csv
+import hashlib
+import io
+import json
+import os
+
+# 専用のロガーを作成
+logger = getLogger(__name__)
+
+
+class CSVTailReader:
+    # 置き換え検知用に，読み終えた位置の直前から取るバイト数
+    FINGERPRINT_BYTES = 64
+
+    def __init__(self, csv_path, checkpoint_path=None, skip_header=True,
+                 block_size=1024 * 1024):
+        assert csv_path, "CSVを指定していない"
+        assert isinstance(csv_path, Path), "CSVはPathオブジェクトで指定"
+
+        self.csv_path = csv_path
+        if checkpoint_path is None:
+            checkpoint_path = csv_path.with_name(
+                csv_path.name + ".checkpoint.json"
+            )
+        self.checkpoint_path = checkpoint_path
+        self.skip_header = skip_header
+        # 1回に読み込むバイト数
+        self.block_size = block_size
+        self.checkpoint = self._load_checkpoint()
+        self._pending = None
+
+    @property
+    def header(self):
+        '''
+        [概要]
+        先頭から読んだときに取得したヘッダー行
+        (skip_header=True の場合のみ．commit() 前の読み取り結果も含む)
+        '''
+        if self._pending:
+            return self._pending.get("header")
+        return self.checkpoint.get("header")
+
+    def _load_checkpoint(self):
+        '''
+        [概要]
+        チェックポイントファイルを読み込むメソッド
+        存在しない・壊れている場合は先頭から読む状態を返す
+        '''
+        if self.checkpoint_path.exists() == False:
+            return {"offset": 0}
+
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                checkpoint = json.load(f)
+            logger.debug(
+                f"> チェックポイントを読み込んだ: {checkpoint['offset']} bytes"
+            )
+            return checkpoint
+
+        except Exception as e:
+            logger.warning(
+                f">>> チェックポイントが読めないので先頭から読む: {e}"
+            )
+            return {"offset": 0}
+
+    def _save_checkpoint(self):
+        '''
+        [概要]
+        チェックポイントを一時ファイル経由で保存するメソッド
+        '''
+        with atomic_open(
+                self.checkpoint_path, "w", encoding="utf-8") as tmp_file:
+            json.dump(self.checkpoint, tmp_file, ensure_ascii=False)
+
+    def _fingerprint(self, csv_file, offset):
+        '''
+        [概要]
+        offset の直前 FINGERPRINT_BYTES バイトのハッシュを返すメソッド
+        前回読み終えた位置までの内容が変わっていないかの確認に使う
+        '''
+        start = max(offset - self.FINGERPRINT_BYTES, 0)
+        csv_file.seek(start)
+        return hashlib.sha256(csv_file.read(offset - start)).hexdigest()
+
+    def _is_rotated(self, csv_file, stat):
+        '''
+        [概要]
+        前回読んだときからファイルが切り詰められたり
+        別ファイルに置き換えられたりしていないかを判定するメソッド
+        '''
+        offset = self.checkpoint["offset"]
+        if offset == 0:
+            return False
+
+        if stat.st_size < offset:
+            logger.warning(f">>> {self.csv_path} が切り詰められた")
+            return True
+
+        if self.checkpoint.get("inode") not in (None, stat.st_ino):
+            logger.warning(f">>> {self.csv_path} が置き換えられた")
+            return True
+
+        if self.checkpoint.get("fingerprint") != self._fingerprint(
+                csv_file, offset):
+            logger.warning(f">>> {self.csv_path} の既読部分が書き換えられた")
+            return True
+
+        return False
+
+    def _find_last_boundary(self, data):
+        '''
+        [概要]
+        data の中で最後のレコード区切り(クォート外の改行の直後)を返すメソッド
+        data はレコードの先頭から始まっている前提で，
+        区切りが無ければ 0 を返す
+        '''
+        newline = data.rfind(b"\n")
+        while newline != -1:
+            if data.count(b'"', 0, newline) % 2 == 0:
+                return newline + 1
+            newline = data.rfind(b"\n", 0, newline)
+
+        return 0
+
+    def iter_new_rows(self, commit=True):
+        '''
+        [概要]
+        前回の続きから，新しく追記された完全な行を1行ずつ返すジェネレータ
+        block_size バイトずつ読み，最後のレコード区切りまでを行に変換して返す
+        読み終えた位置はブロックの行を全て返し終えた分だけ進めるので，
+        途中でやめた場合は返し終えていないブロックから次回に読み直す
+        commit=True の場合は最後まで読んだ後でチェックポイントに保存する
+        (False の場合は処理が成功した後で commit() を呼ぶ)
+        '''
+        if self.csv_path.exists() == False:
+            logger.warning(f">>> {self.csv_path} が存在していません")
+            raise FileNotFoundError
+
+        try:
+            with open(self.csv_path, mode="rb") as csv_file:
+                stat = os.fstat(csv_file.fileno())
+                if self._is_rotated(csv_file, stat):
+                    self.checkpoint = {"offset": 0}
+
+                offset = self.checkpoint["offset"]
+                # 読み終えた位置の直前のバイト列(置き換え検知用)
+                start = max(offset - self.FINGERPRINT_BYTES, 0)
+                csv_file.seek(start)
+                tail = csv_file.read(offset - start)
+                self._pending = {
+                    "offset": offset,
+                    "inode": stat.st_ino,
+                    "fingerprint": hashlib.sha256(tail).hexdigest(),
+                    "header": self.checkpoint.get("header"),
+                }
+                need_header = offset == 0 and self.skip_header == True
+
+                num_rows = 0
+                carry = b""
+                position = offset
+                # 読んでいる間に追記された分は次回に回す
+                while position < stat.st_size:
+                    block = csv_file.read(
+                        min(self.block_size, stat.st_size - position)
+                    )
+                    if not block:
+                        break
+                    position += len(block)
+
+                    data = carry + block
+                    boundary = self._find_last_boundary(data)
+                    # 1行が block_size より長い場合は次のブロックとつなげる
+                    carry = data[boundary:]
+                    if boundary == 0:
+                        continue
+
+                    text = data[:boundary].decode("utf-8")
+                    rows = csv.reader(io.StringIO(text, newline=""))
+                    if need_header:
+                        self._pending["header"] = next(rows, None)
+                        need_header = False
+
+                    for row in rows:
+                        num_rows += 1
+                        yield row
+
+                    tail_start = max(boundary - self.FINGERPRINT_BYTES, 0)
+                    tail = tail + data[tail_start:boundary]
+                    tail = tail[-self.FINGERPRINT_BYTES:]
+                    self._pending["offset"] += boundary
+                    self._pending["fingerprint"] = \
+                        hashlib.sha256(tail).hexdigest()
+
+            if carry:
+                logger.debug(
+                    f"> 書き込み途中の {len(carry)} bytes は次回に回す"
+                )
+
+            logger.info(f">> {self.csv_path} から {num_rows} 行の差分を取得")
+            if commit == True:
+                self.commit()
+
+        except Exception as e:
+            logger.error(
+                f"差分の読み取り時にエラーが発生: {e}"
+            )
+            raise e
+
+    def read_new_rows(self, commit=True):
+        '''
+        [概要]
+        iter_new_rows() の結果をリストで返すメソッド
+        差分が大きくなりうる場合は iter_new_rows() で1行ずつ処理する
+        '''
+        return list(self.iter_new_rows(commit))
+
+    def commit(self):
+        '''
+        [概要]
+        直前の iter_new_rows() / read_new_rows() で読んだ位置を
+        チェックポイントに保存するメソッド
+        '''
+        assert self._pending, "先に iter_new_rows() を実行して"
+
+        self.checkpoint = self._pending
+        self._pending = None
+        self._save_checkpoint()
+        logger.debug(
+            f"> チェックポイントを保存した: {self.checkpoint['offset']} bytes"
+        )
+        return True
+
+
+if __name__ == "__main__":
+    from setup_logging import setup_logging
+
+    logging_config = Path("../config/logging_config.yml")
+    setup_logging(logging_config)
+
+    tail_reader = CSVTailReader(Path("output.csv"))
+    tail_reader.read_new_rows()
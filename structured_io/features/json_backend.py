@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+#
+# json_backend.py
+#
+# [概要]
+# JSON のエンコード/デコードに使うライブラリを切り替えるプログラム
+#
+# orjson や ujson がインストールされていればそちらを使い，
+# 無ければ標準ライブラリの json を使う．
+# どのライブラリでも日本語はエスケープせずに(ensure_ascii=False 相当)
+# UTF-8 のまま出力する．
+#
+# なお，整形(インデント4)出力は従来の出力と完全に一致させるため
+# 常に標準ライブラリの json を使い，高速なライブラリは
+# インデント無しのコンパクト出力で使う．
+#
+
+from logging import getLogger
+import importlib
+import json
+
+# 専用のロガーを作成
+logger = getLogger(__name__)
+
+
+class JSONBackend:
+    # 優先順位の高い順に並べたライブラリ名
+    CANDIDATES = ["orjson", "ujson", "json"]
+
+    def __init__(self, name=None):
+        candidates = [name] if name else self.CANDIDATES
+        self.name, self.module = self._import_backend(candidates)
+
+    def _import_backend(self, candidates):
+        '''
+        [概要]
+        候補のライブラリを順番に import して
+        最初に成功したものを返すメソッド
+        '''
+        for candidate in candidates:
+            try:
+                module = importlib.import_module(candidate)
+                logger.debug(f"> JSON バックエンドに {candidate} を使う")
+                return candidate, module
+
+            except ImportError:
+                logger.debug(f"> {candidate} はインストールされていない")
+
+        logger.warning(f">>> {candidates} が見つからないので json を使う")
+        return "json", json
+
+    def dumps_bytes(self, data, compact=True):
+        '''
+        [概要]
+        データを UTF-8 の JSON バイト列に変換するメソッド
+        compact=False の場合はインデント4で整形する
+        '''
+        if compact == False or self.name == "json":
+            return self._stdlib_dumps(data, compact).encode("utf-8")
+
+        try:
+            if self.name == "orjson":
+                return self.module.dumps(data)
+            return self.module.dumps(
+                data, ensure_ascii=False, escape_forward_slashes=False
+            ).encode("utf-8")
+
+        except (TypeError, OverflowError) as e:
+            # 文字列以外のキーや巨大な整数など，
+            # 高速ライブラリが扱えないデータは標準ライブラリに任せる
+            logger.debug(f"> {self.name} で変換できないので json を使う: {e}")
+            return self._stdlib_dumps(data, compact).encode("utf-8")
+
+    def dumps(self, data, compact=True):
+        '''
+        [概要]
+        データを JSON 文字列に変換するメソッド
+        '''
+        if compact == False or self.name == "json":
+            return self._stdlib_dumps(data, compact)
+        return self.dumps_bytes(data, compact).decode("utf-8")
+
+    def loads(self, text):
+        '''
+        [概要]
+        JSON 文字列(またはバイト列)をデータに変換するメソッド
+        '''
+        return self.module.loads(text)
+
+    def _stdlib_dumps(self, data, compact):
+        if compact == True:
+            return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+        return json.dumps(data, ensure_ascii=False, indent=4)
@@ -7,18 +7,29 @@
 # ・既存ファイルからのデータ読み取り
 # ・JSON ファイルを新規作成して書き込み
 # ・既存の JSON ファイルに書き込み
+# ・JSON Lines(1行1レコード)形式での追記と逐次読み取り
 # を定義したプログラム
 # 
 
+try:
+    from features.atomic_file import atomic_open
+    from features.json_backend import JSONBackend
+
+except:
+    from atomic_file import atomic_open
+    from json_backend import JSONBackend
+
 from logging import getLogger
 from pathlib import Path
-import json
 
 # 専用のロガーを作成
 logger = getLogger(__name__)
 
 
 class JSONIO:
+    # エンコード/デコードに使うライブラリ(インスタンスごとに差し替え可能)
+    json_backend = JSONBackend()
+
     def __init__(self):
         pass
 
@@ -38,11 +49,8 @@ class JSONIO:
             
         try:
             logger.debug(f"> データを取得する")
-            with open(json_path, "r", encoding="utf-8") as json_file:
-                self.json_data = json.load(json_file)
-                logger.debug(
-                    f"> 取得したデータ: {self.json_data}"
-                )
+            with open(json_path, "rb") as json_file:
+                self.json_data = self.json_backend.loads(json_file.read())
                 logger.info(f">> {len(self.json_data)} 個のデータを取得した")
                 return self.json_data
 
@@ -52,11 +60,16 @@ class JSONIO:
             )
             raise e
         
-    def write_json_data(self, data, save_json_path=Path("./output.json")):
+    def write_json_data(self, data, save_json_path=Path("./output.json"),
+                        compact=False):
         '''
         [概要]
         JSONファイルにデータを書き込むメソッド
         書き込み対象のJSONが存在しない場合でも新規作成した上で書き込む
+        一時ファイルに書き終えてから置き換えるので
+        途中で失敗しても書きかけの JSON は残らない
+        compact=True の場合はインデント無しで書き込む
+        (高速な JSON ライブラリが使えるのはこちら)
         '''
         assert data, "書き込むデータを辞書型・JSON型で渡して"
         
@@ -64,16 +77,15 @@ class JSONIO:
         assert isinstance(save_json_path, Path), "Pathオブジェクトを渡して"
 
         if save_json_path.exists() == False:
-            save_json_path.touch()
             logger.info(
-                f">> {save_json_path} がないので新規作成した"
+                f">> {save_json_path} がないので新規作成する"
             )
 
         try:
             logger.debug(f"> {save_json_path} にデータを書き込む")
-            with open(save_json_path, "w", encoding="utf-8") as json_file:
-                json.dump(
-                    data, json_file, ensure_ascii=False, indent=4
+            with atomic_open(save_json_path, "wb") as json_file:
+                json_file.write(
+                    self.json_backend.dumps_bytes(data, compact=compact)
                 )
             logger.info(
                 f">> {len(data)} 個のデータを書き込んだ"
@@ -85,6 +97,85 @@ class JSONIO:
             )
             raise e
 
+    def append_records(self, records, json_lines_path, batch_size=1000):
+        '''
+        [概要]
+        レコード(辞書など)を JSON Lines 形式で1行ずつ追記するメソッド
+        records はリストでもジェネレータでもよく，batch_size 件ごとに
+        まとめて書き込んでフラッシュするので，読み手は書き込み途中でも
+        それまでのレコードを iter_records() で読み取れる
+        書き込んだ件数を返す
+        '''
+        assert json_lines_path, "JSON Linesファイルパスを渡して"
+        assert isinstance(json_lines_path, Path), "Pathオブジェクトを渡して"
+        assert batch_size > 0, "batch_sizeは1以上で指定"
+
+        count = 0
+        try:
+            logger.debug(f"> {json_lines_path} にレコードを追記する")
+            with open(json_lines_path, "a", encoding="utf-8") as json_file:
+                lines = []
+                for record in records:
+                    lines.append(self.json_backend.dumps(record))
+                    if len(lines) >= batch_size:
+                        json_file.write("\n".join(lines) + "\n")
+                        json_file.flush()
+                        count += len(lines)
+                        lines = []
+
+                if lines:
+                    json_file.write("\n".join(lines) + "\n")
+                    count += len(lines)
+
+            logger.info(f">> {count} 個のレコードを追記した")
+            return count
+
+        except Exception as e:
+            logger.error(
+                f"レコード追記時にエラーが発生: {e}"
+            )
+            raise e
+
+    def iter_records(self, json_lines_path):
+        '''
+        [概要]
+        JSON Lines 形式のファイルから1件ずつレコードを返すジェネレータ
+        ファイル全体を読み込まないので，大きなファイルでもメモリは一定
+        書き込み途中で改行が付いていない最終行は読み飛ばす
+        '''
+        assert json_lines_path, "JSON Linesファイルパスを渡して"
+        assert isinstance(json_lines_path, Path), "Pathオブジェクトを渡して"
+
+        if json_lines_path.exists() == False:
+            logger.warning(
+                f">>> {json_lines_path} が存在していない"
+            )
+            raise FileNotFoundError
+
+        count = 0
+        try:
+            logger.debug(f"> {json_lines_path} からレコードを読み取る")
+            with open(json_lines_path, "r", encoding="utf-8") as json_file:
+                for line in json_file:
+                    if not line.endswith("\n"):
+                        logger.warning(
+                            f">>> 書き込み途中の行を読み飛ばした: {line[:50]}"
+                        )
+                        break
+                    if not line.strip():
+                        continue
+
+                    count += 1
+                    yield self.json_backend.loads(line)
+
+            logger.info(f">> {count} 個のレコードを取得した")
+
+        except Exception as e:
+            logger.error(
+                f"レコード読み取り時にエラーが発生: {e}"
+            )
+            raise e
+
 
 if __name__ == "__main__":
     from setup_logging import setup_logging
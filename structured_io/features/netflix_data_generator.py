@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+#
+# netflix_data_generator.py
+#
+# [概要]
+# ベンチマーク用に Kaggle の Netflix Movies and TV Shows
+# (netflix_titles.csv)と同じ列構成の CSV を
+# 好きな行数で作るプログラム
+#
+# 日本語のタイトルや説明文，カンマ・ダブルクォート・改行を含む
+# セルを混ぜているので，実データと同じように
+# クォート処理が必要な CSV になる．
+# 行は1行ずつ書き出すので 1000万行でもメモリは増えない．
+#
+
+from logging import getLogger
+from pathlib import Path
+import csv
+import random
+
+# 専用のロガーを作成
+logger = getLogger(__name__)
+
+
+class NetflixDataGenerator:
+    HEADER = [
+        "show_id", "type", "title", "director", "cast", "country",
+        "date_added", "release_year", "rating", "duration", "listed_in",
+        "description"
+    ]
+    COUNTRIES = [
+        "United States", "India", "Japan", "United Kingdom", "South Korea",
+        "Canada", "Spain", "France", "Japan, United States", "Mexico", ""
+    ]
+    # 実データに近い比率になるように Japan を含む国の重みを調整している
+    COUNTRY_WEIGHTS = [35, 12, 3, 5, 2, 3, 2, 2, 1, 2, 33]
+    RATINGS = ["TV-MA", "TV-14", "TV-PG", "R", "PG-13", "TV-Y7", "PG"]
+    GENRES = [
+        "Dramas", "Comedies", "International TV Shows", "Anime Series",
+        "Documentaries", "Action & Adventure", "Romantic Movies"
+    ]
+    JAPANESE_WORDS = [
+        "東京", "物語", "侍", "夏祭り", "ラーメン", "学園", "冒険", "星空",
+        "忍者", "桜", "探偵", "青春", "魔法", "列車", "海辺", "約束"
+    ]
+    ENGLISH_WORDS = [
+        "Love", "Night", "Story", "City", "Dark", "Last", "Secret",
+        "Summer", "Lost", "Island", "King", "Road", "Heart", "War"
+    ]
+    NAMES = [
+        "Hayao Miyazaki", "Makoto Shinkai", "Steven Spielberg",
+        "Bong Joon Ho", "Greta Gerwig", "Christopher Nolan", "是枝裕和"
+    ]
+    MONTHS = [
+        "January", "February", "March", "April", "May", "June", "July",
+        "August", "September", "October", "November", "December"
+    ]
+
+    def __init__(self, seed=0):
+        self.random = random.Random(seed)
+
+    def make_row(self, index):
+        '''
+        [概要]
+        1行分のデータをリストで返すメソッド
+        '''
+        rand = self.random
+        country = rand.choices(self.COUNTRIES, self.COUNTRY_WEIGHTS)[0]
+        is_movie = rand.random() < 0.7
+        if "Japan" in country or rand.random() < 0.1:
+            title = "".join(rand.choices(self.JAPANESE_WORDS, k=2))
+        else:
+            title = " ".join(rand.choices(self.ENGLISH_WORDS, k=2))
+
+        description = "、".join(rand.choices(self.JAPANESE_WORDS, k=6))
+        if rand.random() < 0.05:
+            # クォート内の改行やダブルクォートを含むセル
+            description += '\n"特別編" を収録'
+
+        return [
+            f"s{index + 1}",
+            "Movie" if is_movie else "TV Show",
+            title,
+            rand.choice(self.NAMES) if rand.random() < 0.7 else "",
+            ", ".join(rand.choices(self.NAMES, k=rand.randint(0, 4))),
+            country,
+            f"{rand.choice(self.MONTHS)} {rand.randint(1, 28)}, "
+            f"{rand.randint(2015, 2021)}",
+            str(rand.randint(1942, 2021)),
+            rand.choice(self.RATINGS),
+            f"{rand.randint(60, 180)} min" if is_movie
+            else f"{rand.randint(1, 9)} Seasons",
+            ", ".join(rand.sample(self.GENRES, k=rand.randint(1, 3))),
+            description,
+        ]
+
+    def write_csv(self, csv_path, num_rows):
+        '''
+        [概要]
+        num_rows 行のデータを CSV ファイルに書き出すメソッド
+        '''
+        assert isinstance(csv_path, Path), "CSVはPathオブジェクトで指定"
+        assert num_rows > 0, "num_rowsは1以上で指定"
+
+        try:
+            logger.info(f">> {csv_path} に {num_rows} 行を生成する")
+            with open(csv_path, "w", encoding="utf-8", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(self.HEADER)
+                for index in range(num_rows):
+                    writer.writerow(self.make_row(index))
+
+            logger.info(f">> {csv_path} を生成した")
+            return True
+
+        except Exception as e:
+            logger.error(
+                f"ベンチマーク用 CSV の生成時にエラーが発生: {e}"
+            )
+            raise e
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+#
+# query_engine.py
+#
+# [概要]
+# CSV の行に対する絞り込み条件・出力する列・並び替え・件数制限を
+# 宣言的に書ける簡易クエリエンジン
+#
+# ・Condition: 1つの列に対する条件(一致/正規表現/範囲など)
+# ・AllOf / AnyOf: 条件の AND / OR
+# ・Query: 条件 + 出力列(fields) + 並び替え(order_by) + 件数(limit)
+# ・QueryEngine: 複数の Query を1回の走査でまとめて評価する
+#
+# クエリは YAML (config/queries.yml) にも書けるようにしている．
+#
+
+try:
+    from features.read_yml import read_yml
+
+except:
+    from read_yml import read_yml
+
+from logging import getLogger
+import operator
+import re
+
+# 専用のロガーを作成
+logger = getLogger(__name__)
+
+# "90 min" や "2 Seasons" のような値から先頭の数値を取り出す
+NUMBER_PATTERN = re.compile(r"^\s*(-?\d+(?:\.\d+)?)")
+
+
+def to_number(value):
+    '''
+    [概要]
+    文字列の先頭にある数値を取り出して返す関数
+    数値が無ければ None を返す
+    '''
+    match = NUMBER_PATTERN.match(value)
+    if match is None:
+        return None
+    return float(match.group(1))
+
+
+class Condition:
+    # 文字列として比較する演算子
+    TEXT_OPERATORS = {
+        "eq": operator.eq,
+        "ne": operator.ne,
+        "contains": lambda value, target: target in value,
+        "in": lambda value, target: value in target,
+    }
+    # 数値として比較する演算子(release_year や duration 向け)
+    NUMBER_OPERATORS = {
+        "gt": operator.gt,
+        "gte": operator.ge,
+        "lt": operator.lt,
+        "lte": operator.le,
+        "between": lambda value, target: target[0] <= value <= target[1],
+    }
+
+    def __init__(self, column, op, value):
+        assert column, "列名を渡して"
+        assert op == "regex" or op in self.TEXT_OPERATORS \
+            or op in self.NUMBER_OPERATORS, f"{op} は未対応の演算子"
+
+        self.column = column
+        self.op = op
+        self.value = value
+
+    def columns(self):
+        return {self.column}
+
+    def compile(self, indices):
+        '''
+        [概要]
+        列名を列番号に置き換えた判定関数(行 -> bool)を返すメソッド
+        走査中に辞書の参照や演算子の選択をしなくて済むようにしている
+        '''
+        index = indices[self.column]
+
+        if self.op == "regex":
+            pattern = re.compile(self.value)
+            return lambda row: bool(pattern.search(row[index]))
+
+        if self.op in self.TEXT_OPERATORS:
+            func = self.TEXT_OPERATORS[self.op]
+            target = self.value
+            if self.op == "in":
+                target = {str(value) for value in target}
+            elif self.op in ("eq", "ne"):
+                target = str(target)
+            return lambda row: func(row[index], target)
+
+        func = self.NUMBER_OPERATORS[self.op]
+        if self.op == "between":
+            target = (float(self.value[0]), float(self.value[1]))
+        else:
+            target = float(self.value)
+
+        def predicate(row):
+            number = to_number(row[index])
+            return number is not None and func(number, target)
+
+        return predicate
+
+
+class AllOf:
+    def __init__(self, *conditions):
+        self.conditions = conditions
+
+    def columns(self):
+        return set().union(*(cond.columns() for cond in self.conditions))
+
+    def compile(self, indices):
+        predicates = [cond.compile(indices) for cond in self.conditions]
+        return lambda row: all(predicate(row) for predicate in predicates)
+
+
+class AnyOf:
+    def __init__(self, *conditions):
+        self.conditions = conditions
+
+    def columns(self):
+        return set().union(*(cond.columns() for cond in self.conditions))
+
+    def compile(self, indices):
+        predicates = [cond.compile(indices) for cond in self.conditions]
+        return lambda row: any(predicate(row) for predicate in predicates)
+
+
+class Query:
+    def __init__(self, name, where=None, fields=None, order_by=None,
+                 descending=False, limit=None):
+        assert name, "クエリ名を渡して"
+        assert limit is None or limit > 0, "limitは1以上で指定"
+
+        self.name = name
+        self.where = where if where is not None else AllOf()
+        self.fields = fields
+        self.order_by = order_by
+        self.descending = descending
+        self.limit = limit
+
+    @classmethod
+    def from_dict(cls, name, spec):
+        '''
+        [概要]
+        YAML などから読み込んだ辞書を Query に変換するメソッド
+        where は以下の形で書く
+            - [列名, 演算子, 値]      -> Condition
+            - {all: [...]}             -> AllOf
+            - {any: [...]}             -> AnyOf
+        '''
+        return cls(
+            name,
+            where=cls._parse_condition(spec.get("where")),
+            fields=spec.get("fields"),
+            order_by=spec.get("order_by"),
+            descending=spec.get("descending", False),
+            limit=spec.get("limit"),
+        )
+
+    @classmethod
+    def _parse_condition(cls, spec):
+        if spec is None:
+            return None
+
+        if isinstance(spec, dict):
+            assert len(spec) == 1, "all か any のどちらか1つを指定して"
+            key, children = next(iter(spec.items()))
+            assert key in ("all", "any"), f"{key} は未対応の結合方法"
+            conditions = [cls._parse_condition(child) for child in children]
+            return AllOf(*conditions) if key == "all" else AnyOf(*conditions)
+
+        assert len(spec) == 3, "条件は [列名, 演算子, 値] で指定して"
+        return Condition(*spec)
+
+    def columns(self):
+        '''
+        [概要]
+        クエリが参照する全ての列名を返すメソッド
+        '''
+        columns = set(self.where.columns()) | set(self.fields or [])
+        if self.order_by:
+            columns.add(self.order_by)
+        return columns
+
+
+class _QueryRunner:
+    '''
+    [概要]
+    1つの Query の評価状態(判定関数と途中結果)を保持するクラス
+    '''
+    def __init__(self, query, header, indices):
+        self.query = query
+        self.predicate = query.where.compile(indices)
+        fields = query.fields or header
+        self.projection = [(field, indices[field]) for field in fields]
+        self.order_index = None
+        if query.order_by:
+            self.order_index = indices[query.order_by]
+        self.results = []
+        self.matched = 0
+
+    def feed(self, row):
+        if not self.predicate(row):
+            return
+
+        self.matched += 1
+        limit = self.query.limit
+        if self.order_index is None:
+            if limit is None or len(self.results) < limit:
+                self.results.append(self._project(row))
+            return
+
+        self.results.append((self._sort_key(row), self._project(row)))
+        # 並び替え + 件数制限がある場合は溜まり過ぎる前に上位だけ残す
+        if limit is not None and len(self.results) >= limit * 2:
+            self._trim()
+
+    def _project(self, row):
+        return {field: row[index] for field, index in self.projection}
+
+    def _sort_key(self, row):
+        value = row[self.order_index]
+        number = to_number(value)
+        if number is not None:
+            return (0, number, value)
+        return (1, 0, value)
+
+    def _trim(self):
+        self.results.sort(
+            key=lambda item: item[0], reverse=self.query.descending
+        )
+        if self.query.limit is not None:
+            del self.results[self.query.limit:]
+
+    def finish(self):
+        if self.order_index is None:
+            return self.results
+
+        self._trim()
+        return [item for _, item in self.results]
+
+
+class QueryEngine:
+    def __init__(self):
+        pass
+
+    def load_queries(self, yml_path):
+        '''
+        [概要]
+        YAML ファイルに書かれたクエリ定義を Query のリストにするメソッド
+        '''
+        config = read_yml(yml_path)
+        if not config:
+            logger.warning(f">>> {yml_path} からクエリを読み込めなかった")
+            raise FileNotFoundError
+
+        queries = [
+            Query.from_dict(name, spec)
+            for name, spec in config.get("queries", {}).items()
+        ]
+        logger.info(f">> {len(queries)} 個のクエリを読み込んだ")
+        return queries
+
+    def run(self, header, rows, queries):
+        '''
+        [概要]
+        rows を1回だけ走査して，全てのクエリの結果をまとめて返すメソッド
+        結果は {クエリ名: 辞書のリスト} の形
+        '''
+        assert header, "ヘッダーリストを渡して"
+        assert queries, "クエリを渡して"
+
+        indices = {name: index for index, name in enumerate(header)}
+        for query in queries:
+            missing = query.columns() - set(indices)
+            if missing:
+                logger.warning(
+                    f">>> {query.name} が存在しない列を参照している: {missing}"
+                )
+                raise KeyError(missing)
+
+        runners = [_QueryRunner(query, header, indices) for query in queries]
+        num_columns = len(header)
+
+        try:
+            logger.debug(f"> {len(runners)} 個のクエリを同時に評価する")
+            row_count = 0
+            for row in rows:
+                if len(row) < num_columns:
+                    continue
+
+                row_count += 1
+                for runner in runners:
+                    runner.feed(row)
+
+            results = {}
+            for runner in runners:
+                results[runner.query.name] = runner.finish()
+                logger.debug(
+                    f"> {runner.query.name}: {runner.matched} 件が一致"
+                )
+
+            logger.info(
+                f">> {row_count} 行を走査して {len(runners)} 個のクエリを評価した"
+            )
+            return results
+
+        except Exception as e:
+            logger.error(
+                f"クエリ評価中にエラーが発生: {e}"
+            )
+            raise e
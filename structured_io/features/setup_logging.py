@@ -8,8 +8,11 @@
 # Pythonスクリプト．
 #
 
-from features.read_yml import read_yml
-#from read_yml import read_yml
+try:
+    from features.read_yml import read_yml
+
+except:
+    from read_yml import read_yml
 
 import logging
 from logging import getLogger, basicConfig
@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+#
+# table.py
+#
+# [概要]
+# CSV のデータを列ごとにまとめて保持する
+# 列指向(カラムナ)のテーブルを定義したプログラム
+#
+# 行ごとに文字列のリストを持つ代わりに
+# ・整数だけの列は array('q') (8バイト/セル)
+# ・種類の少ない文字列の列は辞書符号化(値の一覧 + 番号の配列)
+#   (読み込み中に値の種類が max_dict_values を超えた列は途中で諦める)
+# ・それ以外の列は文字列のリスト(キャッシュから読んだ場合は StringColumn)
+# として保持するので，行数が多いほどメモリを節約できる．
+# また where() による絞り込みは辞書符号化された列なら
+# 値の種類ごとに1回だけ判定すればよいので高速に動作する．
+# gt / gte / lt / lte は列の型によらず数値として比較する．
+#
+
+try:
+    from features.query_engine import to_number
+
+except:
+    from query_engine import to_number
+
+from array import array
+from itertools import compress
+from logging import getLogger
+import operator
+import re
+
+# 専用のロガーを作成
+logger = getLogger(__name__)
+
+# 整数列(array("q"))に入る値の範囲
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+
+
+class DictEncodedColumn:
+    '''
+    [概要]
+    辞書符号化された文字列の列
+    values に値の一覧を，codes に各行の値が values の何番目かを保持する
+    '''
+    def __init__(self, codes, values):
+        self.codes = codes
+        self.values = values
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        return self.values[self.codes[index]]
+
+    def __iter__(self):
+        values = self.values
+        for code in self.codes:
+            yield values[code]
+
+
+class StringColumn:
+    '''
+    [概要]
+    UTF-8 のバイト列と各セルの開始位置(offsets)で文字列の列を表すクラス
+    キャッシュファイルを mmap したバッファをそのまま参照し，
+    アクセスされたセルだけを文字列に変換する
+    '''
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        start = self.offsets[index]
+        end = self.offsets[index + 1]
+        return str(self.data[start:end], "utf-8")
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+class Table:
+    # where() で使える演算子
+    OPERATORS = {
+        "eq": operator.eq,
+        "ne": operator.ne,
+        "gt": operator.gt,
+        "gte": operator.ge,
+        "lt": operator.lt,
+        "lte": operator.le,
+        "in": lambda value, target: value in target,
+        "contains": lambda value, target: target in str(value),
+        "icontains": lambda value, target: (
+            target.lower() in str(value).lower()
+        ),
+        "startswith": lambda value, target: str(value).startswith(target),
+        "regex": lambda value, target: bool(target.search(str(value))),
+    }
+    # 数値として比較する演算子
+    RANGE_OPERATORS = ("gt", "gte", "lt", "lte")
+
+    def __init__(self, column_names, columns, num_rows, selection=None):
+        self.column_names = list(column_names)
+        self.columns = columns
+        self.num_rows = num_rows
+        self.selection = selection
+
+    @classmethod
+    def from_rows(cls, header, rows, dict_threshold=0.5,
+                  max_dict_values=0xFFFF):
+        '''
+        [概要]
+        ヘッダーと行のイテラブルから Table を作成するメソッド
+        行は1件ずつ処理するので iter_csv_rows() のジェネレータを
+        そのまま渡せば CSV 全体をリストにする必要はない
+        値の種類が行数 × dict_threshold 以下の列を辞書符号化する
+        ID やタイトルのように値の種類が max_dict_values を超えた列は
+        値の辞書を作り続けずに，その時点で文字列のリストに切り替える
+        '''
+        assert header, "ヘッダーリストを渡して"
+
+        num_columns = len(header)
+        encoders = [{} for _ in range(num_columns)]
+        codes = [array("I") for _ in range(num_columns)]
+        # 辞書符号化をやめた列の値(列番号 -> 文字列のリスト)
+        plain_columns = {}
+
+        num_rows = 0
+        for row in rows:
+            if len(row) < num_columns:
+                row = row + [""] * (num_columns - len(row))
+
+            for index, encoder, value in zip(range(num_columns), encoders, row):
+                if encoder is None:
+                    plain_columns[index].append(value)
+                    continue
+
+                code = encoder.get(value)
+                if code is None:
+                    code = len(encoder)
+                    if code >= max_dict_values:
+                        values = list(encoder)
+                        plain_columns[index] = [
+                            values[old_code] for old_code in codes[index]
+                        ]
+                        plain_columns[index].append(value)
+                        encoders[index] = None
+                        codes[index] = None
+                        continue
+                    encoder[value] = code
+                codes[index].append(code)
+            num_rows += 1
+
+        columns = {}
+        for index, name in enumerate(header):
+            if index in plain_columns:
+                columns[name] = cls._finalize_plain_column(
+                    plain_columns.pop(index)
+                )
+            else:
+                columns[name] = cls._finalize_column(
+                    list(encoders[index]), codes[index], num_rows,
+                    dict_threshold
+                )
+
+        logger.info(f">> {num_rows} 行 × {num_columns} 列のテーブルを作成")
+        return cls(header, columns, num_rows)
+
+    @staticmethod
+    def _finalize_column(values, codes, num_rows, dict_threshold):
+        '''
+        [概要]
+        読み込み中は全列を辞書符号化しておき，最後に
+        整数列 / 辞書符号化列 / 文字列リスト のどれで持つかを決めるメソッド
+        '''
+        if values and all(Table._is_int_text(value) for value in values):
+            numbers = [int(value) for value in values]
+            return array("q", (numbers[code] for code in codes))
+
+        if len(values) <= num_rows * dict_threshold:
+            if len(values) <= 0xFF:
+                typecode = "B"
+            elif len(values) <= 0xFFFF:
+                typecode = "H"
+            else:
+                typecode = "I"
+            return DictEncodedColumn(array(typecode, codes), values)
+
+        return [values[code] for code in codes]
+
+    @staticmethod
+    def _finalize_plain_column(values):
+        '''
+        [概要]
+        辞書符号化をやめた列を 整数列 / 文字列リスト のどちらで持つかを決めるメソッド
+        '''
+        if values and all(Table._is_int_text(value) for value in values):
+            return array("q", map(int, values))
+        return values
+
+    @staticmethod
+    def _is_int_text(value):
+        '''
+        [概要]
+        文字列が整数として可逆に変換できるかを判定するメソッド
+        (「007」のように変換すると形が変わるものは整数扱いしない)
+        「²」や全角数字のような ASCII 以外の数字や，
+        array("q") に入らない(符号付き64ビットを超える)値も整数扱いしない
+        '''
+        digits = value[1:] if value.startswith("-") else value
+        if not (digits.isascii() and digits.isdecimal()):
+            return False
+        number = int(value)
+        return str(number) == value and INT64_MIN <= number <= INT64_MAX
+
+    @staticmethod
+    def is_int_column(column):
+        '''
+        [概要]
+        整数列(array もしくはキャッシュを参照する memoryview)かを判定する
+        '''
+        return isinstance(column, (array, memoryview))
+
+    @staticmethod
+    def _to_number(value):
+        '''
+        [概要]
+        値を数値に変換するメソッド
+        整数列の値はそのまま，文字列は先頭の数値を取り出す
+        (query_engine.to_number と同じく "90 min" は 90 になる)
+        数値で無ければ None を返す
+        '''
+        if isinstance(value, (int, float)):
+            return value
+        return to_number(str(value))
+
+    def __len__(self):
+        if self.selection is None:
+            return self.num_rows
+        return len(self.selection)
+
+    def _row_indices(self):
+        if self.selection is None:
+            return range(self.num_rows)
+        return self.selection
+
+    def column(self, name):
+        '''
+        [概要]
+        絞り込み後の行について，指定した列の値をリストで返すメソッド
+        '''
+        assert name in self.columns, f"{name} という列はない"
+
+        column = self.columns[name]
+        if self.selection is None:
+            return list(column)
+        return [column[index] for index in self.selection]
+
+    def where(self, **conditions):
+        '''
+        [概要]
+        条件に合う行だけを選択した新しい Table を返すメソッド
+        条件は「列名__演算子=値」の形で指定する(演算子省略時は eq)
+            例: table.where(country__contains="Japan", type="Movie")
+        複数の条件は AND で結合される
+        列データはコピーせず，選択した行番号だけを新しく持つ
+        '''
+        selection = self._row_indices()
+        for key, target in conditions.items():
+            name, _, op_name = key.partition("__")
+            op_name = op_name or "eq"
+            assert name in self.columns, f"{name} という列はない"
+            assert op_name in self.OPERATORS, f"{op_name} は未対応の演算子"
+
+            column = self.columns[name]
+            predicate = self._make_predicate(column, op_name, target)
+            selection = self._select(column, predicate, selection)
+
+        logger.debug(f"> {len(selection)} 行が条件に一致: {conditions}")
+        return Table(
+            self.column_names, self.columns, self.num_rows,
+            selection=array("I", selection)
+        )
+
+    def _make_predicate(self, column, op_name, target):
+        '''
+        [概要]
+        列の型に合わせて比較対象の値を変換し，判定関数を作るメソッド
+        gt / gte / lt / lte は空欄などで文字列の列になっていても
+        両辺を数値にして比較し，数値でないセルは一致しないものとする
+        '''
+        func = self.OPERATORS[op_name]
+
+        if op_name in self.RANGE_OPERATORS:
+            target = self._to_number(target)
+            assert target is not None, f"{op_name} には数値を指定"
+            as_number = self._to_number
+
+            def predicate(value):
+                number = as_number(value)
+                return number is not None and func(number, target)
+            return predicate
+
+        if op_name == "regex" and isinstance(target, str):
+            target = re.compile(target)
+        elif self.is_int_column(column) and op_name in ("eq", "ne"):
+            target = int(target)
+        elif self.is_int_column(column) and op_name == "in":
+            target = {int(value) for value in target}
+
+        return lambda value: func(value, target)
+
+    def _select(self, column, predicate, selection):
+        '''
+        [概要]
+        selection の行のうち predicate を満たす行番号を返すメソッド
+        辞書符号化された列は値の種類ごとに1回だけ判定して
+        その結果を番号で引くことで判定回数を減らしている
+        '''
+        if isinstance(column, DictEncodedColumn):
+            matched = bytearray(
+                predicate(value) for value in column.values
+            )
+            codes = column.codes
+            if isinstance(selection, range):
+                return list(
+                    compress(selection, map(matched.__getitem__, codes))
+                )
+            return [index for index in selection if matched[codes[index]]]
+
+        if isinstance(selection, range):
+            return list(compress(selection, map(predicate, column)))
+        return [index for index in selection if predicate(column[index])]
+
+    def to_dicts(self, fields=None):
+        '''
+        [概要]
+        絞り込み後の行を辞書のリストに変換して返すメソッド
+        fields で出力する列(とその順番)を指定できる
+        値は整数列でも CSV に書かれていた文字列のまま返すので，
+        列の型の推定結果(データの中身)によって出力の型は変わらない
+        '''
+        if fields is None:
+            fields = self.column_names
+
+        getters = []
+        for name in fields:
+            column = self.columns[name]
+            if self.is_int_column(column):
+                # 整数として可逆な値だけを整数列にしているので元の文字列に戻る
+                getters.append(lambda index, column=column: str(column[index]))
+            else:
+                getters.append(column.__getitem__)
+
+        return [
+            {name: getter(index) for name, getter in zip(fields, getters)}
+            for index in self._row_indices()
+        ]
+
+
+if __name__ == "__main__":
+    from setup_logging import setup_logging
+    from pathlib import Path
+
+    logging_config = Path("../config/logging_config.yml")
+    setup_logging(logging_config)
+
+    header = ["title", "type", "country", "release_year"]
+    rows = [
+        ["君の名は。", "Movie", "Japan", "2016"],
+        ["Stranger Things", "TV Show", "United States", "2016"],
+        ["千と千尋の神隠し", "Movie", "Japan", "2001"],
+        ["天気の子", "Movie", "Japan", ""],
+    ]
+    table = Table.from_rows(header, rows)
+    japan = table.where(country__contains="Japan", release_year__gte=2010)
+    logger.debug(f"> 絞り込み結果: {japan.to_dicts(['title', 'type'])}")
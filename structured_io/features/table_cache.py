@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+#
+# table_cache.py
+#
+# [概要]
+# CSV を解析して作った Table を
+# バイナリのキャッシュファイル(<CSV名>.tblcache)として
+# CSV の隣に保存・読み込みするプログラム
+#
+# キャッシュは
+# ・マジックナンバー(8バイト)
+# ・ヘッダー(JSON)の長さ(8バイト)
+# ・ヘッダー(JSON): キャッシュキーと各列の型・位置
+# ・各列のデータ本体(8バイト境界に揃えて配置．位置はデータ領域先頭からの相対値)
+# という構成になっている．
+# 読み込み時はファイルを mmap して memoryview で参照するだけなので
+# データのコピーや文字列の解析が発生せず，一瞬で読み込める．
+#
+
+try:
+    from features.atomic_file import atomic_open
+    from features.table import DictEncodedColumn, StringColumn, Table
+
+except:
+    from atomic_file import atomic_open
+    from table import DictEncodedColumn, StringColumn, Table
+
+from array import array
+from logging import getLogger
+from pathlib import Path
+import hashlib
+import json
+import mmap
+import struct
+import sys
+
+# 専用のロガーを作成
+logger = getLogger(__name__)
+
+
+class TableCache:
+    MAGIC = b"PP2TBL01"
+    ALIGNMENT = 8
+
+    def __init__(self, hash_bytes=1024 * 1024):
+        self.hash_bytes = hash_bytes
+
+    def cache_path_for(self, csv_path):
+        '''
+        [概要]
+        CSV に対応するキャッシュファイルのパスを返すメソッド
+        '''
+        return csv_path.with_name(csv_path.name + ".tblcache")
+
+    def _make_cache_key(self, csv_path, dict_threshold):
+        '''
+        [概要]
+        キャッシュが有効かを判定するためのキーを作るメソッド
+        パス・サイズ・更新時刻に加えて内容のハッシュを使う
+        ハッシュは読み込みを速く保つため，ファイル全体ではなく
+        先頭と末尾の hash_bytes バイトずつから計算している
+        '''
+        stat = csv_path.stat()
+        digest = hashlib.sha256()
+        digest.update(str(stat.st_size).encode())
+        with open(csv_path, mode="rb") as csv_file:
+            digest.update(csv_file.read(self.hash_bytes))
+            if stat.st_size > self.hash_bytes:
+                csv_file.seek(max(stat.st_size - self.hash_bytes, 0))
+                digest.update(csv_file.read(self.hash_bytes))
+
+        return {
+            "path": str(csv_path.resolve()),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "hash": digest.hexdigest(),
+            "dict_threshold": dict_threshold,
+            "byteorder": sys.byteorder,
+        }
+
+    def load(self, csv_path, dict_threshold=0.5):
+        '''
+        [概要]
+        キャッシュファイルから Table を読み込むメソッド
+        キャッシュが存在しない・キーが一致しない・壊れている場合は None を返す
+        '''
+        assert isinstance(csv_path, Path), "CSVはPathオブジェクトで指定"
+
+        cache_path = self.cache_path_for(csv_path)
+        if cache_path.exists() == False:
+            logger.debug(f"> {cache_path} が存在しないので CSV を解析する")
+            return None
+
+        try:
+            key = self._make_cache_key(csv_path, dict_threshold)
+            with open(cache_path, mode="rb") as cache_file:
+                buffer = mmap.mmap(
+                    cache_file.fileno(), 0, access=mmap.ACCESS_READ
+                )
+
+            if buffer[:len(self.MAGIC)] != self.MAGIC:
+                logger.warning(f">>> {cache_path} の形式が不正なので無視する")
+                return None
+
+            header_start = len(self.MAGIC) + 8
+            (header_length,) = struct.unpack(
+                "<Q", buffer[len(self.MAGIC):header_start]
+            )
+            header = json.loads(
+                buffer[header_start:header_start + header_length]
+            )
+            if header["key"] != key:
+                logger.info(f">> {cache_path} が古いので作り直す")
+                return None
+
+            data_start = self._align(header_start + header_length)
+            view = memoryview(buffer)[data_start:]
+            columns = {}
+            for meta in header["columns"]:
+                columns[meta["name"]] = self._load_column(view, meta)
+
+            logger.info(
+                f">> {cache_path} から {header['num_rows']} 行を読み込んだ"
+            )
+            return Table(header["column_names"], columns, header["num_rows"])
+
+        except Exception as e:
+            logger.warning(
+                f">>> キャッシュの読み込みに失敗したので CSV を解析する: {e}"
+            )
+            return None
+
+    def _load_column(self, view, meta):
+        '''
+        [概要]
+        mmap したデータ領域の該当範囲を memoryview として切り出して
+        列オブジェクトにするメソッド(データはコピーしない)
+        '''
+        def section(name):
+            offset, length = meta[name]
+            return view[offset:offset + length]
+
+        if meta["kind"] == "int":
+            return section("data").cast("q")
+
+        if meta["kind"] == "dict":
+            codes = section("codes").cast(meta["typecode"])
+            return DictEncodedColumn(codes, meta["values"])
+
+        return StringColumn(section("offsets").cast("Q"), section("data"))
+
+    def save(self, csv_path, table, dict_threshold=0.5):
+        '''
+        [概要]
+        Table をキャッシュファイルに書き込むメソッド
+        一時ファイルに書き込んでからリネームするので
+        書き込み途中のキャッシュが読まれることはない
+        '''
+        assert isinstance(csv_path, Path), "CSVはPathオブジェクトで指定"
+        assert table.selection is None, "絞り込み前のテーブルを渡して"
+
+        cache_path = self.cache_path_for(csv_path)
+        try:
+            logger.debug(f"> {cache_path} にキャッシュを書き込む")
+            sections = []
+            metas = []
+            for name in table.column_names:
+                meta, blobs = self._dump_column(name, table.columns[name])
+                metas.append(meta)
+                sections.append(blobs)
+
+            header = {
+                "key": self._make_cache_key(csv_path, dict_threshold),
+                "num_rows": table.num_rows,
+                "column_names": table.column_names,
+                "columns": metas,
+            }
+
+            # 各列の位置はデータ領域の先頭からの相対位置で記録する
+            position = 0
+            for meta, blobs in zip(metas, sections):
+                for section_name, blob in blobs:
+                    meta[section_name] = [position, len(blob)]
+                    position = self._align(position + len(blob))
+
+            header_bytes = self._encode_header(header)
+            data_start = self._align(len(self.MAGIC) + 8 + len(header_bytes))
+
+            with atomic_open(cache_path, "wb") as cache_file:
+                cache_file.write(self.MAGIC)
+                cache_file.write(struct.pack("<Q", len(header_bytes)))
+                cache_file.write(header_bytes)
+                for meta, blobs in zip(metas, sections):
+                    for section_name, blob in blobs:
+                        cache_file.seek(data_start + meta[section_name][0])
+                        cache_file.write(blob)
+
+            logger.info(f">> {cache_path} にキャッシュを書き込んだ")
+            return True
+
+        except Exception as e:
+            # キャッシュは無くても動くので，失敗しても処理は続ける
+            logger.warning(f">>> キャッシュの書き込みに失敗した: {e}")
+            return False
+
+    def _dump_column(self, name, column):
+        '''
+        [概要]
+        列オブジェクトをメタ情報とバイト列のリストに変換するメソッド
+        '''
+        if Table.is_int_column(column):
+            return {"name": name, "kind": "int"}, [
+                ("data", bytes(column))
+            ]
+
+        if isinstance(column, DictEncodedColumn):
+            codes = column.codes
+            typecode = codes.typecode if isinstance(codes, array) \
+                else codes.format
+            meta = {
+                "name": name, "kind": "dict",
+                "typecode": typecode, "values": list(column.values)
+            }
+            return meta, [("codes", bytes(codes))]
+
+        encoded = [value.encode("utf-8") for value in column]
+        offsets = array("Q", [0])
+        total = 0
+        for value in encoded:
+            total += len(value)
+            offsets.append(total)
+
+        return {"name": name, "kind": "str"}, [
+            ("offsets", offsets.tobytes()), ("data", b"".join(encoded))
+        ]
+
+    def _encode_header(self, header):
+        return json.dumps(header, ensure_ascii=False).encode("utf-8")
+
+    def _align(self, position):
+        return -(-position // self.ALIGNMENT) * self.ALIGNMENT
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+#
+# async_probe.py
+#
+# [概要]
+# asyncio を使って多数の Web サービスを1つのイベントループで確認するプログラム
+#
+# ping のプロセスを1台ずつ起動する代わりに，
+# ・tcp : 指定したポートに TCP で接続できるか
+# ・http: HTTP の HEAD リクエスト(断られたら GET)に応答があるか
+# ・ping: ping コマンドを非同期で実行(ICMP の確認が必要な場合だけ)
+# を asyncio のソケット(ストリーム)で直接確認する．
+# 同時に確認する台数は concurrency(セマフォ)で制限し，
+# 結果は health_check.py と同じ CheckResult で返す．
+#
+# 単体で実行すると，ローカルに立てたダミーのサーバに対して
+# 各確認方法を試せる．
+#     python3 async_probe.py
+#
+
+try:
+    from features.health_check import CheckResult
+    from features.health_check import build_ping_command
+    from features.health_check import parse_ping_output
+
+except:
+    from health_check import CheckResult
+    from health_check import build_ping_command
+    from health_check import parse_ping_output
+
+from logging import getLogger
+from urllib.parse import urlsplit
+import asyncio
+import math
+import ssl
+import time
+
+# 専用のロガーを作成
+logger = getLogger(__name__)
+
+
+class AsyncProber:
+    METHODS = ("tcp", "http", "ping")
+    # HEAD を受け付けないサーバの応答(この場合は GET で確認し直す)
+    HEAD_REJECTED = (405, 501)
+
+    def __init__(self, method="tcp", concurrency=1000, timeout=5.0,
+                 port=443, http_method="HEAD", ping_count=3):
+        assert method in self.METHODS, f"methodは {self.METHODS} のどれか"
+        assert concurrency > 0, "concurrencyは1以上で指定"
+        assert timeout > 0, "timeoutは正の数で指定"
+
+        self.method = method
+        # 同時に確認する最大の台数(開くソケットの数の上限)
+        self.concurrency = concurrency
+        self.timeout = timeout
+        # ポートの指定が無い場合に TCP で接続するポート
+        self.port = port
+        self.http_method = http_method
+        self.ping_count = ping_count
+        # 証明書の読み込みは重いので全ての確認で使い回す
+        self.ssl_context = ssl.create_default_context()
+
+    def _parse_target(self, target):
+        '''
+        [概要]
+        監視対象の文字列から(確認方法, 接続先)を決めるメソッド
+        "https://host/path" や "tcp://host:port" のように
+        スキームが付いていればそちらを優先する
+        '''
+        if "://" in target:
+            parts = urlsplit(target)
+            if parts.scheme in ("http", "https"):
+                return "http", target
+            if parts.scheme == "tcp":
+                return "tcp", (parts.hostname, parts.port or self.port)
+            raise ValueError(f"対応していないスキーム: {parts.scheme}")
+
+        if self.method == "http":
+            return "http", f"https://{target}/"
+        if self.method == "ping":
+            return "ping", target
+
+        host, _, port = target.rpartition(":")
+        if host and port.isdigit():
+            return "tcp", (host, int(port))
+        return "tcp", (target, self.port)
+
+    async def _close(self, writer):
+        writer.close()
+        try:
+            await writer.wait_closed()
+
+        except (OSError, ssl.SSLError):
+            pass
+
+    async def tcp_probe(self, host, port):
+        '''
+        [概要]
+        host:port に TCP で接続できるか確認するメソッド
+        応答時間は接続が完了するまでの時間
+        '''
+        label = f"{host}:{port}"
+        start = time.perf_counter()
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(host, port), self.timeout
+            )
+
+        except asyncio.TimeoutError:
+            return CheckResult(
+                label, "TIMEOUT", method="tcp",
+                detail=f"{self.timeout}秒以内に接続できない"
+            )
+
+        except OSError as e:
+            return CheckResult(label, "DOWN", method="tcp", detail=str(e))
+
+        latency_ms = (time.perf_counter() - start) * 1000
+        await self._close(writer)
+        return CheckResult(label, "UP", latency_ms, method="tcp")
+
+    async def _http_request(self, parts, http_method):
+        '''
+        [概要]
+        1回の HTTP リクエストを送り，ステータスコードを返すメソッド
+        本文は読まずにステータス行だけで判定する
+        '''
+        https = parts.scheme == "https"
+        port = parts.port or (443 if https else 80)
+        host_header = parts.hostname if parts.port is None \
+            else f"{parts.hostname}:{parts.port}"
+        path = parts.path or "/"
+        if parts.query:
+            path += f"?{parts.query}"
+
+        reader, writer = await asyncio.open_connection(
+            parts.hostname, port, ssl=self.ssl_context if https else None
+        )
+        try:
+            request = (
+                f"{http_method} {path} HTTP/1.1\r\n"
+                f"Host: {host_header}\r\n"
+                "User-Agent: WebServiceMonitor\r\n"
+                "Connection: close\r\n\r\n"
+            )
+            writer.write(request.encode("ascii"))
+            await writer.drain()
+            status_line = await reader.readline()
+
+        finally:
+            await self._close(writer)
+
+        fields = status_line.decode("latin-1").split()
+        if len(fields) < 2 or not fields[0].startswith("HTTP/") \
+                or not fields[1].isdigit():
+            raise ValueError(f"HTTP の応答ではない: {status_line[:50]!r}")
+        return int(fields[1])
+
+    async def http_probe(self, url):
+        '''
+        [概要]
+        url に HTTP リクエストを送り，400 未満の応答なら UP とするメソッド
+        応答時間はステータス行を受け取るまでの時間
+        '''
+        parts = urlsplit(url)
+        start = time.perf_counter()
+        try:
+            status_code = await asyncio.wait_for(
+                self._http_request(parts, self.http_method), self.timeout
+            )
+            if self.http_method == "HEAD" \
+                    and status_code in self.HEAD_REJECTED:
+                status_code = await asyncio.wait_for(
+                    self._http_request(parts, "GET"), self.timeout
+                )
+
+        except asyncio.TimeoutError:
+            return CheckResult(
+                url, "TIMEOUT", method="http",
+                detail=f"{self.timeout}秒以内に応答なし"
+            )
+
+        except (OSError, ValueError) as e:
+            return CheckResult(url, "DOWN", method="http", detail=str(e))
+
+        latency_ms = (time.perf_counter() - start) * 1000
+        status = "UP" if status_code < 400 else "DOWN"
+        return CheckResult(
+            url, status, latency_ms, method="http",
+            detail=f"HTTP {status_code}"
+        )
+
+    async def ping_probe(self, host):
+        '''
+        [概要]
+        ping コマンドを非同期で実行して結果を返すメソッド
+        (ICMP を送るには管理者権限が要るので ping コマンドに任せる)
+        '''
+        command = build_ping_command(host, self.ping_count, self.timeout)
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command, stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+
+        except OSError as e:
+            return CheckResult(host, "ERROR", detail=str(e))
+
+        try:
+            stdout, stderr = await asyncio.wait_for(
+                process.communicate(), self.timeout + 1
+            )
+
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            return CheckResult(
+                host, "TIMEOUT", loss=100.0,
+                detail=f"{self.timeout}秒以内に応答なし"
+            )
+
+        loss, latency_ms = parse_ping_output(
+            stdout.decode("utf-8", errors="replace")
+        )
+        if process.returncode == 0 and (loss is None or loss < 100):
+            return CheckResult(host, "UP", latency_ms, loss)
+
+        detail = stderr.decode("utf-8", errors="replace").strip() \
+            or f"終了コード {process.returncode}"
+        return CheckResult(host, "DOWN", latency_ms, loss, detail=detail)
+
+    async def probe(self, target):
+        '''
+        [概要]
+        監視対象1つを確認するメソッド
+        '''
+        try:
+            method, address = self._parse_target(target)
+            if method == "http":
+                return await self.http_probe(address)
+            if method == "ping":
+                return await self.ping_probe(address)
+            return await self.tcp_probe(*address)
+
+        except Exception as e:
+            logger.error(f"{target} の確認時にエラー発生: {e}")
+            return CheckResult(
+                target, "ERROR", method=self.method, detail=str(e)
+            )
+
+    async def run(self, targets):
+        '''
+        [概要]
+        targets を最大 concurrency 台ずつ同時に確認し，
+        targets と同じ順番の CheckResult のリストを返すメソッド
+        '''
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def bounded_probe(target):
+            async with semaphore:
+                return await self.probe(target)
+
+        return await asyncio.gather(
+            *(bounded_probe(target) for target in targets)
+        )
+
+    def run_sync(self, targets):
+        '''
+        [概要]
+        イベントループを作って run() を実行するメソッド
+        '''
+        return asyncio.run(self.run(list(targets)))
+
+
+def latency_percentiles(results, percentiles=(50, 90, 95, 99)):
+    '''
+    [概要]
+    UP だった結果の応答時間(ミリ秒)のパーセンタイルを辞書で返す関数
+    (最近傍順位法: 全体の p% 以上がその値以下になる最小の値)
+    '''
+    latencies = sorted(
+        result.latency_ms for result in results
+        if result.ok and result.latency_ms is not None
+    )
+    if not latencies:
+        return {}
+
+    return {
+        f"p{percentile}": round(
+            latencies[max(0, math.ceil(percentile / 100 * len(latencies)) - 1)],
+            2
+        )
+        for percentile in percentiles
+    }
+
+
+if __name__ == "__main__":
+    from health_check import summarize_results
+    from setup_logging import setup_logging
+    from pathlib import Path
+
+    logging_config = Path("../config/logging_config.yml")
+    setup_logging(logging_config)
+
+    # 応答を返さずに接続を保ったままにする(/slow 用)
+    stalled_writers = []
+
+    async def handle_http(reader, writer):
+        # リクエストの1行目のパスでステータスコードを決めるダミーの Web サーバ
+        request_line = (await reader.readline()).decode("latin-1").split()
+        if len(request_line) < 2:
+            # TCP の接続確認だけの場合
+            writer.close()
+            return
+        if request_line[1] == "/slow":
+            stalled_writers.append(writer)
+            return
+
+        status = "500 Internal Server Error" if request_line[1] == "/error" \
+            else "200 OK"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Length: 0\r\n\r\n".encode()
+        )
+        await writer.drain()
+        writer.close()
+
+    async def demo():
+        server = await asyncio.start_server(handle_http, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        # 接続を断られるポート(一度開いてすぐ閉じる)
+        closed = await asyncio.start_server(handle_http, "127.0.0.1", 0)
+        closed_port = closed.sockets[0].getsockname()[1]
+        closed.close()
+        await closed.wait_closed()
+
+        targets = [f"http://127.0.0.1:{port}/"] * 200 + [
+            f"127.0.0.1:{port}",
+            f"127.0.0.1:{closed_port}",
+            f"http://127.0.0.1:{port}/error",
+            f"http://127.0.0.1:{port}/slow",
+        ]
+        prober = AsyncProber(method="tcp", concurrency=100, timeout=1.0)
+        start = time.perf_counter()
+        results = await prober.run(targets)
+        logger.info(
+            f">> {len(targets)} 件を {time.perf_counter() - start:.2f} 秒で確認"
+        )
+        for result in results[-4:]:
+            logger.info(f">> {result} {result.detail}")
+        logger.info(f">> 監視結果: {summarize_results(results)}")
+        logger.info(f">> 応答時間: {latency_percentiles(results)}")
+
+        for writer in stalled_writers:
+            writer.close()
+        server.close()
+        await server.wait_closed()
+
+    asyncio.run(demo())
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+#
+# health_check.py
+#
+# [概要]
+# ping で Web サービスの死活監視を行い，
+# 結果(状態・応答時間・パケット損失率)を CheckResult にまとめるプログラム
+#
+# HealthCheckPool は決まった数(max_workers)のスレッドを使い回して
+# ping を実行するので，監視対象が数千台あっても
+# 同時に動く ping のプロセスは max_workers 個までに収まる．
+# 1回の確認には timeout 秒の制限があり，応答しない相手で詰まらない．
+#
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from logging import getLogger
+import math
+import platform
+import re
+import subprocess
+import time
+
+# 専用のロガーを作成
+logger = getLogger(__name__)
+
+# ping の出力から損失率と平均応答時間を取り出す正規表現
+# (Linux / macOS / Windows の英語・日本語表示に対応)
+LOSS_PATTERN = re.compile(r"(\d+(?:\.\d+)?)% (?:packet loss|loss|の損失)")
+UNIX_RTT_PATTERN = re.compile(
+    r"(?:rtt|round-trip) min/avg/max/(?:mdev|stddev) = "
+    r"[\d.]+/([\d.]+)/[\d.]+/[\d.]+ ms"
+)
+WINDOWS_RTT_PATTERN = re.compile(r"(?:Average|平均) = (\d+)ms")
+
+
+class CheckResult:
+    '''
+    1台分の確認結果
+    status は "UP" / "DOWN" / "TIMEOUT" / "ERROR" のどれか
+    '''
+    __slots__ = (
+        "host", "status", "latency_ms", "loss", "method", "detail",
+        "checked_at"
+    )
+
+    def __init__(self, host, status, latency_ms=None, loss=None,
+                 method="ping", detail=""):
+        self.host = host
+        self.status = status
+        # 平均応答時間(ミリ秒)．応答が無ければ None
+        self.latency_ms = latency_ms
+        # パケット損失率(%)．分からなければ None
+        self.loss = loss
+        self.method = method
+        self.detail = detail
+        self.checked_at = datetime.now()
+
+    @property
+    def ok(self):
+        return self.status == "UP"
+
+    def to_dict(self):
+        return {
+            name: getattr(self, name) for name in self.__slots__
+        } | {"checked_at": self.checked_at.isoformat(timespec="seconds")}
+
+    def __repr__(self):
+        latency = "-" if self.latency_ms is None \
+            else f"{self.latency_ms:.1f}ms"
+        loss = "-" if self.loss is None else f"{self.loss:g}%"
+        return (
+            f"CheckResult({self.host}: {self.status}, {self.method}, "
+            f"latency={latency}, loss={loss})"
+        )
+
+
+def build_ping_command(host, count=3, timeout=5.0):
+    '''
+    [概要]
+    OS に合わせた ping のコマンドを作る関数
+    timeout 秒で ping 自身が終了するように期限も指定する
+    '''
+    system = platform.system().lower()
+    deadline = str(max(1, math.ceil(timeout)))
+    if system == "windows":
+        # -w は1回の応答を待つ時間(ミリ秒)
+        return ["ping", "-n", str(count), "-w", str(int(timeout * 1000)), host]
+    if system == "darwin":
+        return ["ping", "-c", str(count), "-t", deadline, host]
+    return ["ping", "-c", str(count), "-w", deadline, host]
+
+
+def parse_ping_output(output):
+    '''
+    [概要]
+    ping の出力から(損失率, 平均応答時間)を取り出す関数
+    見つからない値は None にする
+    '''
+    loss = None
+    match = LOSS_PATTERN.search(output)
+    if match:
+        loss = float(match.group(1))
+
+    latency_ms = None
+    match = UNIX_RTT_PATTERN.search(output) \
+        or WINDOWS_RTT_PATTERN.search(output)
+    if match:
+        latency_ms = float(match.group(1))
+
+    return loss, latency_ms
+
+
+def ping_host(host, count=3, timeout=5.0):
+    '''
+    [概要]
+    host に ping を送り，結果を CheckResult で返す関数
+    終了コードと出力の両方を見て UP / DOWN を判定する
+    '''
+    assert host, "hostを渡して"
+    assert isinstance(host, str), "hostは文字列型"
+
+    command = build_ping_command(host, count, timeout)
+    try:
+        # ping 自身の期限に少し余裕を持たせて打ち切る
+        response = subprocess.run(
+            command, capture_output=True, text=True, errors="replace",
+            timeout=timeout + 1
+        )
+
+    except subprocess.TimeoutExpired:
+        return CheckResult(
+            host, "TIMEOUT", loss=100.0, detail=f"{timeout}秒以内に応答なし"
+        )
+
+    except OSError as e:
+        # ping コマンドが無い場合など
+        return CheckResult(host, "ERROR", detail=str(e))
+
+    loss, latency_ms = parse_ping_output(response.stdout)
+    if response.returncode == 0 and (loss is None or loss < 100):
+        return CheckResult(host, "UP", latency_ms, loss)
+
+    detail = response.stderr.strip() or f"終了コード {response.returncode}"
+    return CheckResult(host, "DOWN", latency_ms, loss, detail=detail)
+
+
+class HealthCheckPool:
+    def __init__(self, max_workers=32, timeout=5.0, count=3, check=ping_host):
+        assert max_workers > 0, "max_workersは1以上で指定"
+        assert timeout > 0, "timeoutは正の数で指定"
+
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.count = count
+        # host, count, timeout を受け取って CheckResult を返す関数
+        self.check = check
+
+    def _check_one(self, host):
+        try:
+            return self.check(host, self.count, self.timeout)
+
+        except Exception as e:
+            logger.error(f"{host} の確認時にエラー発生: {e}")
+            return CheckResult(host, "ERROR", detail=str(e))
+
+    def run(self, hosts):
+        '''
+        [概要]
+        hosts を max_workers 個のスレッドで並行に確認し，
+        hosts と同じ順番の CheckResult のリストを返すメソッド
+        '''
+        hosts = list(hosts)
+        if not hosts:
+            return []
+
+        start = time.perf_counter()
+        workers = min(self.max_workers, len(hosts))
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="health-check"
+        ) as executor:
+            results = list(executor.map(self._check_one, hosts))
+
+        logger.debug(
+            f"> {len(hosts)} 台を {workers} スレッドで確認しました "
+            f"({time.perf_counter() - start:.2f} 秒)"
+        )
+        return results
+
+
+def summarize_results(results):
+    '''
+    [概要]
+    CheckResult のリストを状態ごとの台数にまとめる関数
+    '''
+    summary = {"UP": 0, "DOWN": 0, "TIMEOUT": 0, "ERROR": 0}
+    for result in results:
+        summary[result.status] = summary.get(result.status, 0) + 1
+    return summary
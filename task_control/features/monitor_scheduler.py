@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+#
+# monitor_scheduler.py
+#
+# [概要]
+# 多数の Web サービスをそれぞれの間隔で確認し続けるスケジューラ
+#
+# ・次に確認する時刻が早い順に並べたヒープ(heapq)を使うので，
+#   台数が増えても「次はどれか」を調べる手間はほとんど増えない
+# ・確認の時刻に ±jitter の揺らぎを入れ，全台が同時に確認されないようにする
+# ・DOWN が続く相手は確認の間隔を倍々に広げる(max_backoff 秒まで)
+# ・1台あたりの記録は HostSchedule の決まった項目(直近の結果と
+#   応答時間の指数移動平均)だけなので，長時間動かしてもメモリが増えない
+#
+# 実際の確認は AsyncProber.probe() に任せ，
+# 同時に確認する台数は concurrency までに制限する．
+#
+
+from logging import getLogger
+import asyncio
+import heapq
+import itertools
+import random
+
+# 専用のロガーを作成
+logger = getLogger(__name__)
+
+
+class HostSchedule:
+    '''
+    1台分の確認の予定と直近の状態
+    '''
+    __slots__ = (
+        "target", "interval", "next_due", "status", "failures",
+        "latency_ms", "ewma_latency_ms", "checks", "last_checked"
+    )
+
+    def __init__(self, target, interval, next_due):
+        self.target = target
+        self.interval = interval
+        self.next_due = next_due
+        self.status = "UNKNOWN"
+        # 連続して UP 以外だった回数
+        self.failures = 0
+        self.latency_ms = None
+        # 応答時間の指数移動平均(ミリ秒)
+        self.ewma_latency_ms = None
+        self.checks = 0
+        self.last_checked = None
+
+
+class MonitorScheduler:
+    def __init__(self, prober, targets, default_interval=60.0, jitter=0.1,
+                 max_backoff=600.0, concurrency=100, alpha=0.3,
+                 stats_interval=60.0):
+        '''
+        targets は監視対象のリスト，または
+        {監視対象: 確認の間隔(秒)} の辞書(間隔が None なら default_interval)
+        '''
+        assert default_interval > 0, "default_intervalは正の数で指定"
+        assert 0 <= jitter < 1, "jitterは0以上1未満で指定"
+        assert concurrency > 0, "concurrencyは1以上で指定"
+
+        self.prober = prober
+        self.default_interval = default_interval
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.concurrency = concurrency
+        self.alpha = alpha
+        self.stats_interval = stats_interval
+
+        if not isinstance(targets, dict):
+            targets = dict.fromkeys(targets)
+        self._pending_targets = targets
+
+        # 監視対象 -> HostSchedule
+        self.hosts = {}
+        # (次に確認する時刻, 登録順, 監視対象) のヒープ
+        self._heap = []
+        self._sequence = itertools.count()
+        self._stop_event = None
+        self._wake_event = None
+        self._loop = None
+
+        # 監視用のカウンタ
+        self.total_checks = 0
+        # 予定の時刻から実際に確認を始めるまでの遅れ(秒)の最大値
+        self.max_lag = 0.0
+
+    def _jittered(self, interval):
+        if not self.jitter:
+            return interval
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _push(self, schedule):
+        heapq.heappush(
+            self._heap,
+            (schedule.next_due, next(self._sequence), schedule.target)
+        )
+
+    def add_host(self, target, interval=None):
+        '''
+        [概要]
+        監視対象を追加するメソッド
+        最初の確認は 0 〜 interval 秒後のどこかにばらして行う
+        '''
+        assert target, "監視対象を渡して"
+
+        interval = interval or self.default_interval
+        if self._loop is None:
+            # run() を始める前に追加された分は run() の中で登録する
+            self._pending_targets[target] = interval
+            return
+
+        now = self._loop.time()
+        schedule = HostSchedule(
+            target, interval, now + random.uniform(0, interval)
+        )
+        self.hosts[target] = schedule
+        self._push(schedule)
+
+    def remove_host(self, target):
+        '''
+        [概要]
+        監視対象を削除するメソッド
+        ヒープに残った予定は取り出した時に読み飛ばす
+        '''
+        self._pending_targets.pop(target, None)
+        return self.hosts.pop(target, None) is not None
+
+    def _next_interval(self, schedule):
+        '''
+        [概要]
+        次の確認までの間隔を決めるメソッド
+        DOWN が続くほど間隔を倍にし，max_backoff 秒で頭打ちにする
+        '''
+        interval = schedule.interval
+        if schedule.failures:
+            interval = min(
+                max(self.max_backoff, interval),
+                interval * 2 ** min(schedule.failures - 1, 16)
+            )
+        return self._jittered(interval)
+
+    def _record(self, schedule, result):
+        '''
+        [概要]
+        確認結果を HostSchedule に反映するメソッド
+        状態が変わった時だけログに出す
+        '''
+        previous = schedule.status
+        schedule.status = result.status
+        schedule.checks += 1
+        schedule.last_checked = result.checked_at
+        schedule.latency_ms = result.latency_ms
+        if result.ok:
+            schedule.failures = 0
+            if result.latency_ms is not None:
+                schedule.ewma_latency_ms = result.latency_ms \
+                    if schedule.ewma_latency_ms is None \
+                    else self.alpha * result.latency_ms \
+                    + (1 - self.alpha) * schedule.ewma_latency_ms
+        else:
+            schedule.failures += 1
+
+        if previous != result.status:
+            if result.ok:
+                logger.info(f">> {schedule.target}: {previous} -> UP {result}")
+            else:
+                logger.warning(
+                    f">>> {schedule.target}: {previous} -> {result.status} "
+                    f"{result.detail}"
+                )
+
+    async def _check(self, schedule, semaphore):
+        try:
+            result = await self.prober.probe(schedule.target)
+            self.total_checks += 1
+            if self.hosts.get(schedule.target) is not schedule:
+                # 確認中に削除された
+                return
+
+            self._record(schedule, result)
+            schedule.next_due = self._loop.time() + self._next_interval(schedule)
+            self._push(schedule)
+
+        except Exception as e:
+            logger.error(f"{schedule.target} の確認時にエラー発生: {e}")
+            if self.hosts.get(schedule.target) is schedule:
+                schedule.next_due = self._loop.time() + schedule.interval
+                self._push(schedule)
+
+        finally:
+            semaphore.release()
+            self._wake_event.set()
+
+    async def _sleep(self, seconds):
+        '''
+        [概要]
+        seconds 秒待つ．停止されたか確認が終わった場合は早めに戻る
+        '''
+        self._wake_event.clear()
+        try:
+            await asyncio.wait_for(self._wake_event.wait(), seconds)
+
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self, duration=None):
+        '''
+        [概要]
+        stop() が呼ばれるまで(duration 秒が指定されていればその間)
+        予定の時刻が来た監視対象から順に確認し続けるメソッド
+        '''
+        self._loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        self._wake_event = asyncio.Event()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+
+        pending, self._pending_targets = self._pending_targets, {}
+        for target, interval in pending.items():
+            self.add_host(target, interval)
+        logger.info(f">> {len(self.hosts)} 台の監視を開始します")
+
+        start = self._loop.time()
+        next_stats = start + self.stats_interval
+        try:
+            while not self._stop_event.is_set():
+                now = self._loop.time()
+                if duration is not None and now - start >= duration:
+                    break
+                if now >= next_stats:
+                    logger.info(f">> 監視状況: {self.stats()}")
+                    next_stats = now + self.stats_interval
+
+                if not self._heap or self._heap[0][0] > now:
+                    wait = next_stats - now
+                    if self._heap:
+                        wait = min(wait, self._heap[0][0] - now)
+                    if duration is not None:
+                        wait = min(wait, start + duration - now)
+                    await self._sleep(max(wait, 0))
+                    continue
+
+                next_due, _, target = heapq.heappop(self._heap)
+                schedule = self.hosts.get(target)
+                if schedule is None or schedule.next_due != next_due:
+                    # 削除済み・予定が変わった古い予定
+                    continue
+
+                # 同時に確認する台数が concurrency に達していたら空きを待つ
+                await semaphore.acquire()
+                self.max_lag = max(self.max_lag, self._loop.time() - next_due)
+                task = asyncio.create_task(self._check(schedule, semaphore))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._loop = None
+            logger.info(f">> 監視を終了します: {self.stats()}")
+
+    def stop(self):
+        '''
+        [概要]
+        run() を止めるメソッド(同じイベントループの中から呼ぶ)
+        '''
+        if self._stop_event is not None:
+            self._stop_event.set()
+            self._wake_event.set()
+
+    def stats(self):
+        '''
+        [概要]
+        監視用のカウンタを辞書にまとめて返すメソッド
+        '''
+        statuses = {}
+        for schedule in self.hosts.values():
+            statuses[schedule.status] = statuses.get(schedule.status, 0) + 1
+        return {
+            "hosts": len(self.hosts),
+            "statuses": statuses,
+            "checks": self.total_checks,
+            "scheduled": len(self._heap),
+            "max_lag_sec": round(self.max_lag, 3),
+        }
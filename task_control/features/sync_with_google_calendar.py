@@ -19,6 +19,12 @@ from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 
+try:
+    from features.rate_limiter import get_rate_limiter
+
+except:
+    from rate_limiter import get_rate_limiter
+
 from logging import getLogger
 from pathlib import Path
 import os
@@ -44,6 +50,10 @@ class SyncWithGoogleCalendar:
         )
 
         self.calendar_id = calendar_id
+        # Calendar API の呼び出し回数の制限(同じプロセス内で共有する)
+        self.rate_limiter = get_rate_limiter(
+            "calendar", rate=5.0, capacity=10
+        )
 
     def _creds_refresh(self, token_path, json_path):
         '''
@@ -97,15 +107,17 @@ class SyncWithGoogleCalendar:
             logger.error(">>>> サービスが初期化されていないため処理を中止")
 
         try:
-            event_list = self.service.events().list(
-                calendarId=self.calendar_id,
-                q=event_name,
-                timeMin=start_iso,
-                timeMax=end_iso,
-                maxResults=5,
-                singleEvents=True,
-                orderBy="startTime",
-            ).execute()
+            event_list = self.rate_limiter.call(
+                self.service.events().list(
+                    calendarId=self.calendar_id,
+                    q=event_name,
+                    timeMin=start_iso,
+                    timeMax=end_iso,
+                    maxResults=5,
+                    singleEvents=True,
+                    orderBy="startTime",
+                ).execute
+            )
             events = event_list.get("items", [])
 
             if not events:
@@ -158,10 +170,13 @@ class SyncWithGoogleCalendar:
         }
 
         try:
-            self.service.events().insert(
-                calendarId=self.calendar_id,
-                body=event,
-            ).execute()
+            # 予定の追加は検索より先に通す
+            self.rate_limiter.call(
+                self.service.events().insert(
+                    calendarId=self.calendar_id,
+                    body=event,
+                ).execute, priority="high"
+            )
 
             logger.debug(
                 f"> カレンダーにイベントを追加しました: {event}"
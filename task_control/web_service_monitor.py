@@ -3,25 +3,32 @@
 # web_service_monitor.py
 #
 # [概要]
+# ping で複数の Web サービスの死活監視を行うプログラム
 #
-#
-#
-#
-#
-#
-#
-#
+# 直列・threading・multiprocessing・スレッドプールの
+# 4つの実行方法を選んで実行時間を比べられる．
+# スレッドプール(run_pooled)は同時に動く ping の数を
+# max_workers 個までに抑えるので，監視対象が多くても使える．
+# asyncio(run_asyncio)は ping を使わず，1つのイベントループで
+# TCP の接続や HTTP のリクエストを直接送って確認する．
+# 継続監視(run_scheduled)は Ctrl + c で止めるまで
+# 各サービスを interval 秒ごとに確認し続ける．
 #
 
 import pyinputplus as pyip
 
+from features.async_probe import AsyncProber
+from features.async_probe import latency_percentiles
+from features.health_check import HealthCheckPool
+from features.health_check import ping_host
+from features.health_check import summarize_results
+from features.monitor_scheduler import MonitorScheduler
 from features.setup_logging import setup_logging
 
 from logging import getLogger
 from pathlib import Path
+import asyncio
 import multiprocessing
-import platform
-import subprocess
 import time
 import threading
 
@@ -34,14 +41,18 @@ setup_logging(logging_config)
 
 
 class WebServiceMonitor:
-    def __init__(self, target_hosts):
+    def __init__(self, target_hosts, max_workers=32, timeout=5.0):
         self.target_hosts = target_hosts
+        # run_pooled() で同時に確認する最大の台数
+        self.max_workers = max_workers
+        # 1台あたりの確認にかける最長の時間(秒)
+        self.timeout = timeout
 
     @staticmethod
-    def _check_server_task(host):
+    def _check_server_task(host, timeout=5.0):
         '''
         [概要]
-        実際にWebサービスへ通信を飛ばすメソッド
+        実際にWebサービスへ通信を飛ばし，結果を CheckResult で返すメソッド
         ＊ multiprocessing による並列処理時に
            バグが起きないように静的メソッドとして定義している
         '''
@@ -52,17 +63,9 @@ class WebServiceMonitor:
             logger.debug(
                 f"> {host} と通信します"
             )
-            param = "-n" if platform.system().lower() == "windows" else "-c"
-            command = [
-                "ping", param, "3", host
-            ]
-            response = subprocess.run(
-                command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-            )
-            logger.info(
-                f">> {host} との通信結果: OK"
-            )
-            return True
+            result = ping_host(host, timeout=timeout)
+            WebServiceMonitor._log_result(result)
+            return result
 
         except Exception as e:
             logger.error(
@@ -70,6 +73,15 @@ class WebServiceMonitor:
             )
             raise e
 
+    @staticmethod
+    def _log_result(result):
+        if result.ok:
+            logger.info(f">> {result.host} との通信結果: {result}")
+        else:
+            logger.warning(
+                f">>> {result.host} との通信結果: {result} {result.detail}"
+            )
+
     def run_sequential(self):
         '''
         [概要]
@@ -82,7 +94,7 @@ class WebServiceMonitor:
                 "> 通常の直列処理を実行"
             )
             for host in self.target_hosts:
-                self._check_server_task(host)
+                self._check_server_task(host, self.timeout)
 
             logger.debug(
                 f"> 直列処理の実行時間: {time.time() - start:.2f} 秒"
@@ -108,7 +120,7 @@ class WebServiceMonitor:
             for host in self.target_hosts:
                 thread = threading.Thread(
                     target=self._check_server_task,
-                    args=(host,)
+                    args=(host, self.timeout)
                 )
                 thread.start()
                 workers.append(thread)
@@ -142,7 +154,7 @@ class WebServiceMonitor:
             for host in self.target_hosts:
                 process = multiprocessing.Process(
                     target=self._check_server_task,
-                    args=(host,)
+                    args=(host, self.timeout)
                 )
                 process.start()
                 workers.append(process)
@@ -161,6 +173,102 @@ class WebServiceMonitor:
             )
             raise e
 
+    def run_pooled(self):
+        '''
+        [概要]
+        スレッドプール(HealthCheckPool)を使って並行処理を実演するメソッド
+        1台ずつスレッドやプロセスを作らず，max_workers 個を使い回す
+        結果は CheckResult のリストで返す
+        '''
+        start = time.time()
+        try:
+            logger.debug(
+                f"> スレッドプール(最大 {self.max_workers} スレッド)"
+                "による並行処理を実行"
+            )
+            pool = HealthCheckPool(
+                max_workers=self.max_workers, timeout=self.timeout
+            )
+            results = pool.run(self.target_hosts)
+            for result in results:
+                self._log_result(result)
+
+            logger.info(f">> 監視結果: {summarize_results(results)}")
+            logger.debug(
+                f"> 並行処理の実行時間: {time.time() - start:.2f} 秒"
+            )
+            return results
+
+        except Exception as e:
+            logger.error(
+                f"並行処理の実行時にエラー発生: {e}"
+            )
+            raise e
+
+    def run_asyncio(self, method="http", concurrency=1000):
+        '''
+        [概要]
+        asyncio(AsyncProber)を使って並行処理を実演するメソッド
+        method は "tcp" / "http" / "ping" のどれか
+        結果は CheckResult のリストで返す
+        '''
+        start = time.time()
+        try:
+            logger.debug(
+                f"> asyncio による並行処理を実行 "
+                f"(確認方法: {method}, 最大 {concurrency} 件を同時に確認)"
+            )
+            prober = AsyncProber(
+                method=method, concurrency=concurrency, timeout=self.timeout
+            )
+            results = prober.run_sync(self.target_hosts)
+            for result in results:
+                self._log_result(result)
+
+            logger.info(f">> 監視結果: {summarize_results(results)}")
+            logger.info(f">> 応答時間(ミリ秒): {latency_percentiles(results)}")
+            logger.debug(
+                f"> 並行処理の実行時間: {time.time() - start:.2f} 秒"
+            )
+            return results
+
+        except Exception as e:
+            logger.error(
+                f"並行処理の実行時にエラー発生: {e}"
+            )
+            raise e
+
+    def run_scheduled(self, method="http", interval=60.0, duration=None,
+                      concurrency=100):
+        '''
+        [概要]
+        MonitorScheduler を使って各サービスを interval 秒ごとに
+        確認し続けるメソッド
+        Ctrl + c で止めるか duration 秒経つまで終わらない
+        '''
+        prober = AsyncProber(method=method, timeout=self.timeout)
+        scheduler = MonitorScheduler(
+            prober, self.target_hosts, default_interval=interval,
+            concurrency=concurrency
+        )
+        try:
+            logger.debug(
+                f"> 継続監視を実行 (確認方法: {method}, 間隔: {interval} 秒)"
+            )
+            logger.info(">> 監視を停止する場合は Ctrl + c を押してください")
+            asyncio.run(scheduler.run(duration))
+
+        except KeyboardInterrupt:
+            logger.info(f">> 監視を停止しました: {scheduler.stats()}")
+
+        except Exception as e:
+            logger.error(
+                f"継続監視の実行時にエラー発生: {e}"
+            )
+            raise e
+
+        return scheduler
+
 
 if __name__ == "__main__":
     targets = [
@@ -171,7 +279,10 @@ if __name__ == "__main__":
     logger.debug(f"監視対象のWebサービス数: {len(targets)} 個")
 
     mode = pyip.inputMenu(
-        choices=["Sequentials", "Threading", "Multiprocessing"],
+        choices=[
+            "Sequentials", "Threading", "Multiprocessing", "Pooled",
+            "Asyncio", "Scheduled"
+        ],
         prompt="実行モードを選択してください:\n",
         numbered=True
     )
@@ -186,3 +297,12 @@ if __name__ == "__main__":
 
     elif mode == "Multiprocessing":
         monitor.run_multiprocessing()
+
+    elif mode == "Pooled":
+        monitor.run_pooled()
+
+    elif mode == "Asyncio":
+        monitor.run_asyncio()
+
+    elif mode == "Scheduled":
+        monitor.run_scheduled()